@@ -0,0 +1,165 @@
+-- Subset of the Cumulus PostgreSQL schema described by task/api_model.py, used by the benchmark harness.
+-- https://nasa.github.io/cumulus/docs/architecture/#postgresql-database-schema-diagram
+CREATE TABLE collections (
+    cumulus_id serial PRIMARY KEY,
+    name text NOT NULL,
+    version text NOT NULL,
+    sample_file_name text,
+    granule_id_validation_regex text,
+    granule_id_extraction_regex text,
+    files jsonb,
+    process text,
+    url_path text,
+    duplicate_handling text,
+    report_to_ems boolean,
+    ignore_files_config_for_discovery boolean,
+    meta jsonb,
+    tags jsonb,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (name, version)
+);
+
+CREATE TABLE providers (
+    cumulus_id serial PRIMARY KEY,
+    name text NOT NULL UNIQUE,
+    protocol text,
+    host text,
+    port integer,
+    username text,
+    password text,
+    global_connection_limit integer,
+    private_key text,
+    cm_key_id text,
+    certificate_uri text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    allowed_redirects text[],
+    max_download_time integer
+);
+
+CREATE TABLE async_operations (
+    cumulus_id bigserial PRIMARY KEY,
+    id uuid NOT NULL UNIQUE,
+    description text,
+    operation_type text,
+    output jsonb,
+    status text,
+    task_arn text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE executions (
+    cumulus_id bigserial PRIMARY KEY,
+    arn text NOT NULL UNIQUE,
+    async_operation_cumulus_id bigint REFERENCES async_operations (cumulus_id),
+    collection_cumulus_id integer REFERENCES collections (cumulus_id),
+    parent_cumulus_id bigint REFERENCES executions (cumulus_id),
+    cumulus_version text,
+    url text,
+    status text,
+    tasks jsonb,
+    error jsonb,
+    workflow_name text,
+    duration real,
+    original_payload jsonb,
+    final_payload jsonb,
+    timestamp timestamptz,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE pdrs (
+    cumulus_id serial PRIMARY KEY,
+    collection_cumulus_id integer NOT NULL REFERENCES collections (cumulus_id),
+    provider_cumulus_id integer NOT NULL REFERENCES providers (cumulus_id),
+    execution_cumulus_id bigint REFERENCES executions (cumulus_id),
+    status text,
+    name text NOT NULL UNIQUE,
+    progress real,
+    pan_sent boolean,
+    pan_message text,
+    stats jsonb,
+    address text,
+    original_url text,
+    duration real,
+    timestamp timestamptz,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE granules (
+    cumulus_id bigserial PRIMARY KEY,
+    granule_id text NOT NULL,
+    status text,
+    collection_cumulus_id integer NOT NULL REFERENCES collections (cumulus_id),
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    published boolean,
+    duration real,
+    time_to_archive real,
+    time_to_process real,
+    product_volume bigint,
+    error jsonb,
+    cmr_link text,
+    pdr_cumulus_id integer REFERENCES pdrs (cumulus_id),
+    provider_cumulus_id integer REFERENCES providers (cumulus_id),
+    beginning_date_time timestamptz,
+    ending_date_time timestamptz,
+    last_update_date_time timestamptz,
+    processing_end_date_time timestamptz,
+    processing_start_date_time timestamptz,
+    production_date_time timestamptz,
+    query_fields jsonb,
+    timestamp timestamptz,
+    UNIQUE (granule_id, collection_cumulus_id)
+);
+CREATE INDEX granules_collection_cumulus_id_index ON granules (collection_cumulus_id);
+CREATE INDEX granules_status_index ON granules (status);
+CREATE INDEX granules_updated_at_index ON granules (updated_at);
+
+CREATE TABLE files (
+    cumulus_id bigserial PRIMARY KEY,
+    granule_cumulus_id bigint NOT NULL REFERENCES granules (cumulus_id),
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    file_size bigint,
+    bucket text NOT NULL,
+    checksum_type text,
+    checksum_value text,
+    file_name text,
+    key text NOT NULL,
+    path text,
+    source text,
+    type text,
+    UNIQUE (bucket, key)
+);
+CREATE INDEX files_granule_cumulus_id_index ON files (granule_cumulus_id);
+
+CREATE TABLE granules_executions (
+    granule_cumulus_id bigint NOT NULL REFERENCES granules (cumulus_id),
+    execution_cumulus_id bigint NOT NULL REFERENCES executions (cumulus_id),
+    PRIMARY KEY (granule_cumulus_id, execution_cumulus_id)
+);
+CREATE INDEX granules_executions_execution_cumulus_id_index ON granules_executions (execution_cumulus_id);
+
+CREATE TABLE rules (
+    cumulus_id serial PRIMARY KEY,
+    name text NOT NULL UNIQUE,
+    workflow text NOT NULL,
+    collection_cumulus_id integer REFERENCES collections (cumulus_id),
+    provider_cumulus_id integer REFERENCES providers (cumulus_id),
+    type text NOT NULL,
+    enabled boolean NOT NULL,
+    value text,
+    arn text,
+    log_event_arn text,
+    execution_name_prefix text,
+    payload jsonb,
+    meta jsonb,
+    tags jsonb,
+    queue_url text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
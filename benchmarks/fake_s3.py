@@ -0,0 +1,103 @@
+"""
+In-process stand-in for the boto3 S3 client calls made by the lambda. Object bodies are kept in memory only when
+keep_bodies is set so large benchmark runs measure the lambda rather than the stand-in.
+"""
+import io
+import itertools
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+def not_found(operation):
+    return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, operation)
+
+
+def read_body(body):
+    return body.read() if hasattr(body, 'read') else bytes(body)
+
+
+class FakeS3Client:
+    def __init__(self, keep_bodies=False):
+        self.keep_bodies = keep_bodies
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.uploads = {}
+        # Upload ids are never reused, completed uploads are removed while others are still running
+        self.upload_ids = itertools.count(1)
+        self.stats = {'put_objects': 0, 'parts': 0, 'part_bytes': 0, 'part_seconds': 0.0, 'first_part_at': None}
+
+    def store(self, bucket, key, body, size):
+        with self.lock:
+            self.objects.update({(bucket, key): {'Body': body if self.keep_bodies else None, 'ContentLength': size}})
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        body = read_body(Body)
+        self.store(Bucket, Key, body, len(body))
+        with self.lock:
+            self.stats['put_objects'] += 1
+        return {'ETag': f'"{hash(body)}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        stored = self.objects.get((Bucket, Key))
+        if not stored:
+            raise not_found('GetObject')
+        return {'Body': io.BytesIO(stored.get('Body') or b''), 'ContentLength': stored.get('ContentLength')}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        stored = self.objects.get((Bucket, Key))
+        if not stored:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': stored.get('ContentLength')}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        with self.lock:
+            upload_id = str(next(self.upload_ids))
+            self.uploads.update({upload_id: {'Bucket': Bucket, 'Key': Key, 'Parts': {}}})
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        start = time.perf_counter()
+        body = read_body(Body)
+        with self.lock:
+            self.uploads.get(UploadId).get('Parts').update({
+                PartNumber: body if self.keep_bodies else len(body)
+            })
+            if self.stats['first_part_at'] is None:
+                self.stats['first_part_at'] = start
+            self.stats['parts'] += 1
+            self.stats['part_bytes'] += len(body)
+            self.stats['part_seconds'] += time.perf_counter() - start
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        parts = self.uploads.get(UploadId).get('Parts')
+        return {'Parts': [{'PartNumber': number, 'ETag': f'"{UploadId}-{number}"'} for number in sorted(parts)]}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self.lock:
+            upload = self.uploads.pop(UploadId)
+        numbers = [part.get('PartNumber') for part in MultipartUpload.get('Parts')]
+        if numbers != sorted(numbers):
+            raise ClientError({'Error': {'Code': 'InvalidPartOrder', 'Message': str(numbers)}}, 'CompleteMultipartUpload')
+        parts = [upload.get('Parts').get(number) for number in numbers]
+        if self.keep_bodies:
+            body = b''.join(parts)
+            self.store(Bucket, Key, body, len(body))
+        else:
+            self.store(Bucket, Key, None, sum(parts))
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_body(self, bucket, key):
+        return self.objects.get((bucket, key)).get('Body')
@@ -0,0 +1,109 @@
+"""
+Compares the planner cost of the SQL generated by each query strategy for common granule and execution query shapes
+against a database seeded by benchmarks.seed. --analyze also runs the queries and reports the execution time and the
+number of buffers touched.
+
+    BENCHMARK_DSN="dbname=cumulus_benchmark" python -m benchmarks.plan_cost_benchmark --granules 1000000 --analyze
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+
+import psycopg2
+from psycopg2 import sql
+
+from benchmarks.seed import seed
+from task.query_builders import QUERY_STRATEGIES, temp_query_selection
+
+PLAN_CASES = {
+    'granules_10': {'records': 'granules', 'limit': 10},
+    'granules_10_columns': {'records': 'granules', 'columns': 'granule_id, status, files', 'limit': 10},
+    'granules_10_status': {'records': 'granules', 'granules_where': "granules.status = 'failed'", 'limit': 10},
+    'granules_10_files_where': {'records': 'granules', 'files_where': "files.type = 'data'", 'limit': 10},
+    'granules_10_executions_where': {
+        'records': 'granules', 'executions_where': "executions.status = 'failed'", 'limit': 10
+    },
+    'granules_10_collection': {
+        'records': 'granules', 'collections_where': "collections.name = 'collection_3'", 'limit': 10
+    },
+    'granules_1000': {'records': 'granules', 'limit': 1000},
+    'executions_10': {'records': 'executions', 'limit': 10}
+}
+
+
+def explain(db_conn, query, analyze=False):
+    options = sql.SQL('ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON')
+    with db_conn.cursor() as curs:
+        curs.execute(sql.SQL('EXPLAIN ({}) {}').format(options, query))
+        plan = curs.fetchone()[0][0]
+    db_conn.rollback()
+    return plan
+
+
+def get_plan_result(db_conn, rds_config, strategy, analyze=False):
+    with contextlib.redirect_stdout(io.StringIO()):
+        query = temp_query_selection(**rds_config, strategy=strategy)
+    plan = explain(db_conn, query, analyze)
+    root = plan.get('Plan')
+    result = {
+        'total_cost': root.get('Total Cost'),
+        'plan_rows': root.get('Plan Rows'),
+        'sql_length': len(' '.join(query.as_string(db_conn).split()))
+    }
+    if analyze:
+        result.update({
+            'execution_ms': plan.get('Execution Time'),
+            'planning_ms': plan.get('Planning Time'),
+            'actual_rows': root.get('Actual Rows'),
+            'shared_blocks': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--granules', type=int, default=100000, help='Seeded scale, e.g. 100000, 1000000, 10000000')
+    parser.add_argument('--strategies', default=','.join(QUERY_STRATEGIES), help='Comma separated query strategies')
+    parser.add_argument('--analyze', action='store_true', help='Run the queries with EXPLAIN ANALYZE')
+    parser.add_argument('--output', help='File the JSON report is written to')
+    args = parser.parse_args()
+    strategies = [strategy.strip() for strategy in args.strategies.split(',')]
+
+    # Not used as a context manager, psycopg2 would wrap the VACUUM run by seed in a transaction block
+    db_conn = psycopg2.connect(os.getenv('BENCHMARK_DSN', ''))
+    try:
+        schema, _ = seed(db_conn, args.granules)
+        with db_conn.cursor() as curs:
+            curs.execute(sql.SQL('SET search_path TO {}').format(sql.Identifier(schema)))
+        db_conn.commit()
+
+        report = {'granules': args.granules, 'schema': schema, 'cases': {}}
+        print(f'{"case":<32}' + ''.join(f'{strategy + " cost":>18}' for strategy in strategies) + (
+            ''.join(f'{strategy + " ms":>16}' for strategy in strategies) if args.analyze else ''
+        ))
+        for name, rds_config in PLAN_CASES.items():
+            results = {}
+            for strategy in strategies:
+                try:
+                    results.update({strategy: get_plan_result(db_conn, rds_config, strategy, args.analyze)})
+                except psycopg2.Error as e:
+                    db_conn.rollback()
+                    results.update({strategy: {'error': str(e).splitlines()[0]}})
+            report.get('cases').update({name: results})
+
+            line = f'{name:<32}' + ''.join(f'{results.get(s).get("total_cost", "error"):>18}' for s in strategies)
+            if args.analyze:
+                line += ''.join(f'{results.get(s).get("execution_ms", "error"):>16}' for s in strategies)
+            print(line)
+    finally:
+        db_conn.close()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
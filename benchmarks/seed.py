@@ -0,0 +1,147 @@
+"""
+Creates the Cumulus tables of benchmarks/cumulus_schema.sql in a dedicated schema and fills them with synthetic rows.
+
+    BENCHMARK_DSN="dbname=cumulus_benchmark" python -m benchmarks.seed --granules 100000
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), 'cumulus_schema.sql')
+
+SEED_STATEMENTS = (
+    '''
+    INSERT INTO collections (name, version, sample_file_name, granule_id_validation_regex,
+                             granule_id_extraction_regex, files, process, url_path, duplicate_handling)
+    SELECT 'collection_' || n, '1', 'sample.nc', '^.*$', '(.*)\\.nc',
+           '[{"regex": "^.*\\\\.nc$", "bucket": "protected"}]'::jsonb, 'modis', 'data', 'replace'
+    FROM generate_series(1, %(collections)s) AS n
+    ''',
+    '''
+    INSERT INTO providers (name, protocol, host, port, global_connection_limit)
+    SELECT 'provider_' || n, 'https', 'provider' || n || '.example.com', 443, 10
+    FROM generate_series(1, %(providers)s) AS n
+    ''',
+    '''
+    INSERT INTO executions (arn, collection_cumulus_id, url, status, workflow_name, duration, timestamp)
+    SELECT 'arn:aws:states:us-west-2:000000000000:execution:IngestGranule:' || n,
+           1 + n %% %(collections)s,
+           'https://console.aws.amazon.com/states/home?region=us-west-2#/executions/details/' || n,
+           CASE WHEN n %% 10 = 0 THEN 'failed' ELSE 'completed' END,
+           'IngestGranule', 12.5, now() - n * interval '1 second'
+    FROM generate_series(1, %(granules)s) AS n
+    ''',
+    '''
+    INSERT INTO pdrs (collection_cumulus_id, provider_cumulus_id, status, name, progress, pan_sent, timestamp)
+    SELECT 1 + n %% %(collections)s, 1 + n %% %(providers)s, 'completed', 'pdr_' || n || '.PDR', 100, true, now()
+    FROM generate_series(1, greatest(%(granules)s / %(granules_per_pdr)s, 1)) AS n
+    ''',
+    '''
+    INSERT INTO granules (granule_id, status, collection_cumulus_id, published, duration, time_to_archive,
+                          time_to_process, product_volume, cmr_link, pdr_cumulus_id, provider_cumulus_id,
+                          beginning_date_time, ending_date_time, last_update_date_time, processing_end_date_time,
+                          processing_start_date_time, updated_at, error)
+    SELECT 'granule_' || lpad(n::text, 10, '0'),
+           CASE WHEN n %% 10 = 0 THEN 'failed' ELSE 'completed' END,
+           1 + n %% %(collections)s, n %% 2 = 0, 12.5, 3.25, 9.25, 1052672,
+           'https://cmr.earthdata.nasa.gov/search/granules.json?granule_ur=granule_' || n,
+           1 + n %% greatest(%(granules)s / %(granules_per_pdr)s, 1), 1 + n %% %(providers)s,
+           timestamptz '2020-01-01' + n * interval '1 minute', timestamptz '2020-01-01' + (n + 1) * interval '1 minute',
+           now(), now(), now(), now() - n * interval '1 second',
+           CASE WHEN n %% 10 = 0 THEN '{"Error": "FileNotFound", "Cause": "missing"}'::jsonb END
+    FROM generate_series(1, %(granules)s) AS n
+    ''',
+    '''
+    INSERT INTO files (granule_cumulus_id, file_size, bucket, checksum_type, checksum_value, file_name, key, path,
+                       source, type)
+    SELECT g, 1048576 * f, CASE WHEN f = 1 THEN 'protected' ELSE 'public' END, 'md5', md5(g || '_' || f),
+           'granule_' || g || '_' || f || '.nc', 'data/granule_' || g || '_' || f || '.nc', 'data',
+           'https://provider.example.com/granule_' || g || '_' || f || '.nc',
+           CASE WHEN f = 1 THEN 'data' ELSE 'metadata' END
+    FROM generate_series(1, %(granules)s) AS g, generate_series(1, %(files_per_granule)s) AS f
+    ''',
+    '''
+    INSERT INTO granules_executions (granule_cumulus_id, execution_cumulus_id)
+    SELECT n, n FROM generate_series(1, %(granules)s) AS n
+    ''',
+    '''
+    INSERT INTO rules (name, workflow, collection_cumulus_id, provider_cumulus_id, type, enabled)
+    SELECT 'rule_' || n, 'DiscoverGranules', n, 1 + n %% %(providers)s, 'scheduled', true
+    FROM generate_series(1, %(collections)s) AS n
+    '''
+)
+
+
+def get_schema_name(granules):
+    return f'cumulus_benchmark_{granules}'
+
+
+def schema_exists(db_conn, schema):
+    with db_conn.cursor() as curs:
+        curs.execute('SELECT 1 FROM information_schema.schemata WHERE schema_name = %s', (schema,))
+        return curs.fetchone() is not None
+
+
+def seed(db_conn, granules, files_per_granule=2, collections=20, providers=5, granules_per_pdr=1000, reuse=True):
+    """
+    Creates and fills the schema for the requested scale and returns its name and the seconds spent seeding. An
+    existing schema for the same scale is reused unless reuse is false.
+    """
+    schema = get_schema_name(granules)
+    start = time.perf_counter()
+    exists = schema_exists(db_conn, schema)
+    db_conn.rollback()
+    if reuse and exists:
+        return schema, 0.0
+
+    params = {
+        'granules': granules,
+        'files_per_granule': files_per_granule,
+        'collections': collections,
+        'providers': providers,
+        'granules_per_pdr': granules_per_pdr
+    }
+    with db_conn.cursor() as curs:
+        curs.execute(sql.SQL('DROP SCHEMA IF EXISTS {} CASCADE').format(sql.Identifier(schema)))
+        curs.execute(sql.SQL('CREATE SCHEMA {}').format(sql.Identifier(schema)))
+        curs.execute(sql.SQL('SET search_path TO {}').format(sql.Identifier(schema)))
+        with open(SCHEMA_FILE) as schema_file:
+            curs.execute(schema_file.read())
+        for statement in SEED_STATEMENTS:
+            curs.execute(statement, params)
+    db_conn.commit()
+
+    # Planner statistics are needed for realistic plans and the histogram split of parallel scans
+    autocommit = db_conn.autocommit
+    db_conn.autocommit = True
+    with db_conn.cursor() as curs:
+        curs.execute(sql.SQL('SET search_path TO {}').format(sql.Identifier(schema)))
+        curs.execute('VACUUM ANALYZE')
+    db_conn.autocommit = autocommit
+
+    return schema, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--granules', type=int, default=100000)
+    parser.add_argument('--files-per-granule', type=int, default=2)
+    parser.add_argument('--no-reuse', action='store_true', help='Recreate the schema even if it already exists')
+    args = parser.parse_args()
+
+    # Not used as a context manager, psycopg2 would wrap the VACUUM in a transaction block
+    db_conn = psycopg2.connect(os.getenv('BENCHMARK_DSN', ''))
+    try:
+        schema, seconds = seed(
+            db_conn, args.granules, files_per_granule=args.files_per_granule, reuse=not args.no_reuse
+        )
+    finally:
+        db_conn.close()
+    print(f'Seeded {schema} in {seconds:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
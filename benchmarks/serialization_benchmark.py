@@ -0,0 +1,104 @@
+"""
+Compares the per-row convert_tuple_to_json function with the batched JSONRowEncoder on synthetic granule rows.
+
+    python -m benchmarks.serialization_benchmark --rows 200000 --batch-size 10000
+"""
+import argparse
+import datetime
+import json
+import time
+from collections import namedtuple
+
+from task.serializers import JSONRowEncoder
+
+Column = namedtuple('Column', ['name', 'type_code'])
+
+GRANULE_DESCRIPTION = (
+    Column('cumulus_id', 20),
+    Column('granule_id', 25),
+    Column('status', 25),
+    Column('published', 16),
+    Column('created_at', 1184),
+    Column('updated_at', 1184),
+    Column('beginning_date_time', 1184),
+    Column('ending_date_time', 1184),
+    Column('product_volume', 20),
+    Column('duration', 701),
+    Column('cmr_link', 25),
+    Column('error', 3802),
+    Column('collection_id', 25),
+    Column('files', 114),
+)
+
+
+def convert_tuple_to_json(row, selected_columns):
+    # The per-row encoding the exports used before JSONRowEncoder, kept here as the baseline
+    record_dict = {}
+    for value, column in zip(row, selected_columns):
+        if isinstance(value, datetime.datetime):
+            value = str(value)
+        elif isinstance(value, bool):
+            value = json.dumps(value)
+        record_dict.update({column.name: value})
+    return json.dumps(record_dict)
+
+
+def generate_rows(row_count):
+    timestamp = datetime.datetime(2023, 9, 7, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+    rows = []
+    for cumulus_id in range(row_count):
+        granule_id = f'rssmif17d3d_{cumulus_id:010d}'
+        files = [
+            {'bucket': 'protected', 'key': f'{granule_id}.nc', 'file_size': 1048576, 'type': 'data'},
+            {'bucket': 'public', 'key': f'{granule_id}.cmr.xml', 'file_size': 4096, 'type': 'metadata'}
+        ]
+        rows.append((
+            cumulus_id, granule_id, 'completed', bool(cumulus_id % 2), timestamp, timestamp, timestamp, timestamp,
+            1052672, 12.5, f'https://cmr.earthdata.nasa.gov/search/granules.json?granule_ur={granule_id}', None,
+            'rssmif17d3d___7', files
+        ))
+    return rows
+
+
+def run_per_row(rows, description):
+    return ','.join(convert_tuple_to_json(row, description) for row in rows).encode()
+
+
+def run_batched(rows, description, batch_size):
+    encoder = JSONRowEncoder(description)
+    return encoder.separator.join(
+        encoder.encode_rows(rows[index:index + batch_size]) for index in range(0, len(rows), batch_size)
+    )
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    body = function(*args)
+    return time.perf_counter() - start, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    per_row_seconds, per_row_body = measure(run_per_row, rows, GRANULE_DESCRIPTION)
+    batched_seconds, batched_body = measure(run_batched, rows, GRANULE_DESCRIPTION, args.batch_size)
+
+    if json.loads(b'[' + per_row_body + b']') != json.loads(b'[' + batched_body + b']'):
+        raise RuntimeError('Batched encoder output does not match convert_tuple_to_json')
+
+    report = {
+        'rows': args.rows,
+        'batch_size': args.batch_size,
+        'convert_tuple_to_json_rows_per_second': round(args.rows / per_row_seconds),
+        'json_row_encoder_rows_per_second': round(args.rows / batched_seconds),
+        'speedup': round(per_row_seconds / batched_seconds, 2)
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
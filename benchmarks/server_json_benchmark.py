@@ -0,0 +1,76 @@
+"""
+Compares client CPU time per million rows between the Python JSONRowEncoder and server side JSON rendering
+(rds_config "server_json") for the same rds_config against a Postgres database holding the Cumulus schema.
+
+    BENCHMARK_DSN="dbname=cumulus user=postgres" python -m benchmarks.server_json_benchmark \\
+        --rds-config '{"records": "granules", "limit": 1000000}'
+"""
+import argparse
+import json
+import os
+import time
+
+import psycopg2
+
+from task.export import describe_query, split_rds_config
+from task.query_builders import build_server_json_query, temp_query_selection
+from task.serializers import JSONRowEncoder, PrerenderedJSONRowEncoder
+
+
+def export(db_conn, query, encoder_class, fetch_size):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    body = bytearray()
+    row_count = 0
+    with db_conn.cursor(name='benchmark-cursor') as curs:
+        curs.execute(query)
+        encoder = None
+        while True:
+            rows = curs.fetchmany(fetch_size)
+            if not rows:
+                break
+            encoder = encoder or encoder_class(curs.description)
+            body += encoder.separator if row_count else encoder.prefix
+            body += encoder.encode_rows(rows)
+            row_count += len(rows)
+    db_conn.rollback()
+    body += b']' if row_count else b'[]'
+
+    return {
+        'rows': row_count,
+        'bytes': len(body),
+        'wall_seconds': time.perf_counter() - wall_start,
+        'cpu_seconds': time.process_time() - cpu_start
+    }, bytes(body)
+
+
+def per_million(seconds, rows):
+    return round(seconds * 1000000 / rows, 3) if rows else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rds-config', default='{"records": "granules", "limit": 100000}')
+    parser.add_argument('--fetch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    query_config, _ = split_rds_config(json.loads(args.rds_config))
+    query = temp_query_selection(**query_config)
+    with psycopg2.connect(os.getenv('BENCHMARK_DSN', '')) as db_conn:
+        python_stats, python_body = export(db_conn, query, JSONRowEncoder, args.fetch_size)
+        server_query = build_server_json_query(query, describe_query(db_conn, query))
+        server_stats, server_body = export(db_conn, server_query, PrerenderedJSONRowEncoder, args.fetch_size)
+
+    report = {'rds_config': json.loads(args.rds_config), 'byte_identical': python_body == server_body,
+              'json_equal': json.loads(python_body) == json.loads(server_body)}
+    for name, stats in (('python', python_stats), ('server_json', server_stats)):
+        report.update({name: {
+            **stats,
+            'cpu_seconds_per_million_rows': per_million(stats.get('cpu_seconds'), stats.get('rows')),
+            'wall_seconds_per_million_rows': per_million(stats.get('wall_seconds'), stats.get('rows'))
+        }})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Runs task.main.main end to end against a local Postgres seeded by benchmarks.seed and an in-process S3 stand-in. Every
+query shape is exported with every upload handler configuration in a fresh process so peak RSS is per case. The report
+is written as JSON and can be compared with an earlier report to catch regressions.
+
+    BENCHMARK_DSN="dbname=cumulus_benchmark" python -m benchmarks.throughput_benchmark --granules 100000 \\
+        --output report.json --compare baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+from psycopg2 import extensions
+
+from benchmarks.seed import seed
+
+QUERY_SHAPES = {
+    'granules_all': {'records': 'granules'},
+    'granules_columns': {'records': 'granules', 'columns': 'granule_id, status, updated_at, cmr_link'},
+    'granules_filtered': {'records': 'granules', 'granules_where': "granules.status = 'failed'"},
+    'granules_files_filter': {'records': 'granules', 'files_where': "files.type = 'data'"},
+    'executions': {'records': 'executions'},
+    'files': {'records': 'files'}
+}
+
+UPLOAD_HANDLERS = {
+    'json': {},
+    'ndjson': {'format': 'ndjson'},
+    'csv': {'format': 'csv'},
+    'server_json': {'server_json': True},
+    'copy_csv': {'export': 'copy', 'format': 'csv'},
+    'copy_ndjson': {'export': 'copy', 'format': 'ndjson'},
+    'gzip': {'compression': 'gzip'},
+    'zstd': {'compression': 'zstd'},
+    'parquet': {'format': 'parquet'}
+}
+
+# Results compared between reports, higher is better for all of them
+COMPARED_METRICS = ('rows_per_sec', 'mb_per_sec')
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(dsn, schema, shape, handler, limit, event_options):
+    """
+    Runs a single export in the calling process. Meant to be the only work done by a freshly spawned process.
+    """
+    start = time.perf_counter()
+    os.environ.update({'BUCKET_NAME': 'benchmark', 'S3_KEY_PREFIX': 'benchmark/'})
+    from benchmarks.fake_s3 import FakeS3Client
+    from task.connection_manager import connection_manager
+    from task.main import main
+    import_seconds = time.perf_counter() - start
+
+    s3_client = FakeS3Client()
+    connection_manager.db_params_provider = lambda: {
+        **extensions.parse_dsn(dsn), 'options': f'-c search_path={schema}'
+    }
+    connection_manager._clients.update({('s3', ()): s3_client})
+
+    start = time.perf_counter()
+    with connection_manager.connection():
+        pass
+    connect_seconds = time.perf_counter() - start
+
+    event = {
+        **event_options,
+        'rds_config': {**QUERY_SHAPES.get(shape), **UPLOAD_HANDLERS.get(handler), 'limit': limit}
+    }
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = main(event, None)
+    seconds = time.perf_counter() - start
+    if 'exception' in result:
+        raise RuntimeError(f'{shape}/{handler} failed: {result.get("stack_trace")}')
+
+    stats = s3_client.stats
+    first_part_at = stats.get('first_part_at')
+    raw_bytes = result.get('raw_bytes') or 0
+    rows = result.get('count')
+    return {
+        'case': f'{shape}/{handler}',
+        'shape': shape,
+        'handler': handler,
+        'rows': rows,
+        'raw_bytes': raw_bytes,
+        'stored_bytes': result.get('compressed_bytes') or raw_bytes,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else 0,
+        'mb_per_sec': raw_bytes / seconds / 1e6 if seconds else 0,
+        'peak_rss_mb': get_peak_rss_mb(),
+        'parts': stats.get('parts'),
+        'phases': {
+            'import': import_seconds,
+            'connect': connect_seconds,
+            'first_part': first_part_at - start if first_part_at else None,
+            'part_uploads': stats.get('part_seconds'),
+            'main': seconds
+        },
+        'handler_metrics': result.get('metrics')
+    }
+
+
+def run_isolated(*args):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def run_benchmarks(dsn, schema, shapes, handlers, limit, event_options, repeat=1):
+    results = []
+    for shape in shapes:
+        for handler in handlers:
+            runs = [run_isolated(dsn, schema, shape, handler, limit, event_options) for _ in range(repeat)]
+            result = min(runs, key=lambda run: run.get('seconds'))
+            print(
+                f'{result.get("case"):<36} {result.get("rows"):>10} rows {result.get("rows_per_sec"):>12,.0f} rows/s '
+                f'{result.get("mb_per_sec"):>8.1f} MB/s {result.get("peak_rss_mb"):>8.1f} MB RSS'
+            )
+            results.append(result)
+
+    return results
+
+
+def compare_reports(report, baseline, threshold):
+    """
+    Returns the cases whose throughput dropped by more than threshold (a fraction) compared with baseline.
+    """
+    baseline_results = {result.get('case'): result for result in baseline.get('results')}
+    regressions = []
+    for result in report.get('results'):
+        previous = baseline_results.get(result.get('case'))
+        if not previous:
+            continue
+        for metric in COMPARED_METRICS:
+            if previous.get(metric) and result.get(metric) < previous.get(metric) * (1 - threshold):
+                regressions.append({
+                    'case': result.get('case'),
+                    'metric': metric,
+                    'baseline': previous.get(metric),
+                    'current': result.get(metric),
+                    'change': result.get(metric) / previous.get(metric) - 1
+                })
+
+    return regressions
+
+
+def get_server_version(db_conn):
+    with db_conn.cursor() as curs:
+        curs.execute('SHOW server_version')
+        return curs.fetchone()[0]
+
+
+def parse_names(value, choices):
+    names = [name.strip() for name in value.split(',')] if value else list(choices)
+    unknown = set(names) - set(choices)
+    if unknown:
+        raise SystemExit(f'Unknown names {", ".join(sorted(unknown))}, expected: {", ".join(choices)}')
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--granules', type=int, default=100000, help='Seeded scale, e.g. 100000, 1000000, 10000000')
+    parser.add_argument('--files-per-granule', type=int, default=2)
+    parser.add_argument('--shapes', help=f'Comma separated query shapes: {", ".join(QUERY_SHAPES)}')
+    parser.add_argument('--handlers', help=f'Comma separated upload handlers: {", ".join(UPLOAD_HANDLERS)}')
+    parser.add_argument('--limit', type=int, help='Query limit. Defaults to every seeded row.')
+    parser.add_argument('--size', type=int, default=10000, help='Rows fetched from the cursor at a time')
+    parser.add_argument('--part-size', type=int, default=20971520)
+    parser.add_argument('--upload-workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the fastest run is reported')
+    parser.add_argument('--output', help='File the JSON report is written to')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed throughput drop when comparing')
+    args = parser.parse_args()
+
+    shapes = parse_names(args.shapes, QUERY_SHAPES)
+    handlers = parse_names(args.handlers, UPLOAD_HANDLERS)
+    dsn = os.getenv('BENCHMARK_DSN', '')
+
+    # Not used as a context manager, psycopg2 would wrap the VACUUM run by seed in a transaction block
+    db_conn = psycopg2.connect(dsn)
+    try:
+        schema, seed_seconds = seed(db_conn, args.granules, files_per_granule=args.files_per_granule)
+        server_version = get_server_version(db_conn)
+    finally:
+        db_conn.close()
+    print(f'Using {schema} (seeded in {seed_seconds:.1f}s)')
+
+    event_options = {'size': args.size, 'part_size': args.part_size, 'upload_workers': args.upload_workers}
+    limit = args.limit if args.limit is not None else args.granules * max(args.files_per_granule, 1)
+    report = {
+        'granules': args.granules,
+        'files_per_granule': args.files_per_granule,
+        'schema': schema,
+        'seed_seconds': seed_seconds,
+        'limit': limit,
+        'event': event_options,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'postgres': server_version
+        },
+        'results': run_benchmarks(dsn, schema, shapes, handlers, limit, event_options, args.repeat)
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(
+                f'REGRESSION {regression.get("case")} {regression.get("metric")}: {regression.get("baseline"):,.1f} '
+                f'-> {regression.get("current"):,.1f} ({regression.get("change"):+.1%})'
+            )
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,183 +1,5 @@
-
-
-async_operations_db_columns = (
-    'async_operation_id',
-    'cumulus_id',
-    'id',
-    'description',
-    'operation_type',
-    'output',
-    'status',
-    'task_arn',
-    'created_at',
-    'updated_at'
-)
-async_dict = {
-    'table': 'async_operations',
-    'columns': async_operations_db_columns
-}
-
-collections_db_columns = (
-    'collection_id',
-    'name',
-    'version',
-    'sample_file_name',
-    'granule_id_validation_regex',
-    'granule_id_extraction_regex',
-    'files',
-    'process',
-    'url_path',
-    'duplicate_handling',
-    'report_to_ems',
-    'ignore_files_config_for_discovery',
-    'meta',
-    'tags',
-    'created_at',
-    'updated_at'
-)
-collections_dict = {
-    'table': 'collections',
-    'columns': collections_db_columns
-}
-
-executions_db_columns = (
-    'execution',
-    'cumulus_id',
-    'arn',
-    'async_operation_cumulus_id',
-    'collection_cumulus_id',
-    'parent_cumulus_id',
-    'cumulus_version',
-    'url',
-    'status',
-    'tasks',
-    'error',
-    'workflow_name',
-    'duration',
-    'original_payload'
-)
-executions_dict = {
-    'table': 'executions',
-    'columns': executions_db_columns
-}
-
-files_db_columns = (
-    'files',
-    'cumulus_id',
-    'granule_cumulus_id',
-    'created_at',
-    'updated_at',
-    'file_size',
-    'bucket',
-    'checksum_type',
-    'checksum_value',
-    'file_name',
-    'key',
-    'path',
-    'source',
-    'type'
-)
-files_dict = {
-    'table': 'files',
-    'columns': files_db_columns
-}
-
-granules_db_columns = (
-    # 'granules.cumulus_id',
-    'granule_id',
-    'status',
-    'files',
-    # 'granules.collection_cumulus_id',
-    'created_at',
-    'updated_at',
-    'published',
-    'duration',
-    'time_to_archive',
-    'time_to_process',
-    'product_volume',
-    'error',
-    'cmr_link',
-    # 'granules.pdr_cumulus_id',
-    # 'granules.provider_cumulus_id',
-    'beginning_date_time',
-    'ending_date_time',
-    'last_update_date_time',
-    'processing_end_date_time',
-    'processing_start_date_time',
-    'collection_id'
-)
-granules_dict = {
-    'table': 'granules',
-    'columns': granules_db_columns
-}
-
-pdrs_db_columns = (
-    # 'cumulus_id',
-    # 'collection_cumulus_id',
-    # 'provider_cumulus_id',
-    # 'execution_cumulus_id',
-    'status',
-    'name',
-    'progress',
-    'pan_sent',
-    'pan_message',
-    'stats',
-    'address',
-    'original_url',
-    'duration',
-    'timestamp',
-    'created_at',
-    'updated_at'
-)
-pdrs_dict = {
-    'table': 'pdrs',
-    'columns': pdrs_db_columns
-}
-
-providers_db_columns = (
-    # 'cumulus_id',
-    'id',
-    'name',
-    'protocol',
-    'host',
-    'port',
-    'username',
-    'password',
-    'global_connection_limit',
-    'private_key',
-    'cm_key_id',
-    'certificate_uri',
-    'created_at',
-    'updated_at',
-    'allowed_redirects',
-    'max_download_time'
-)
-providers_dict = {
-    'table': 'providers',
-    'columns': providers_db_columns
-}
-
-rules_db_columns = (
-    # 'cumulus_id',
-    'name',
-    'workflow',
-    # 'collection_cumulus_id',
-    # 'provider_cumulus_id',
-    'type',
-    'enabled',
-    'value',
-    'arn',
-    'log_event_arn',
-    'execution_name_prefix',
-    'payload',
-    'meta',
-    'tags',
-    'queue_url'
-)
-rules_dict = {
-    'table': 'rules',
-    'columns': rules_db_columns
-}
+import datetime
+import re
 
 granule_model_fields = (
     'beginningDateTime',
@@ -206,62 +28,81 @@ granule_model_fields = (
     'updatedAt'
 )
 
-db_dict = {
-    'granules': granules_db_columns,
-    'collections': collections_db_columns,
-    'providers': providers_db_columns,
-    'pdrs': pdrs_db_columns,
-    'files': files_db_columns,
-    'executions': executions_db_columns,
+# Cumulus API fields whose column name is not the snake case form of the field name
+FIELD_COLUMN_EXCEPTIONS = {
+    'timeToPreprocess': 'time_to_process'
+}
+CAMEL_CASE_BOUNDARY = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+# Both directions are worked out once so converting a name is a single dict lookup
+GRANULE_FIELD_COLUMNS = {
+    field: FIELD_COLUMN_EXCEPTIONS.get(field, CAMEL_CASE_BOUNDARY.sub('_', field).lower())
+    for field in granule_model_fields
+}
+GRANULE_COLUMN_FIELDS = {column: field for field, column in GRANULE_FIELD_COLUMNS.items()}
+
+# Fields of the Cumulus API file records in the API's order and the files columns they are read from
+API_FILE_FIELD_COLUMNS = {
+    'bucket': 'bucket', 'checksum': 'checksum_value', 'checksumType': 'checksum_type', 'fileName': 'file_name',
+    'key': 'key', 'size': 'file_size', 'source': 'source', 'type': 'type'
 }
+# The API returns these dates as epoch milliseconds and the other dates as ISO 8601 strings in UTC
+API_EPOCH_COLUMNS = ('created_at', 'updated_at', 'timestamp')
+API_ISO_COLUMNS = (
+    'beginning_date_time', 'ending_date_time', 'last_update_date_time', 'processing_end_date_time',
+    'processing_start_date_time', 'production_date_time'
+)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MILLISECOND = datetime.timedelta(milliseconds=1)
+
+
+def as_utc(value):
+    # Columns without a time zone hold UTC times
+    return value.replace(tzinfo=datetime.timezone.utc) if value.tzinfo is None else value
+
+
+def convert_epoch_milliseconds(value):
+    return (as_utc(value) - EPOCH) // MILLISECOND
+
+
+def convert_iso_timestamp(value):
+    # Same as JavaScript's Date.toISOString, which the API uses
+    value = as_utc(value).astimezone(datetime.timezone.utc)
+    return f'{value:%Y-%m-%dT%H:%M:%S}.{value.microsecond // 1000:03d}Z'
+
+
+def convert_api_files(files):
+    # Like the API, the files only have the API fields and leave out the ones without a value
+    return [
+        {field: file.get(column) for field, column in API_FILE_FIELD_COLUMNS.items() if file.get(column) is not None}
+        for file in files
+    ]
+
+
+# Values of the granule columns converted to the types the Cumulus API returns. product_volume is a bigint the API
+# returns as a string and published stays a boolean.
+GRANULE_COLUMN_CONVERTERS = {
+    **{column: convert_epoch_milliseconds for column in API_EPOCH_COLUMNS},
+    **{column: convert_iso_timestamp for column in API_ISO_COLUMNS},
+    'files': convert_api_files,
+    'product_volume': str,
+    'published': None
+}
+
+# Quoted literals and quoted identifiers are matched as whole tokens so their contents are never renamed
+WHERE_TOKEN_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[A-Za-z_][A-Za-z0-9_]*")
 
 def api_field_names_to_db_column_names(field_names):
-    db_column_names = []
-    for field_name in field_names:
-        db_column_names.append(api_field_name_to_db_column(field_name))
-    
-    return db_column_names
+    return [api_field_name_to_db_column(field_name) for field_name in field_names]
 
 def api_field_name_to_db_column(field_name):
-    db_column_name = ''
-    if field_name in granule_model_fields:
-        for character in field_name:
-            new_character = character
-            if character.isupper():
-                new_character = f'_{character.lower()}'
-            db_column_name = f'{db_column_name}{new_character}'
-    
-    print(f'{field_name} -> {db_column_name}')
-
-    return db_column_name
+    return GRANULE_FIELD_COLUMNS.get(field_name, '')
 
 def db_column_names_to_api_keys(column_names):
-    api_keys = []
-    for column_name in column_names:
-        new_str = db_column_names_to_api_keys(column_name)
-        api_keys.append(new_str)
-    
-    return api_keys
+    return [db_column_name_to_api_field_name(column_name) for column_name in column_names]
 
 def db_column_name_to_api_field_name(db_column_name):
-    new_str = ''
-    capitalize_character = False
-    for character in db_column_name:
-        new_character = character
-        if new_character == '_':
-            capitalize_character = True
-            continue
-        elif capitalize_character:
-            new_character = new_character.upper()
-            capitalize_character = False
-        else: # Case handled by new_character=character
-            pass
-        new_str = f'{new_str}{new_character}'
-    
-    if new_str not in granule_model_fields:
-        new_str = ''
-
-    return new_str
+    return GRANULE_COLUMN_FIELDS.get(db_column_name, '')
 
 
 def test_column_api():
@@ -273,22 +114,8 @@ def test_column_api():
     print(keys)
 
 def parse_where_clause(where):
-    parsed_query = ''
-    query_term = ''
-    for character in where:
-        if character.isalnum():
-            query_term = f'{query_term}{character}'
-        else:
-            db_column_name = api_field_name_to_db_column(query_term)
-            if db_column_name:
-                query_term = db_column_name
-
-            parsed_query = f'{parsed_query}{query_term}{character}'
-            query_term = ''
-
-    parsed_query = f'{parsed_query}{query_term}'
-
-    return parsed_query
+    # Replaces the Cumulus API field names in where with their column names in a single pass over the clause
+    return WHERE_TOKEN_PATTERN.sub(lambda match: GRANULE_FIELD_COLUMNS.get(match.group(0), match.group(0)), where)
 
 def test_parse_where_clause():
     query = 'SELECT * where granules.granuleId LIKE someValue AND collectionId=anotherValue'
@@ -296,4 +123,4 @@ def test_parse_where_clause():
     print(parsed_query)
 
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    pass
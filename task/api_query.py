@@ -0,0 +1,120 @@
+from task.api_model import GRANULE_FIELD_COLUMNS, parse_where_clause
+
+# Cumulus API query parameters that are not field filters
+API_PARAMETERS = ('fields', 'limit', 'page', 'prefix', 'infix', 'sort_by', 'sort_key', 'order')
+# Filter suffixes of the Cumulus API, field__<operator>=value
+API_OPERATORS = ('from', 'to', 'in', 'not', 'exists')
+# Cumulus API dates are epoch milliseconds
+API_DATE_FIELDS = frozenset({
+    'beginningDateTime', 'createdAt', 'endingDateTime', 'lastUpdateDateTime', 'processingEndDateTime',
+    'processingStartDateTime', 'productionDateTime', 'timestamp', 'updatedAt'
+})
+# Fields read from a related table are filtered in that table's where clause, the rest are granule columns
+API_RELATED_FIELDS = {
+    'collectionId': ('collections_where', '(collections.name, collections.version)'),
+    'provider': ('providers_where', 'providers.name'),
+    'pdrName': ('pdrs_where', 'pdrs.name'),
+    'execution': ('executions_where', 'executions.url')
+}
+GRANULE_WHERE_KEYS = (
+    'granules_where', 'collections_where', 'providers_where', 'pdrs_where', 'files_where', 'executions_where'
+)
+
+
+def quote_literal(value):
+    # Standard conforming string literal, only quotes need escaping
+    if '\x00' in value:
+        raise ValueError('Filter values cannot contain NUL characters')
+    return "'" + value.replace("'", "''") + "'"
+
+
+def get_value_sql(field, value):
+    if field == 'collectionId':
+        name, _, version = str(value).rpartition('___')
+        return f'({quote_literal(name)}, {quote_literal(version)})'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if field in API_DATE_FIELDS and (isinstance(value, (int, float)) or str(value).isdigit()):
+        return f'to_timestamp({float(value) / 1000})'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return quote_literal(str(value))
+
+
+def get_values(value):
+    # Lists are sent as comma separated strings in API query strings
+    return value if isinstance(value, (list, tuple)) else str(value).split(',')
+
+
+def get_filter_sql(field, operator, value):
+    column = API_RELATED_FIELDS.get(field, (None, f'granules.{GRANULE_FIELD_COLUMNS.get(field)}'))[1]
+    if operator == 'from':
+        return f'{column} >= {get_value_sql(field, value)}'
+    if operator == 'to':
+        return f'{column} <= {get_value_sql(field, value)}'
+    if operator == 'in':
+        return f'{column} IN ({", ".join(get_value_sql(field, item) for item in get_values(value))})'
+    if operator == 'not':
+        return f'{column} IS DISTINCT FROM {get_value_sql(field, value)}'
+    if operator == 'exists':
+        exists = value if isinstance(value, bool) else str(value).lower() == 'true'
+        return f'{column} IS {"NOT " if exists else ""}NULL'
+    return f'{column} = {get_value_sql(field, value)}'
+
+
+def get_like_pattern(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def build_api_query_config(query_config):
+    """
+    Converts the Cumulus API /granules query parameters in query_config['api'] into the granule query config of the
+    planner. Filters are field=value or field__<operator>=value with the from, to, in, not and exists operators,
+    fields selects the returned fields, prefix and infix match the granuleId and limit works as in the API. Any
+    <table>_where clauses given alongside can use the API field names.
+    """
+    api_query = dict(query_config.get('api'))
+    records = query_config.get('records', 'granules')
+    if records != 'granules':
+        raise ValueError('Cumulus API queries support the granules records')
+    if api_query.get('sort_by') or api_query.get('sort_key') or api_query.get('order'):
+        raise ValueError('Cumulus API queries do not support sorting')
+    if int(api_query.get('page', 1)) != 1:
+        raise ValueError('Cumulus API queries only support the first page, use limit or a resumable export instead')
+
+    filters = {}
+    for where_key in GRANULE_WHERE_KEYS:
+        if query_config.get(where_key):
+            filters.setdefault(where_key, []).append(f'({parse_where_clause(query_config.get(where_key))})')
+
+    for parameter, value in api_query.items():
+        if parameter in API_PARAMETERS:
+            continue
+        field, _, operator = parameter.partition('__')
+        if field not in GRANULE_FIELD_COLUMNS or field == 'files':
+            raise ValueError(f'Unsupported Cumulus API filter field "{field}"')
+        if operator and operator not in API_OPERATORS:
+            raise ValueError(f'Unsupported filter "{parameter}", expected one of: {", ".join(API_OPERATORS)}')
+        where_key = API_RELATED_FIELDS.get(field, ('granules_where',))[0]
+        filters.setdefault(where_key, []).append(get_filter_sql(field, operator, value))
+
+    for parameter, pattern in (('prefix', '{}%'), ('infix', '%{}%')):
+        if api_query.get(parameter):
+            like = quote_literal(pattern.format(get_like_pattern(str(api_query.get(parameter)))))
+            filters.setdefault('granules_where', []).append(f'granules.granule_id LIKE {like}')
+
+    fields = get_values(api_query.get('fields')) if api_query.get('fields') else GRANULE_FIELD_COLUMNS
+    unknown_fields = [field.strip() for field in fields if field.strip() not in GRANULE_FIELD_COLUMNS]
+    if unknown_fields:
+        raise ValueError(f'Unsupported Cumulus API fields: {", ".join(unknown_fields)}')
+
+    api_query_config = {
+        key: value for key, value in query_config.items() if key != 'api' and key not in GRANULE_WHERE_KEYS
+    }
+    api_query_config.update({
+        'records': 'granules',
+        'columns': ', '.join(GRANULE_FIELD_COLUMNS.get(field.strip()) for field in fields),
+        'limit': int(api_query.get('limit', query_config.get('limit', 10))),
+        **{where_key: ' AND '.join(clauses) for where_key, clauses in filters.items()}
+    })
+    return api_query_config
@@ -0,0 +1,54 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd output is only available when zstandard is packaged with the lambda
+    zstandard = None
+
+
+class GzipCompressor:
+    content_encoding = 'gzip'
+    suffix = '.gz'
+    default_level = 6
+
+    def __init__(self, level=None):
+        level = self.default_level if level is None else level
+        # wbits of 31 writes a gzip header and trailer instead of a raw zlib stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class ZstdCompressor:
+    content_encoding = 'zstd'
+    suffix = '.zst'
+    default_level = 3
+
+    def __init__(self, level=None):
+        if not zstandard:
+            raise ValueError('zstd compression requires the zstandard package')
+        level = self.default_level if level is None else level
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+COMPRESSORS = {
+    'gzip': GzipCompressor,
+    'zstd': ZstdCompressor
+}
+
+
+def get_compressor_class(compression):
+    compressor_class = COMPRESSORS.get(compression)
+    if not compressor_class:
+        raise ValueError(f'Unsupported compression "{compression}", expected one of: {", ".join(COMPRESSORS)}')
+    return compressor_class
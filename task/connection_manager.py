@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import boto3
+import psycopg2
+from psycopg2 import extensions
+
+from task.metrics import metrics
+
+
+class ManagedConnection(extensions.connection):
+    # The base connection type does not allow extra attributes, the manager records when it was last used
+    last_used = 0
+    # Names of the statements prepared on the connection, see prepared_statements.py
+    prepared_statements = None
+
+
+class ConnectionManager:
+    """
+    Keeps the database credentials, database connections and boto3 clients alive across warm lambda invocations.
+    Credentials are cached for secrets_ttl seconds and idle connections are health checked before being handed out
+    again. Connections that fail are discarded and rebuilt on the next request.
+    """
+    def __init__(self, secrets_ttl=300, max_connections=4, health_check_interval=30):
+        self.secrets_ttl = secrets_ttl
+        self.max_connections = max_connections
+        self.health_check_interval = health_check_interval
+        self.db_params_provider = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._db_params = None
+        self._db_params_expiry = 0
+        self._idle_connections = []
+        self._clients = {}
+
+    def get_db_params(self, refresh=False):
+        with self._lock:
+            if refresh or not self._db_params or time.monotonic() >= self._db_params_expiry:
+                provider = self.db_params_provider or fetch_db_params
+                with metrics.timer('secrets'):
+                    self._db_params = provider()
+                self._db_params_expiry = time.monotonic() + self.secrets_ttl
+            return dict(self._db_params)
+
+    def get_client(self, service_name, **kwargs):
+        # boto3 clients are thread safe so a single client per service is shared by every caller
+        client_key = (service_name, tuple(sorted(kwargs.items())))
+        with self._lock:
+            client = self._clients.get(client_key)
+            if not client:
+                client = boto3.client(service_name, **kwargs)
+                self._clients.update({client_key: client})
+        return client
+
+    def get_s3_client(self):
+        return self.get_client('s3')
+
+    def connect(self):
+        with metrics.timer('connect'):
+            return self.open_connection()
+
+    def open_connection(self):
+        try:
+            db_conn = psycopg2.connect(**self.get_db_params(), connection_factory=ManagedConnection)
+        except psycopg2.OperationalError as e:
+            # The secret may have been rotated since it was cached so try once more with fresh credentials
+            print(f'Connection failed, refreshing credentials: {e}')
+            db_conn = psycopg2.connect(**self.get_db_params(refresh=True), connection_factory=ManagedConnection)
+        db_conn.last_used = time.monotonic()
+        return db_conn
+
+    def is_healthy(self, db_conn):
+        if db_conn.closed or db_conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+
+        if time.monotonic() - db_conn.last_used >= self.health_check_interval:
+            try:
+                with db_conn.cursor() as curs:
+                    curs.execute('SELECT 1')
+                db_conn.rollback()
+            except psycopg2.Error as e:
+                print(f'Discarding unhealthy connection: {e}')
+                return False
+
+        return True
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    db_conn = self._idle_connections.pop() if self._idle_connections else None
+                if not db_conn:
+                    return self.connect()
+                if self.is_healthy(db_conn):
+                    return db_conn
+                close_quietly(db_conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, db_conn, discard=False):
+        try:
+            if not discard and not db_conn.closed:
+                try:
+                    db_conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+            if discard or db_conn.closed:
+                close_quietly(db_conn)
+            else:
+                db_conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle_connections.append(db_conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        db_conn = self.acquire()
+        try:
+            yield db_conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.release(db_conn, discard=True)
+            raise
+        except Exception:
+            self.release(db_conn)
+            raise
+        else:
+            self.release(db_conn)
+
+    def reset(self):
+        with self._lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = []
+            self._db_params = None
+            self._db_params_expiry = 0
+            self._clients.clear()
+
+        for db_conn in idle_connections:
+            close_quietly(db_conn)
+
+
+def close_quietly(db_conn):
+    try:
+        db_conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def fetch_db_params():
+    sm = connection_manager.get_client('secretsmanager', region_name='us-west-2')
+    secrets_arn = os.getenv('CUMULUS_CREDENTIALS_ARN', None)
+    secrets = json.loads(sm.get_secret_value(SecretId=secrets_arn).get('SecretString'))
+
+    query_timeout_offset = 1000
+    statement_timeout_ms = int(os.getenv("QUERY_TIMEOUT")) * 1000 - query_timeout_offset
+    db_params = {
+        'sslmode': 'disable', # Will revisit when/if SSL becomes required
+        'options': f'-c statement_timeout={statement_timeout_ms}'
+    }
+    for key in secrets.keys():
+        if key in ('username', 'user', 'password', 'database', 'host', 'port'):
+            new_key = key
+            if key == 'username':
+                new_key = 'user'
+            db_params.update({new_key: secrets.get(key)})
+
+    return db_params
+
+
+connection_manager = ConnectionManager(
+    secrets_ttl=int(os.getenv('DB_SECRETS_TTL', 300)),
+    max_connections=int(os.getenv('DB_MAX_CONNECTIONS', 4)),
+    health_check_interval=int(os.getenv('DB_HEALTH_CHECK_INTERVAL', 30))
+)
+
+
+def get_db_params():
+    return connection_manager.get_db_params()
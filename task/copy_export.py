@@ -0,0 +1,94 @@
+from psycopg2 import sql
+from psycopg2.errors import QueryCanceled
+
+from task.deadline import deadline
+from task.metrics import metrics
+from task.query_builders import build_json_rows_query
+
+COPY_FORMATS = ('csv', 'ndjson')
+
+
+# psycopg2 writes COPY output one row at a time so rows are gathered into chunks of this size first
+COPY_CHUNK_SIZE = 1048576
+
+
+class CopyStreamAdapter:
+    """
+    File-like object handed to cursor.copy_expert. The raw COPY output is written straight into the upload handler so
+    the rows are never decoded into Python tuples.
+    """
+    def __init__(self, upload_handler, chunk_size=COPY_CHUNK_SIZE):
+        self.upload_handler = upload_handler
+        self.chunk_size = chunk_size
+        self.chunk = bytearray()
+        self.bytes_written = 0
+        # libpq hands over COPY output one whole row at a time, so the writes count the rows of an unfinished COPY
+        self.writes = 0
+
+    def write(self, data):
+        if not self.bytes_written:
+            metrics.mark('first_row')
+        self.chunk += data
+        self.bytes_written += len(data)
+        self.writes += 1
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.chunk:
+            self.upload_handler.write_stream(self.chunk)
+            self.chunk = bytearray()
+
+
+def build_copy_query(query, copy_format, description=None):
+    if copy_format == 'csv':
+        copy_query = sql.SQL('COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)').format(query)
+    elif copy_format == 'ndjson':
+        # Each row is a single JSON text value without raw newlines. CSV mode with delimiter and quote characters that
+        # JSON never contains unescaped leaves the values untouched, unlike text mode which escapes backslashes.
+        copy_query = sql.SQL(
+            "COPY ({}) TO STDOUT WITH (FORMAT csv, DELIMITER E'\\x01', QUOTE E'\\x02')"
+        ).format(build_json_rows_query(query, description, normalize_json=True))
+    else:
+        raise ValueError(f'Unsupported COPY format "{copy_format}", expected one of: {", ".join(COPY_FORMATS)}')
+
+    return copy_query
+
+
+def get_copy_rowcount(curs):
+    rowcount = curs.rowcount
+    if rowcount is None or rowcount < 0:
+        # The command status of a finished COPY is "COPY <rows>"
+        rowcount = int(curs.statusmessage.split()[-1])
+    return rowcount
+
+
+def run_copy_export(db_conn, query, upload_handler, copy_format, description=None):
+    """
+    Streams the COPY output of query into upload_handler. Returns the COPY query, the number of rows and whether the
+    export was truncated. COPY cannot stop between rows, so when the statement_timeout set for the deadline cancels it
+    the rows written so far are kept and the export is truncated.
+    """
+    adapter = CopyStreamAdapter(upload_handler)
+    truncated = False
+    with db_conn.cursor() as curs:
+        copy_query = build_copy_query(query, copy_format, description)
+        deadline.set_statement_timeout(db_conn)
+        with metrics.timer('copy'):
+            try:
+                curs.copy_expert(copy_query, adapter)
+            except QueryCanceled as e:
+                if not deadline.cancelled(e):
+                    raise
+                truncated = True
+            adapter.flush()
+        if truncated:
+            # The csv header is the first write
+            rowcount = max(adapter.writes - (copy_format == 'csv'), 0)
+            print(f'Deadline reached, stopped the COPY after {rowcount} rows')
+        else:
+            rowcount = get_copy_rowcount(curs)
+        metrics.increment('rows', rowcount)
+
+    return copy_query, rowcount, truncated
@@ -0,0 +1,55 @@
+import time
+
+from psycopg2.errors import QueryCanceled
+
+# Seconds kept back for flushing the buffered rows, completing the upload and returning the response
+DEFAULT_DEADLINE_MARGIN = 30
+
+
+class Deadline:
+    """
+    The time left in the invocation, taken from context.get_remaining_time_in_millis() when it starts so the time
+    spent on the secrets, connecting and the placeholder upload is accounted for. Without a lambda context there is no
+    deadline and queries run until the statement_timeout of the connection.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, context=None, margin=DEFAULT_DEADLINE_MARGIN):
+        self.expires = None
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            self.expires = time.monotonic() + context.get_remaining_time_in_millis() / 1000
+        self.margin = margin
+
+    def remaining(self):
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    def has_time(self, seconds=0, margin=None):
+        # True if more than the margin is left after spending seconds
+        remaining = self.remaining()
+        return remaining is None or remaining > (self.margin if margin is None else margin) + seconds
+
+    def get_statement_timeout_ms(self):
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        # A statement_timeout of 0 disables the timeout so a query started without time left is cancelled at once
+        return max(int((remaining - self.margin) * 1000), 1)
+
+    def set_statement_timeout(self, db_conn):
+        # SET LOCAL only lasts until the end of the transaction so pooled connections keep their own statement_timeout
+        timeout_ms = self.get_statement_timeout_ms()
+        if timeout_ms is not None:
+            with db_conn.cursor() as curs:
+                curs.execute('SET LOCAL statement_timeout = %s', (timeout_ms,))
+
+    def cancelled(self, error):
+        # A query cancelled within a second of the margin was stopped by the statement_timeout set above
+        return isinstance(error, QueryCanceled) and not self.has_time(1)
+
+
+def get_deadline_margin(event):
+    return float(event.get('deadline_margin', DEFAULT_DEADLINE_MARGIN))
+
+
+deadline = Deadline()
@@ -0,0 +1,294 @@
+import os
+import time
+
+from psycopg2.errors import QueryCanceled
+
+from task.compression import get_compressor_class
+from task.connection_manager import connection_manager
+from task.copy_export import COPY_FORMATS, run_copy_export
+from task.deadline import deadline
+from task.fetch_sizing import FetchSizer
+from task.metrics import metrics
+from task.query_builders import build_describe_query, build_server_json_query
+from task.query_planner import plan_normalized_queries
+from task.api_model import GRANULE_COLUMN_CONVERTERS, GRANULE_COLUMN_FIELDS
+from task.serializers import get_renamed_encoder_class, get_row_encoder_class
+from task.upload_handlers import (
+    MPUHandler, ParquetUploadHandler, ShardedUploadHandler, UploadHandler, get_sibling_key
+)
+
+# rds_config keys that change how the query is run and stored rather than what it selects
+EXPORT_OPTION_KEYS = (
+    'server_json', 'format', 'export', 'compression', 'compression_level', 'row_group_size', 'parallel',
+    'cache_max_age', 'cache_bypass', 'mode', 'resumable', 'api_keys', 'shard', 'normalized',
+    'incremental'
+)
+EXPORT_ENGINES = ('cursor', 'copy')
+DEFAULT_SHARD_BYTES = 268435456  # 256MB of serialized rows per shard
+
+def split_rds_config(rds_config):
+    query_config = {}
+    export_options = {}
+    for key, value in rds_config.items():
+        if key in EXPORT_OPTION_KEYS:
+            export_options.update({key: value})
+        else:
+            query_config.update({key: value})
+
+    return query_config, export_options
+
+def get_export_encoder_class(export_options):
+    export_engine = export_options.get('export', 'cursor')
+    if export_engine not in EXPORT_ENGINES:
+        raise ValueError(f'Unsupported export "{export_engine}", expected one of: {", ".join(EXPORT_ENGINES)}')
+
+    output_format = export_options.get('format', 'json')
+    if export_engine == 'copy' and output_format not in COPY_FORMATS:
+        raise ValueError(f'COPY exports support the formats: {", ".join(COPY_FORMATS)}')
+
+    # COPY renders the rows itself so server_json only changes the cursor export
+    prerendered = bool(export_options.get('server_json')) and export_engine == 'cursor'
+    if export_options.get('api_keys'):
+        if export_engine != 'cursor' or prerendered or output_format == 'parquet':
+            raise ValueError('Cumulus API field names are only supported by the cursor export of json, ndjson and csv')
+        return get_renamed_encoder_class(
+            get_row_encoder_class(output_format), GRANULE_COLUMN_FIELDS, GRANULE_COLUMN_CONVERTERS
+        )
+
+    if output_format == 'parquet':
+        if export_engine != 'cursor' or prerendered:
+            raise ValueError('Parquet output is only supported by the cursor export without server_json')
+        return None
+
+    return get_row_encoder_class(output_format, prerendered=prerendered)
+
+def get_shard_options(export_options):
+    shard = export_options.get('shard')
+    if not shard:
+        return None
+    if export_options.get('export', 'cursor') != 'cursor':
+        raise ValueError('Sharded output is only supported by the cursor export')
+    if export_options.get('parallel') or export_options.get('resumable'):
+        raise ValueError('Sharded output cannot be combined with parallel or resumable exports')
+
+    if not isinstance(shard, dict):
+        shard = {}
+    return {
+        'max_rows': shard.get('rows'),
+        'max_bytes': shard.get('bytes', None if shard.get('rows') else DEFAULT_SHARD_BYTES),
+        'key_column': shard.get('key_column')
+    }
+
+def create_upload_handler(handler_args, upload_options, encoder_class, export_options):
+    shard_options = get_shard_options(export_options)
+    if shard_options:
+        def create_shard_handler(key):
+            shard_args = {**handler_args, 'key': key}
+            return create_upload_handler(shard_args, upload_options, encoder_class, {**export_options, 'shard': None})
+
+        return ShardedUploadHandler(**handler_args, create_handler=create_shard_handler, **shard_options)
+
+    if export_options.get('format') == 'parquet':
+        upload_handler = ParquetUploadHandler(
+            **handler_args, **upload_options, row_group_size=export_options.get('row_group_size', 100000)
+        )
+    else:
+        upload_handler = MPUHandler(**handler_args, **upload_options)
+        upload_handler.encoder_class = encoder_class
+
+    return upload_handler
+
+def describe_query(db_conn, query):
+    with metrics.timer('describe'), db_conn.cursor() as curs:
+        curs.execute(build_describe_query(query))
+        return curs.description
+
+def format_query(query, context):
+    return '\r'.join(query.as_string(context).replace('\n', '\r').split('\r'))
+
+def get_upload_options(event, export_options):
+    upload_options = {}
+    for key in ('part_size', 'upload_workers', 'max_inflight_parts', 'max_inflight_bytes'):
+        if key in event:
+            upload_options.update({key: event.get(key)})
+    for key in ('compression', 'compression_level'):
+        if key in export_options:
+            upload_options.update({key: export_options.get(key)})
+
+    return upload_options
+
+def get_results_key(encoder_class, export_options):
+    extension = encoder_class.extension if encoder_class else ParquetUploadHandler.extension
+    key = f'{os.getenv("S3_KEY_PREFIX")}query_results_{time.time_ns()}.{extension}'
+    # Parquet compresses its column chunks internally so the object itself is not compressed
+    if export_options.get('compression') and encoder_class:
+        key = f'{key}{get_compressor_class(export_options.get("compression")).suffix}'
+    return key
+
+def run_cursor_export(db_conn, query, upload_handler, fetch_options):
+    """
+    Streams the rows of query into upload_handler. Returns the query, the number of rows and whether the export was
+    truncated because the invocation is about to run out of time. No further batch is fetched once the deadline margin
+    plus the time of the last batch would be used up, and the statement_timeout of every fetch ends at the margin, so
+    the rows already fetched can still be flushed and the upload completed.
+    """
+    fetch_sizer = FetchSizer(**{
+        **fetch_options, 'adaptive': fetch_options.get('adaptive') and upload_handler.serializes_batches
+    })
+    rowcount = 0
+    truncated = False
+    with db_conn.cursor(name='rds-cursor') as curs:
+        curs.itersize = fetch_sizer.size
+        # print(format_query(query, curs))  # Uncomment when troubleshooting queries
+        # print(curs.mogrify(query, vars))
+        try:
+            # Declaring the cursor parses and plans the query, the rows are only produced by the fetches
+            deadline.set_statement_timeout(db_conn)
+            with metrics.timer('plan'):
+                curs.execute(query=query)
+
+            # The first batch waits for the query to start producing rows so it is timed separately from the rest
+            fetch_phase = 'first_row'
+            batch_seconds = 0
+            while deadline.has_time(batch_seconds):
+                start = time.perf_counter()
+                deadline.set_statement_timeout(db_conn)
+                with metrics.timer(fetch_phase):
+                    rows = curs.fetchmany(fetch_sizer.size)
+                fetch_phase = 'fetch'
+                if not rows:
+                    break
+                metrics.mark('first_row')
+                metrics.increment('rows', len(rows))
+                raw_bytes = upload_handler.raw_bytes
+                upload_handler.handle_rows(rows, curs.description)
+                curs.itersize = fetch_sizer.observe(len(rows), upload_handler.raw_bytes - raw_bytes)
+                rowcount += len(rows)
+                batch_seconds = time.perf_counter() - start
+            else:
+                truncated = True
+        except QueryCanceled as e:
+            if not deadline.cancelled(e):
+                raise
+            truncated = True
+
+    if truncated:
+        print(f'Deadline reached, stopped the export after {rowcount} rows')
+    return query, rowcount, truncated
+
+def run_export(db_conn, query, upload_handler, export_options, fetch_options):
+    if export_options.get('export') == 'copy':
+        copy_format = export_options.get('format')
+        description = describe_query(db_conn, query) if copy_format == 'ndjson' else None
+        query, rowcount, truncated = run_copy_export(db_conn, query, upload_handler, copy_format, description)
+    else:
+        if export_options.get('server_json'):
+            query = build_server_json_query(query, describe_query(db_conn, query))
+        query, rowcount, truncated = run_cursor_export(db_conn, query, upload_handler, fetch_options)
+
+    return query, rowcount, truncated
+
+def complete_upload(upload_handler):
+    with metrics.timer('complete'):
+        upload_handler.complete_upload()
+    metrics.increment('bytes_serialized', upload_handler.raw_bytes)
+    metrics.increment('bytes_stored', upload_handler.stored_bytes)
+
+def run_upload(db_conn, query, upload_handler, export_options, fetch_options):
+    # A failed export aborts the multipart upload rather than leaving its parts behind in the bucket
+    try:
+        query, rowcount, truncated = run_export(db_conn, query, upload_handler, export_options, fetch_options)
+        complete_upload(upload_handler)
+    except Exception:
+        upload_handler.abort_upload()
+        raise
+
+    return query, rowcount, truncated
+
+def get_upload_stats(upload_handler):
+    return {
+        'raw_bytes': upload_handler.raw_bytes,
+        'compressed_bytes': upload_handler.stored_bytes if upload_handler.compressor else None
+    }
+
+def get_truncated_args(truncated):
+    # Only results cut short by the deadline have the truncated flag, an export's count is the number of rows stored
+    return {'truncated': True} if truncated else {}
+
+def get_output_args(handler_args, upload_handler):
+    # Sharded output is found through its manifest
+    if isinstance(upload_handler, ShardedUploadHandler):
+        return {**handler_args, 'key': upload_handler.manifest_key, 'shard_count': len(upload_handler.shards)}
+    return handler_args
+
+def build_stream_queries(query_config, export_options):
+    if query_config.get('records') != 'granules' or query_config.get('strategy', 'planner') != 'planner':
+        raise ValueError('Normalized exports support the granules records with the planner strategy')
+    if export_options.get('parallel') or export_options.get('api_keys'):
+        raise ValueError('Normalized exports cannot be combined with parallel exports or Cumulus API queries')
+
+    normalized = export_options.get('normalized')
+    tables = normalized.get('tables') if isinstance(normalized, dict) else None
+    if isinstance(tables, str):
+        tables = [table.strip() for table in tables.split(',')]
+    stream_config = {key: value for key, value in query_config.items() if key not in ('records', 'strategy')}
+    return plan_normalized_queries(tables, **stream_config)
+
+def export_query(query, handler_args, upload_options, encoder_class, export_options, fetch_options):
+    # Placeholder so the results key exists while the query runs. Sharded output only has a key once the manifest is
+    # written.
+    if encoder_class and not export_options.get('shard'):
+        placeholder = UploadHandler(**handler_args, compression=upload_options.get('compression'))
+        placeholder.encoder_class = encoder_class
+        placeholder.complete_upload()
+
+    with connection_manager.connection() as db_conn, db_conn:
+        upload_handler = create_upload_handler(handler_args, upload_options, encoder_class, export_options)
+        query, rowcount, truncated = run_upload(db_conn, query, upload_handler, export_options, fetch_options)
+
+        return {
+            **get_output_args(handler_args, upload_handler),
+            'query': format_query(query, db_conn),
+            'count': rowcount,
+            **get_upload_stats(upload_handler),
+            **get_truncated_args(truncated)
+        }
+
+def export_streams(stream_queries, handler_args, upload_options, encoder_class, export_options, fetch_options):
+    """
+    Exports the granules and each to-many relation of a normalized export to sibling objects named
+    <key>_<table>.<format>, one query after the other. They run in a single repeatable read transaction so every
+    stream sees the same granules. The response key and count are those of the granules. Once a stream is truncated by
+    the deadline the remaining streams are left out.
+    """
+    streams = []
+    truncated = False
+    with connection_manager.connection() as db_conn, db_conn:
+        with db_conn.cursor() as curs:
+            curs.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        for table, query in stream_queries:
+            stream_args = {**handler_args, 'key': get_sibling_key(handler_args.get('key'), f'_{table}')}
+            upload_handler = create_upload_handler(stream_args, upload_options, encoder_class, export_options)
+            with metrics.timer(f'stream_{table}'):
+                query, rowcount, truncated = run_upload(
+                    db_conn, query, upload_handler, export_options, fetch_options
+                )
+            streams.append({
+                'table': table,
+                **get_output_args(stream_args, upload_handler),
+                'query': format_query(query, db_conn),
+                'count': rowcount,
+                **get_upload_stats(upload_handler),
+                **get_truncated_args(truncated)
+            })
+            if truncated:
+                break
+
+    granules = streams[0]
+    return {
+        'bucket': granules.get('bucket'),
+        'key': granules.get('key'),
+        'count': granules.get('count'),
+        'streams': streams,
+        **get_truncated_args(truncated)
+    }
@@ -0,0 +1,58 @@
+import os
+
+from task.metrics import metrics
+
+# Rows in the first batch when fetch sizing is adaptive, enough to measure the row width without holding a large batch
+INITIAL_FETCH_SIZE = 1000
+# Rows in every batch when fetch sizing is not adaptive
+DEFAULT_FETCH_SIZE = 10000
+MIN_FETCH_SIZE = 100
+MAX_FETCH_SIZE = 100000
+DEFAULT_TARGET_BYTES = 8388608  # 8MB of serialized rows per batch
+# Fetched rows take about 2 to 3 times their serialized size as Python objects and the serialized batch is held too
+ROW_MEMORY_FACTOR = 4
+# Share of the function memory a fetched batch may use, the rest is left for the runtime and the upload buffers
+BATCH_MEMORY_SHARE = 0.25
+
+
+def get_fetch_options(event):
+    return {
+        'size': event.get('size'),
+        'adaptive': bool(event.get('adaptive_fetch', True)),
+        'target_bytes': event.get('fetch_target_bytes', DEFAULT_TARGET_BYTES)
+    }
+
+
+def get_memory_budget():
+    # Largest serialized batch that keeps the fetched rows within their share of the Lambda memory
+    memory_size = os.getenv('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if not memory_size:
+        return None
+    return int(int(memory_size) * 1048576 * BATCH_MEMORY_SHARE / ROW_MEMORY_FACTOR)
+
+
+class FetchSizer:
+    """
+    Chooses the number of rows fetched from the server side cursor. After each batch the serialized bytes per row are
+    averaged with the earlier batches and the next batch is sized to hold target_bytes, so wide granule rows with large
+    files arrays are fetched a few thousand at a time and narrow rows tens of thousands at a time.
+    """
+    def __init__(self, size=None, adaptive=True, target_bytes=DEFAULT_TARGET_BYTES):
+        self.size = size or (INITIAL_FETCH_SIZE if adaptive else DEFAULT_FETCH_SIZE)
+        self.adaptive = adaptive
+        memory_budget = get_memory_budget()
+        self.target_bytes = min(target_bytes, memory_budget) if memory_budget else target_bytes
+        self.bytes_per_row = None
+        if adaptive:
+            metrics.record('fetch_target_bytes', self.target_bytes)
+
+    def observe(self, rows, byte_count):
+        metrics.record('fetch_size', self.size)
+        if not self.adaptive or not rows or byte_count <= 0:
+            return self.size
+
+        row_bytes = byte_count / rows
+        self.bytes_per_row = row_bytes if self.bytes_per_row is None else (self.bytes_per_row + row_bytes) / 2
+        metrics.record('bytes_per_row', self.bytes_per_row)
+        self.size = max(MIN_FETCH_SIZE, min(MAX_FETCH_SIZE, int(self.target_bytes / self.bytes_per_row)))
+        return self.size
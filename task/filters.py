@@ -0,0 +1,96 @@
+from psycopg2 import sql
+
+from task.api_query import GRANULE_WHERE_KEYS
+from task.schema_catalog import get_schema_catalog
+
+# Operators of the filters option and the number of values each takes, None takes a list of one or more values
+FILTER_OPERATORS = {
+    '=': 1, '!=': 1, '<': 1, '<=': 1, '>': 1, '>=': 1, 'like': 1, 'ilike': 1, 'between': 2,
+    'in': None, 'not in': None, 'is null': 0, 'is not null': 0
+}
+# Tables granule queries can filter, each through its <table>_where option
+GRANULE_FILTER_TABLES = tuple(where_key[:-len('_where')] for where_key in GRANULE_WHERE_KEYS)
+
+
+def as_sql(where):
+    # where options hold SQL text or a filter compiled from the filters option
+    return where if isinstance(where, sql.Composable) else sql.SQL(where)
+
+
+def and_where(where, where_filter):
+    if not where:
+        return where_filter
+    if isinstance(where, str) and isinstance(where_filter, str):
+        return f'({where}) AND {where_filter}'
+    return sql.SQL('({}) AND {}').format(as_sql(where), as_sql(where_filter))
+
+
+def get_filter_column(records, column):
+    table, _, name = str(column).rpartition('.')
+    table = table or records
+    tables = GRANULE_FILTER_TABLES if records == 'granules' else (records,)
+    if table not in tables:
+        raise ValueError(f'Filters of {records} queries support the tables: {", ".join(tables)}')
+    if not get_schema_catalog().has_column(table, name):
+        raise ValueError(f'Unknown filter column "{table}.{name}"')
+    return table, name
+
+
+def get_filter_values(condition, operator):
+    value_count = FILTER_OPERATORS.get(operator)
+    values = condition.get('values', [condition.get('value')] if 'value' in condition else [])
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    if (value_count is None and not values) or (value_count is not None and len(values) != value_count):
+        expected = 'one or more' if value_count is None else value_count
+        raise ValueError(f'The "{operator}" filter operator takes {expected} values: {condition}')
+    if any(value is None for value in values):
+        raise ValueError(f'Filter values cannot be null, use the "is null" operator instead: {condition}')
+    return values
+
+
+def compile_filter(records, condition):
+    """
+    Compiles a {"column": ..., "operator": ..., "value": ...} condition. Unqualified columns belong to the records
+    table. Returns the filtered table and the condition with the column as an identifier and the values as literals.
+    """
+    operator = str(condition.get('operator', '=')).lower()
+    if operator not in FILTER_OPERATORS:
+        raise ValueError(f'Unsupported filter operator "{operator}", expected one of: {", ".join(FILTER_OPERATORS)}')
+    table, column = get_filter_column(records, condition.get('column'))
+    literals = [sql.Literal(value) for value in get_filter_values(condition, operator)]
+
+    if operator in ('in', 'not in'):
+        operand = sql.SQL('({})').format(sql.SQL(', ').join(literals))
+    elif operator == 'between':
+        operand = sql.SQL('{} AND {}').format(*literals)
+    else:
+        operand = literals[0] if literals else sql.SQL('')
+    return table, sql.SQL('{} {} {}').format(sql.Identifier(table, column), sql.SQL(operator.upper()), operand)
+
+
+def apply_filters(query_config):
+    """
+    Moves the conditions of the filters option into the where options of the query, <table>_where for granule
+    queries and where for the other records. The values stay sql.Literal objects so prepared statements can bind them
+    as parameters.
+    """
+    filters = query_config.get('filters')
+    query_config = {key: value for key, value in query_config.items() if key != 'filters'}
+    if not filters:
+        return query_config
+
+    records = query_config.get('records')
+    if records == 'granules' and query_config.get('strategy', 'planner') != 'planner':
+        raise ValueError('Granule filters are only supported by the planner strategy')
+
+    table_filters = {}
+    for condition in filters if isinstance(filters, list) else [filters]:
+        table, condition_sql = compile_filter(records, condition)
+        table_filters.setdefault(table, []).append(condition_sql)
+
+    for table, conditions in table_filters.items():
+        where_key = f'{table}_where' if records == 'granules' else 'where'
+        query_config.update({where_key: and_where(query_config.get(where_key), sql.SQL(' AND ').join(conditions))})
+
+    return query_config
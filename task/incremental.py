@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from psycopg2 import sql
+
+from task.api_query import quote_literal
+from task.connection_manager import connection_manager
+from task.deadline import deadline
+from task.metrics import metrics
+from task.parallel_scan import PARALLEL_SCAN_TABLES
+from task.query_builders import add_records_filter, get_limit_sql, temp_query_selection
+from task.query_modes import get_limit
+from task.s3_json import get_json_object, put_json_object
+
+# rds_config keys that do not change which rows an export holds or how they are stored, so they share a watermark
+WATERMARK_IGNORED_KEYS = ('limit', 'strategy', 'cache_max_age', 'cache_bypass', 'incremental')
+WATERMARK_NAME_PATTERN = re.compile(r'[A-Za-z0-9_.-]+')
+
+
+def get_incremental_options(export_options):
+    incremental = export_options.get('incremental')
+    return incremental if isinstance(incremental, dict) else {}
+
+
+def get_watermark_name(query_config, export_options):
+    name = get_incremental_options(export_options).get('name')
+    if name:
+        if not WATERMARK_NAME_PATTERN.fullmatch(name):
+            raise ValueError(f'Watermark names can only contain letters, digits, "_", "-" and ".": {name}')
+        return name
+
+    # The same rds_config with different whitespace or key order shares its watermark
+    config = {
+        key: ' '.join(value.split()) if isinstance(value, str) else value
+        for key, value in {**query_config, **export_options}.items() if key not in WATERMARK_IGNORED_KEYS
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_watermark_location(name):
+    return os.getenv('BUCKET_NAME'), f'{os.getenv("S3_KEY_PREFIX")}watermarks/{name}.json'
+
+
+def get_row_key_sql(watermark):
+    return f'({quote_literal(watermark.get("updated_at"))}, {int(watermark.get("cumulus_id"))})'
+
+
+def get_watermark_filter(records, lower=None, upper=None):
+    """
+    Rows changed after lower up to and including upper. Rows are compared on (updated_at, cumulus_id) so rows sharing
+    an updated_at value are not skipped, and the plain updated_at bounds let the updated_at index be used.
+    """
+    row_key = f'({records}.updated_at, {records}.cumulus_id)'
+    filters = []
+    if lower:
+        filters.append(f'{records}.updated_at >= {quote_literal(lower.get("updated_at"))}')
+        filters.append(f'{row_key} > {get_row_key_sql(lower)}')
+    if upper:
+        filters.append(f'{records}.updated_at <= {quote_literal(upper.get("updated_at"))}')
+        filters.append(f'{row_key} <= {get_row_key_sql(upper)}')
+    return ' AND '.join(filters) if filters else 'true'
+
+
+def get_upper_bound(db_conn, query_config, lower):
+    """
+    Returns the (updated_at, cumulus_id) of the last row the export will hold. Taking the limit in updated_at order
+    means the rows left out by the limit are exported by the next run.
+    """
+    records = query_config.get('records')
+    bound_config = {
+        **query_config, 'columns': f'{records}.updated_at, {records}.cumulus_id', 'limit': -1, 'strategy': 'planner'
+    }
+    bound_config = add_records_filter(records, bound_config, get_watermark_filter(records, lower))
+    query = sql.SQL(
+        '''
+        SELECT updated_at, cumulus_id FROM (
+            SELECT updated_at, cumulus_id FROM ({}) AS changed_rows
+            ORDER BY updated_at, cumulus_id
+            {}
+        ) AS exported_rows
+        ORDER BY updated_at DESC, cumulus_id DESC
+        LIMIT 1
+        '''
+    ).format(temp_query_selection(**bound_config), get_limit_sql(get_limit(query_config)))
+    deadline.set_statement_timeout(db_conn)
+    with db_conn.cursor() as curs:
+        curs.execute(query)
+        row = curs.fetchone()
+
+    return {'updated_at': row[0].isoformat(), 'cumulus_id': row[1]} if row else None
+
+
+def start_incremental_export(query_config, export_options):
+    """
+    Limits query_config to the rows changed since the watermark stored by the last successful export of the same
+    rds_config. Returns the limited query_config and the watermark to store with advance_watermark once the results
+    are complete.
+    """
+    records = query_config.get('records')
+    if records not in PARALLEL_SCAN_TABLES:
+        raise ValueError(f'Incremental exports support the records: {", ".join(PARALLEL_SCAN_TABLES)}')
+    if export_options.get('parallel'):
+        raise ValueError('Incremental exports cannot be combined with parallel exports')
+
+    name = get_watermark_name(query_config, export_options)
+    location = get_watermark_location(name)
+    lower = None if get_incremental_options(export_options).get('reset') else get_json_object(*location)
+    with metrics.timer('watermark'), connection_manager.connection() as db_conn, db_conn:
+        upper = get_upper_bound(db_conn, query_config, lower)
+
+    # Without changed rows an empty result is stored and the watermark stays where it is
+    changed_filter = get_watermark_filter(records, lower, upper) if upper else 'false'
+    watermark = {'name': name, 'location': location, 'lower': lower, 'upper': upper}
+    return add_records_filter(records, query_config, changed_filter), watermark
+
+
+def get_row_key(watermark):
+    return {'updated_at': watermark.get('updated_at'), 'cumulus_id': watermark.get('cumulus_id')} if watermark else None
+
+
+def advance_watermark(watermark, handler_args):
+    # Only called once the results are stored so a failed export is retried from the same watermark
+    upper = watermark.get('upper')
+    if upper:
+        state = {**upper, 'key': handler_args.get('key'), 'count': handler_args.get('count'), 'exported_at': time.time()}
+        put_json_object(*watermark.get('location'), state)
+
+    return {
+        'name': watermark.get('name'),
+        'from': get_row_key(watermark.get('lower')),
+        'to': get_row_key(upper or watermark.get('lower'))
+    }
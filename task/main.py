@@ -1,372 +1,150 @@
-import datetime
-import json
 import os
-import time
-from abc import ABC
 import traceback
-from task.query_builders import build_query_case_1, build_query_case_2
-from task.api_model import *
-
-import boto3
-import psycopg2
-from psycopg2 import sql
-
-def get_db_params():
-    sm = boto3.client(service_name='secretsmanager', region_name='us-west-2')
-    secrets_arn = os.getenv('CUMULUS_CREDENTIALS_ARN', None)
-    secrets = json.loads(sm.get_secret_value(SecretId=secrets_arn).get('SecretString'))
-
-    query_timeout_offset = 1000
-    statement_timeout_ms = int(os.getenv("QUERY_TIMEOUT")) * 1000 - query_timeout_offset
-    db_params = {
-        'sslmode': 'disable', # Will revisit when/if SSL becomes required
-        'options': f'-c statement_timeout={statement_timeout_ms}'
-    }
-    for key in secrets.keys():
-        if key in ('username', 'user', 'password', 'database', 'host', 'port'):
-            new_key = key
-            if key == 'username':
-                new_key = 'user'
-            db_params.update({new_key: secrets.get(key)})
-
-    return db_params
-
-
-class UploadHandlerBase(ABC):
-    def handle_row(self, row, selected_columns):
-        raise NotImplementedError
-
-    def complete_upload(self):
-        raise NotImplementedError
-
-
-class MPUHandler(UploadHandlerBase):
-    def __init__(self, bucket, key):
-        self.s3_parts = []
-        self.s3_client = boto3.client('s3')
-        s3_dict = {'Bucket': bucket, 'Key': key}
-        mpu_dict = self.s3_client.create_multipart_upload(**s3_dict)
-        s3_dict.update({'UploadId': mpu_dict.get('UploadId')})
-        self.s3_mpu_dict = s3_dict
-        self.s3_part_size = 20971520  # 20MBit
-        self.rows = []
-
-    def handle_row(self, row, column_description):
-        self.rows.append(convert_tuple_to_json(row, column_description))
-        column_count = len(self.rows) * len(column_description)
-        if column_count >= 360000:
-            self.upload_part(f'{",".join(self.rows)}')
-            self.rows.clear()
-
-    def upload_part(self, body_string):
-        if not self.s3_parts:
-            body_string = f'[{body_string}'
+from concurrent.futures import ThreadPoolExecutor
+
+from task.api_query import build_api_query_config
+from task.connection_manager import connection_manager
+from task.deadline import deadline, get_deadline_margin
+from task.export import (
+    build_stream_queries, export_query, export_streams, get_export_encoder_class, get_results_key,
+    get_truncated_args, get_upload_options, split_rds_config
+)
+from task.fetch_sizing import get_fetch_options
+from task.filters import apply_filters
+from task.incremental import advance_watermark, start_incremental_export
+from task.metrics import metrics, report_metrics
+from task.parallel_scan import run_parallel_scan
+from task.query_builders import temp_query_selection
+from task.query_modes import get_query_mode, run_query_mode
+from task.resumable import run_resumable_export
+from task.schema_catalog import retry_schema_introspection
+from task.result_cache import get_cache_key, get_cache_max_age, get_cached_result, put_cached_result
+
+def run_query(event, context, rds_config):
+    handler_args = {}
+    try:
+        query_config, export_options = split_rds_config(rds_config)
+        if query_config.get('api'):
+            # Cumulus API /granules parameters are converted to a granule query with camelCase record keys
+            query_config = build_api_query_config(query_config)
+            export_options = {**export_options, 'api_keys': True}
+        mode = get_query_mode(export_options)
+        if mode != 'export':
+            # Counts and estimates are returned directly without creating a results object
+            query_config = apply_filters(query_config)
+            with connection_manager.connection() as db_conn, db_conn:
+                handler_args = run_query_mode(db_conn, query_config, mode)
+            handler_args.update({'records': rds_config.get('records')})
+        elif export_options.get('resumable'):
+            if isinstance(event.get('rds_config'), list):
+                raise ValueError('Resumable exports cannot be run in a batch of queries')
+            # Resumable exports are built one page at a time over several invocations and are not cached
+            query_config = apply_filters(query_config)
+            handler_args = run_resumable_export(event, context, rds_config, query_config, export_options)
+            handler_args.update({'records': rds_config.get('records')})
         else:
-            body_string = f', {body_string}'
-        part_number_dict = {'PartNumber': len(self.s3_parts) + 1}
-        mpu_upload_dict = {**part_number_dict, **self.s3_mpu_dict}
-        mpu_upload_dict.update({'Body': body_string.encode()})
-        rsp = self.s3_client.upload_part(**mpu_upload_dict)
-        part_number_dict.update({'ETag': rsp.get('ETag')})
-        self.s3_parts.append(part_number_dict)
-
-    def complete_upload(self):
-        remaining_rows = f'{",".join(self.rows)}]'
-        self.upload_part(remaining_rows)
-        complete_mpu_dict = {
-            **self.s3_mpu_dict, **{
-                'MultipartUpload': {
-                    'Parts': self.s3_parts
+            encoder_class = get_export_encoder_class(export_options)
+            watermark = None
+            if export_options.get('incremental'):
+                # The changed rows are found in the database, their bounds become part of the cache key
+                query_config, watermark = start_incremental_export(apply_filters(query_config), export_options)
+
+            cache_key = get_cache_key(query_config, export_options)
+            cache_max_age = get_cache_max_age(export_options)
+            cached_result = None
+            if cache_max_age > 0 and not export_options.get('cache_bypass'):
+                cached_result = get_cached_result(cache_key, cache_max_age)
+
+            if cached_result:
+                handler_args = {**cached_result, 'cache_hit': True}
+            else:
+                # The schema catalog is only loaded here, by the filters and the planner, once the cache has missed
+                query_config = apply_filters(query_config)
+                with metrics.timer('build'):
+                    if export_options.get('normalized'):
+                        stream_queries = build_stream_queries(query_config, export_options)
+                    else:
+                        query = temp_query_selection(**query_config)
+
+                handler_args = {
+                    'bucket': os.getenv('BUCKET_NAME'),
+                    'key': get_results_key(encoder_class, export_options)
                 }
-            }
-        }
-        return self.s3_client.complete_multipart_upload(**complete_mpu_dict)
-
-def convert_tuple_to_json(row, selected_columns):
-        # print(f'selected_columns: {selected_columns}')
-        record_dict = {}
-        for value, index in zip(row, range(len(row))):
-            if isinstance(value, datetime.datetime):
-                value = str(value)
-            elif isinstance(value, bool):
-                value = json.dumps(value)
-
-            # print(f'selected_columns[index]: {selected_columns[index]}')
-            record_dict.update({selected_columns[index].name: value})
-        return json.dumps(record_dict)
-
-
-class UploadHandler(UploadHandlerBase):
-    def __init__(self, bucket, key):
-        self.s3_dict = {'Bucket': bucket, 'Key': key}
-        self.rows = []
-
-    def handle_row(self, row, selected_columns):
-        self.rows.append(convert_tuple_to_json(row, selected_columns))
-
-    def complete_upload(self):
-        s3_client = boto3.client('s3')
-        self.s3_dict.update({'Body': f'[{",".join(self.rows)}]'.encode()})
-        return s3_client.put_object(**self.s3_dict)
-
-
-def get_upload_handler(total_columns, handler_args):
-    size_avg = 70  # 70 bytes
-    bytes_estimate = total_columns * size_avg
-    if bytes_estimate >= 52428800:  # 50MBit
-        upload_handler = MPUHandler(**handler_args)
-        print('multipart upload')
-    else:
-        print('single upload')
-        upload_handler = UploadHandler(**handler_args)
-
-    return upload_handler
-
-def join_check(selected_columns, where, table_columns):
-    ret = False
-    if selected_columns == '*' or any([column in table_columns for column in selected_columns.replace(' ', '').split(',')]):
-        ret = True
-    elif any([column in where for column in table_columns]):
-        ret = True
-    return ret
-
-def get_limit_sql(limit):
-    limit_sql = sql.SQL('')
-    if limit >= 0:
-        limit_sql = sql.SQL(
-            """
-            LIMIT {}
-            """
-        ).format(sql.SQL(str(limit)))
-
-    return limit_sql
-
-def get_async_join(columns, where, right_table, limit):
-    collections_join = sql.SQL('')
-    if join_check(columns, where, async_operations_db_columns):
-        collections_join = sql.SQL(
-            '''
-            LEFT JOIN (
-                SELECT cumulus_id, id AS async_operation_id
-                FROM async_operations
-                {}
-            ) AS async_operations ON async_operations.cumulus_id={}
-            '''
-            ).format(get_limit_sql(limit), sql.Identifier(right_table, 'async_operation_cumulus_id'))
-
-    return collections_join
-
-def get_collection_json_join(columns, where, right_table, limit):
-    collections_join = sql.SQL('')
-    if join_check(columns, where, collections_db_columns):
-        collections_join = sql.SQL(
-            '''
-            JOIN (
-            SELECT cumulus_id, json_build_object('collection', json_build_object('name', name, 'version', version))
-            FROM collections
-            {}
-            ) AS GC ON GC.cumulus_id={}
-            '''
-            ).format(get_limit_sql(limit), sql.Identifier(right_table, 'collection_cumulus_id'))
-
-    return collections_join
-
-def get_collection_id_join(columns, where, right_table, limit):
-    collections_join = sql.SQL('')
-    if join_check(columns, where, collections_db_columns):
-        collections_join = sql.SQL(
-            '''
-            JOIN (
-                SELECT cumulus_id, concat(collections.name, '___', collections.version) AS collection_id
-                FROM collections
-                {}
-            ) AS GC ON GC.cumulus_id={}
-            '''
-            ).format(get_limit_sql(limit), sql.Identifier(right_table, 'collection_cumulus_id'))
-
-    return collections_join
-
-def get_executions_join(columns, where, right_table, limit):
-    executions_join = sql.SQL('')
-    if join_check(columns, where, executions_db_columns):
-        executions_join = sql.SQL(
-        '''
-        LEFT JOIN (
-          SELECT DISTINCT ON (granule_cumulus_id) granule_cumulus_id, url AS execution
-          FROM executions
-          JOIN granules_executions ON executions.cumulus_id=granules_executions.execution_cumulus_id
-          ORDER BY granule_cumulus_id, executions.timestamp
-          {}
-        ) AS execution_arns ON execution_arns.granule_cumulus_id={}
-        '''
-    ).format(get_limit_sql(limit), sql.Identifier(right_table, 'cumulus_id'))
-
-    return executions_join
-
-def get_files_array_join(columns, where, right_table, limit):
-    files_join = sql.SQL('')
-    if join_check(columns, where, files_db_columns):
-        files_join = sql.SQL(
-        '''
-        LEFT JOIN (
-          SELECT granule_cumulus_id, json_agg(files) AS files
-          FROM files
-          GROUP BY granule_cumulus_id
-          {}
-        ) AS granule_files on granule_files.granule_cumulus_id={}
-        '''
-    ).format(get_limit_sql(limit), sql.Identifier(right_table, 'cumulus_id'))
-
-    return files_join
-
-def get_providers_join(columns, where, right_table, limit):
-    providers_join = sql.SQL('')
-    if join_check(columns, where, providers_db_columns):
-        providers_join = sql.SQL(
-        '''
-        LEFT JOIN (
-          SELECT name AS provider, providers.cumulus_id
-          FROM providers
-          {}
-        ) AS provider_names ON provider_names.cumulus_id={}
-        '''
-    ).format(get_limit_sql(limit), sql.Identifier(right_table, 'provider_cumulus_id'))
-    
-    return providers_join
-
-def build_where(where=''):
-    sql_where = sql.SQL('')
-    if where:
-        sql_where = sql.SQL('WHERE {}').format(sql.SQL(where))
-
-    return sql_where
-
-def build_granules_query(records, columns, where='', limit=-1):
-    joins = []
-    for get_join in [get_collection_id_join, get_executions_join, get_files_array_join, get_providers_join]:
-       joins.append(get_join(columns, where, records, limit))
-
-    joins = sql.SQL(' ').join(joins)
-
-    return joins
-
-
-def build_rules_query(records, columns=None, where=None, limit=-1):
-    joins = []
-    for get_join in [get_collection_json_join, get_providers_join]:
-       joins.append(get_join(columns, where, records, limit))
-
-    joins = sql.SQL(' ').join(joins)
-
-    return joins
-
-def build_executions_query(records, columns=None, where=None, limit=-1):
-    joins = []
-    for get_join in [get_async_join, get_collection_id_join, get_executions_join]:
-       joins.append(get_join(columns, where, records, limit))
-
-    joins = sql.SQL(' ').join(joins)
-
-    return joins
-
-def build_pdrs_query(records, columns=None, where=None, limit=-1):
-    joins = []
-    for get_join in [get_async_join, get_collection_id_join, get_executions_join]:
-       joins.append(get_join(columns, where, records, limit))
-
-    joins = sql.SQL(' ').join(joins)
-
-    return joins
+                upload_options = get_upload_options(event, export_options)
+                fetch_options = get_fetch_options(event)
+
+                if export_options.get('parallel'):
+                    shards = run_parallel_scan(
+                        query_config, handler_args, upload_options, encoder_class, export_options, fetch_options
+                    )
+                    handler_args = {
+                        'shards': shards,
+                        'count': sum(shard.get('count') for shard in shards),
+                        **get_truncated_args(any(shard.get('truncated') for shard in shards))
+                    }
+                elif export_options.get('normalized'):
+                    handler_args = export_streams(
+                        stream_queries, handler_args, upload_options, encoder_class, export_options, fetch_options
+                    )
+                else:
+                    handler_args = export_query(
+                        query, handler_args, upload_options, encoder_class, export_options, fetch_options
+                    )
+                handler_args.update({'records': rds_config.get('records')})
+                # Truncated results are neither cached nor move the watermark, so the next run exports them in full
+                if watermark and not handler_args.get('truncated'):
+                    handler_args.update({'watermark': advance_watermark(watermark, handler_args)})
+
+                if cache_max_age > 0 and not handler_args.get('truncated'):
+                    put_cached_result(cache_key, handler_args)
+    except Exception as e:
+        print(e)
+        stack_trace = traceback.format_exc()
+        handler_args.update({'exception': repr(e), 'stack_trace': stack_trace})
 
-def get_empty_sql_object(records, columns=None, where=None, limit=-1):
-    return sql.SQL('')
+    return handler_args
 
-def build_query_new(records, columns=None, where=None, limit=0, **rds_config):
-    if not columns:
-        columns = '*'
 
-    joins_switch = {
-        'granules': build_granules_query,
-        'rules': build_rules_query,
-        'executions': build_executions_query,
-        'pdrs': build_pdrs_query
+def run_batch_query(event, context, rds_config):
+    # Each query records its own metrics, which are added to those of the invocation once it has finished
+    with metrics.scope() as query_metrics:
+        handler_args = run_query(event, context, rds_config)
+    metrics.merge(query_metrics)
+    return {**handler_args, 'metrics': query_metrics.report()}
+
+
+def run_batch(event, context, rds_configs):
+    """
+    Runs every rds_config of the list concurrently, each with its own results object. The workers share the bounded
+    connection pool and boto3 clients so only the first queries pay for connecting. A failed query is reported in its
+    own result and does not stop the others.
+    """
+    workers = event.get('batch_workers', connection_manager.max_connections)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-query') as executor:
+        futures = [executor.submit(run_batch_query, event, context, rds_config) for rds_config in rds_configs]
+        results = [future.result() for future in futures]
+
+    return {
+        'queries': [{'index': index, **result} for index, result in enumerate(results)],
+        'count': sum(result.get('count') or 0 for result in results if 'exception' not in result),
+        'failed': sum(1 for result in results if 'exception' in result)
     }
 
-    query = sql.SQL(
-        '''
-        SELECT {}
-        FROM {}
-        {}
-        {}
-        {}
-        '''
-    ).format(
-        sql.SQL(columns if columns else '*'),
-        sql.Identifier(records),
-        joins_switch.get(records, get_empty_sql_object)(records, columns, where, limit),
-        build_where(where),
-        get_limit_sql(limit)
-    )
-
-    return query
-
-def temp_query_selection(records, **rds_config):
-    query = ''
-    if records == 'granules':
-        if any(where in rds_config for where in ['granules_where', 'collections_where', 'providers_where', 'pdrs_where']):
-            print('CASE 1')
-            query = build_query_case_1(**rds_config)
-        else:
-            print('CASE 2')
-            query = build_query_case_2(**rds_config)
-        query = sql.SQL(query)
-    else:
-        query = build_query_new(records, **rds_config)
-
-    return query
 
 def main(event, context):
-    handler_args = {}
-    print_query = ''
-    try:
-        rds_config = event.get('rds_config')
-        print(rds_config)
-        handler_args = {
-            'bucket': os.getenv('BUCKET_NAME'),
-            'key': f'{os.getenv("S3_KEY_PREFIX")}query_results_{time.time_ns()}.json'
-        }
-
-        client = boto3.client('s3')
-        client.put_object(Bucket=handler_args['bucket'], Key=handler_args['key'], Body=b'[]')
-        query = temp_query_selection(**rds_config)
-        with psycopg2.connect(**get_db_params()) as db_conn:
-            with db_conn.cursor(name='rds-cursor') as curs:
-                curs.itersize = event.get('size', 10000)
-                print_query = '\r'.join(query.as_string(curs).replace('\n', '\r').split('\r'))
-                # print(print_query)  # Uncomment when troubleshooting queries
-                # print(curs.mogrify(query, vars))
-                curs.execute(query=query)
-
-                upload_handler = MPUHandler(**handler_args)
-                rowcount = 0
-                for row in curs:
-                    upload_handler.handle_row(row, curs.description)
-                    rowcount += 1
-
-                upload_handler.complete_upload()
-
-                handler_args.update({
-                    'query': print_query,
-                    'count': rowcount,
-                    'records': rds_config.get('records')
-                })
-    except Exception as e:
-        print(e)
-        stack_trace = traceback.format_exc()
-        handler_args.update({'exception': repr(e), 'stack_trace': stack_trace})
-    finally:
-        db_conn.close()
+    metrics.reset()
+    deadline.reset(context, get_deadline_margin(event))
+    retry_schema_introspection()
+    # A continuation token carries the rds_config so a Step Functions loop can pass the output straight back in
+    rds_config = event.get('rds_config') or (event.get('continuation') or {}).get('rds_config') or {}
+    if isinstance(rds_config, list):
+        handler_args = run_batch(event, context, rds_config)
+        records = 'batch'
+    else:
+        handler_args = run_query(event, context, rds_config)
+        records = rds_config.get('records')
 
+    handler_args.update({'metrics': report_metrics(event, {'records': records})})
     print(handler_args)
     return handler_args
 
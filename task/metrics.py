@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Units of the values sent as CloudWatch Embedded Metric Format
+METRIC_UNITS = {
+    'rows': 'Count',
+    'parts': 'Count',
+    'bytes_serialized': 'Bytes',
+    'bytes_stored': 'Bytes',
+    'rows_per_sec': 'Count/Second',
+    'bytes_per_row': 'Bytes',
+    'average_part_seconds': 'Seconds',
+    'time_to_first_row': 'Seconds',
+    'planning_seconds': 'Seconds',
+    'prepared_statements': 'Count',
+    'prepared_reuses': 'Count',
+    'total_seconds': 'Seconds'
+}
+
+
+class Metrics:
+    """
+    Phase timers and counters for a single invocation. Timings are taken once per fetched batch or uploaded part and
+    never per row. Phases that run on several threads, such as part uploads and parallel ranges, are summed so they can
+    add up to more than the total time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.perf_counter()
+            self.phases = {}
+            self.counters = {}
+            self.marks = {}
+            self.values = {}
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.phases.update({phase: self.phases.get(phase, 0.0) + seconds})
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counters.update({counter: self.counters.get(counter, 0) + value})
+
+    def mark(self, name):
+        # Records the seconds since the invocation started the first time name is marked
+        with self._lock:
+            self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def record(self, name, value):
+        # Keeps the first, smallest, largest and last of the values recorded under name
+        with self._lock:
+            recorded = self.values.get(name)
+            if recorded:
+                recorded.update({
+                    'min': min(recorded.get('min'), value),
+                    'max': max(recorded.get('max'), value),
+                    'last': value,
+                    'count': recorded.get('count') + 1
+                })
+            else:
+                self.values.update({name: {'first': value, 'min': value, 'max': value, 'last': value, 'count': 1}})
+
+    def merge(self, other):
+        # Adds the phases and counters of other, such as a query of a batch, to this invocation's metrics
+        with other._lock:
+            phases = dict(other.phases)
+            counters = dict(other.counters)
+            marks = dict(other.marks)
+            values = {name: dict(recorded) for name, recorded in other.values.items()}
+
+        for phase, seconds in phases.items():
+            self.add_time(phase, seconds)
+        for counter, value in counters.items():
+            self.increment(counter, value)
+        with self._lock:
+            for name, seconds in marks.items():
+                seconds += other.started - self.started
+                self.marks.update({name: min(seconds, self.marks.get(name, seconds))})
+            for name, other_recorded in values.items():
+                recorded = self.values.get(name)
+                if recorded:
+                    recorded.update({
+                        'min': min(recorded.get('min'), other_recorded.get('min')),
+                        'max': max(recorded.get('max'), other_recorded.get('max')),
+                        'last': other_recorded.get('last'),
+                        'count': recorded.get('count') + other_recorded.get('count')
+                    })
+                else:
+                    self.values.update({name: other_recorded})
+
+    def report(self):
+        total_seconds = time.perf_counter() - self.started
+        with self._lock:
+            phases = dict(self.phases)
+            counters = dict(self.counters)
+            marks = dict(self.marks)
+            values = {name: dict(recorded) for name, recorded in self.values.items()}
+
+        rows = counters.get('rows', 0)
+        parts = counters.get('parts', 0)
+        return {
+            'phases': {phase: round(seconds, 6) for phase, seconds in phases.items()},
+            'total_seconds': round(total_seconds, 6),
+            'time_to_first_row': round(marks['first_row'], 6) if 'first_row' in marks else None,
+            'rows': rows,
+            'bytes_serialized': counters.get('bytes_serialized', 0),
+            'bytes_stored': counters.get('bytes_stored', 0),
+            'parts': parts,
+            'average_part_seconds': round(phases.get('part_upload', 0.0) / parts, 6) if parts else None,
+            'rows_per_sec': round(rows / total_seconds, 1) if total_seconds else None,
+            'fetch_sizes': values.get('fetch_size'),
+            'fetch_target_bytes': values.get('fetch_target_bytes', {}).get('last'),
+            'bytes_per_row': round(values.get('bytes_per_row').get('last'), 1) if 'bytes_per_row' in values else None,
+            # Declaring export cursors and preparing statements, the planning done by EXECUTE is part of execute
+            'planning_seconds': round(phases.get('plan', 0.0) + phases.get('prepare', 0.0), 6),
+            'prepared_statements': counters.get('prepared_statements', 0),
+            'prepared_reuses': counters.get('prepared_reuses', 0)
+        }
+
+
+def metrics_enabled(event):
+    return bool(event.get('emit_metrics', os.getenv('EMIT_METRICS', '').lower() in ('1', 'true')))
+
+
+def format_emf(report, dimensions):
+    """
+    Formats the report as a CloudWatch Embedded Metric Format log line. Phase durations are sent as <phase>_seconds.
+    """
+    values = {f'{phase}_seconds': seconds for phase, seconds in report.get('phases').items()}
+    for name in METRIC_UNITS:
+        if report.get(name) is not None:
+            values.update({name: report.get(name)})
+
+    return json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': os.getenv('METRICS_NAMESPACE', 'GHRC/RDSLambda'),
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': METRIC_UNITS.get(name, 'Seconds')} for name in values]
+            }]
+        },
+        **{key: str(value) for key, value in dimensions.items()},
+        **values
+    })
+
+
+def report_metrics(event, dimensions):
+    report = metrics.report()
+    if metrics_enabled(event):
+        print(format_emf(report, dimensions))
+
+    return report
+
+
+class ScopedMetrics:
+    """
+    The Metrics of the running query. The queries of a batch each record into their own Metrics through scope(), and
+    the threads a query starts record into the Metrics of that query when their function is wrapped with bind().
+    Everything else is delegated to the current Metrics, which is the invocation's outside of a scope.
+    """
+    def __init__(self):
+        self.invocation = Metrics()
+        self._local = threading.local()
+
+    def current(self):
+        return getattr(self._local, 'metrics', None) or self.invocation
+
+    @contextmanager
+    def use(self, scoped_metrics):
+        previous = getattr(self._local, 'metrics', None)
+        self._local.metrics = scoped_metrics
+        try:
+            yield scoped_metrics
+        finally:
+            self._local.metrics = previous
+
+    def scope(self):
+        return self.use(Metrics())
+
+    def bind(self, function):
+        scoped_metrics = self.current()
+
+        def run(*args, **kwargs):
+            with self.use(scoped_metrics):
+                return function(*args, **kwargs)
+        return run
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+
+metrics = ScopedMetrics()
@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2 import sql
+
+from task.connection_manager import connection_manager
+from task.export import (
+    create_upload_handler, format_query, get_truncated_args, get_upload_stats, run_upload
+)
+from task.metrics import metrics
+from task.query_builders import add_records_filter, temp_query_selection
+from task.upload_handlers import get_shard_key
+
+# Tables that can drive a parallel scan, they are split on their cumulus_id primary key
+PARALLEL_SCAN_TABLES = ('granules', 'executions', 'files', 'pdrs', 'rules', 'collections', 'providers')
+RANGE_SPLITS = ('minmax', 'histogram')
+
+
+def get_id_bounds(db_conn, table):
+    with db_conn.cursor() as curs:
+        curs.execute(sql.SQL('SELECT min(cumulus_id), max(cumulus_id) FROM {}').format(sql.Identifier(table)))
+        return curs.fetchone()
+
+
+def get_histogram_bounds(db_conn, table):
+    # Planner statistics give equal population buckets so the ranges hold similar row counts even with id gaps
+    with db_conn.cursor() as curs:
+        curs.execute(
+            '''
+            SELECT histogram_bounds::text::bigint[]
+            FROM pg_stats
+            WHERE schemaname = current_schema() AND tablename = %s AND attname = 'cumulus_id'
+            ''',
+            (table,)
+        )
+        row = curs.fetchone()
+    return row[0] if row and row[0] else []
+
+
+def split_evenly(lower, upper, range_count):
+    step = max((upper - lower + 1) // range_count, 1)
+    boundaries = list(range(lower, upper + 1, step))[:range_count]
+    return boundaries + [upper + 1]
+
+
+def get_id_ranges(db_conn, table, range_count, split='minmax'):
+    """
+    Returns [lower, upper) cumulus_id ranges covering the whole table.
+    """
+    if split not in RANGE_SPLITS:
+        raise ValueError(f'Unsupported split "{split}", expected one of: {", ".join(RANGE_SPLITS)}')
+
+    lower, upper = get_id_bounds(db_conn, table)
+    if lower is None:
+        return []
+
+    boundaries = []
+    if split == 'histogram':
+        histogram = get_histogram_bounds(db_conn, table)
+        if len(histogram) > range_count:
+            step = len(histogram) / range_count
+            boundaries = sorted({lower, *(histogram[int(index * step)] for index in range(1, range_count))})
+            boundaries.append(upper + 1)
+
+    if not boundaries:
+        boundaries = split_evenly(lower, upper, range_count)
+
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def add_range_filter(records, query_config, lower, upper):
+    range_filter = f'{records}.cumulus_id >= {int(lower)} AND {records}.cumulus_id < {int(upper)}'
+    return add_records_filter(records, query_config, range_filter)
+
+
+def export_range(index, id_range, query_config, handler_args, upload_options, encoder_class, export_options,
+                 fetch_options):
+    records = query_config.get('records')
+    lower, upper = id_range
+    shard_args = {**handler_args, 'key': get_shard_key(handler_args.get('key'), index, 'range')}
+    query = temp_query_selection(**add_range_filter(records, query_config, lower, upper))
+    with connection_manager.connection() as db_conn, db_conn:
+        upload_handler = create_upload_handler(shard_args, upload_options, encoder_class, export_options)
+        query, rowcount, truncated = run_upload(db_conn, query, upload_handler, export_options, fetch_options)
+
+        return {
+            **shard_args,
+            'count': rowcount,
+            'lower_id': lower,
+            'upper_id': upper,
+            'query': format_query(query, db_conn),
+            **get_upload_stats(upload_handler),
+            **get_truncated_args(truncated)
+        }
+
+
+def run_parallel_scan(query_config, handler_args, upload_options, encoder_class, export_options, fetch_options):
+    """
+    Splits the driving table into cumulus_id ranges and exports each range on its own connection. Each range is
+    written to its own object and the shards are returned in cumulus_id order. The query limit applies to every range
+    unless parallel.range_limit is set.
+    """
+    records = query_config.get('records')
+    if records not in PARALLEL_SCAN_TABLES:
+        raise ValueError(f'Parallel scans support the records: {", ".join(PARALLEL_SCAN_TABLES)}')
+
+    parallel = export_options.get('parallel')
+    if not isinstance(parallel, dict):
+        parallel = {}
+    workers = parallel.get('workers', connection_manager.max_connections)
+    range_count = parallel.get('ranges', workers)
+    if parallel.get('range_limit') is not None:
+        query_config = {**query_config, 'limit': parallel.get('range_limit')}
+
+    with connection_manager.connection() as db_conn, db_conn:
+        id_ranges = get_id_ranges(db_conn, records, range_count, parallel.get('split', 'minmax'))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='range-scan') as executor:
+        futures = [
+            executor.submit(
+                metrics.bind(export_range), index, id_range, query_config, handler_args, upload_options, encoder_class,
+                export_options, fetch_options
+            ) for index, id_range in enumerate(id_ranges)
+        ]
+        shards = [future.result() for future in futures]
+
+    return shards
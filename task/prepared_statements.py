@@ -0,0 +1,68 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+from psycopg2 import sql
+
+from task.metrics import metrics
+
+# Prepared statements kept per database connection, the least recently used one is deallocated first
+PREPARED_STATEMENTS_MAX = int(os.getenv('PREPARED_STATEMENTS_MAX', 32))
+
+
+def parameterize(query, context):
+    """
+    Renders query with every sql.Literal replaced by a $n parameter. Returns the statement text and the values of the
+    parameters.
+    """
+    values = []
+
+    def render(part):
+        if isinstance(part, sql.Composed):
+            return ''.join(render(child) for child in part.seq)
+        if isinstance(part, sql.Literal):
+            values.append(part.wrapped)
+            return f'${len(values)}'
+        return part.as_string(context)
+
+    return render(query), values
+
+
+def get_prepared_statements(db_conn):
+    statements = getattr(db_conn, 'prepared_statements', None)
+    if statements is None:
+        statements = OrderedDict()
+        db_conn.prepared_statements = statements
+    return statements
+
+
+def prepare(curs, text):
+    # Statements are named after their text so the same query shape is only prepared once per connection
+    name = f'rds_{hashlib.sha256(text.encode()).hexdigest()[:24]}'
+    statements = get_prepared_statements(curs.connection)
+    if name in statements:
+        statements.move_to_end(name)
+        metrics.increment('prepared_reuses')
+        return name
+
+    with metrics.timer('prepare'):
+        curs.execute(f'PREPARE {name} AS {text}')
+    statements.update({name: text})
+    metrics.increment('prepared_statements')
+    while len(statements) > PREPARED_STATEMENTS_MAX:
+        expired_name, _ = statements.popitem(last=False)
+        curs.execute(f'DEALLOCATE {expired_name}')
+    return name
+
+
+def execute_prepared(curs, query, prefix=''):
+    """
+    Runs query through a prepared statement of the cursor's connection with its literals bound as parameters, so a
+    warm container that runs the same query shape with other values reuses the statement and lets Postgres reuse its
+    plan. prefix, such as EXPLAIN, is put in front of the EXECUTE. Prepared statements outlive the transaction that
+    created them so they are kept with the pooled connection.
+    """
+    text, values = parameterize(query, curs)
+    name = prepare(curs, text)
+    arguments = f'({", ".join(["%s"] * len(values))})' if values else ''
+    curs.execute(f'{prefix} EXECUTE {name}{arguments}'.strip(), values or None)
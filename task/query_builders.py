@@ -1,24 +1,46 @@
+import json
+
+from psycopg2 import sql
+
 from task.api_model import *
+from task.filters import and_where, as_sql
+from task.query_planner import plan_granules_query
+from task.schema_catalog import get_column_references, get_schema_catalog
+from task.serializers import (
+    ARRAY_TYPE_CODES, BOOL_TYPE_CODE, FLOAT_TYPE_CODES, INTEGER_TYPE_CODES, JSON_TYPE_CODE, JSONB_TYPE_CODE,
+    TEXT_TYPE_CODES, TIMESTAMP_TYPE_CODES, TIMESTAMPTZ_TYPE_CODE
+)
 
 def condense_whitespaces(string):
     return ' '.join(string.split()).replace('\n', '\r')
 
+# Columns the joins of each table add to the results, selecting one of them requires the join
+JOIN_OUTPUT_COLUMNS = {
+    'async_operations': frozenset({'async_operation_id'}),
+    'collections': frozenset({'collection_id'}),
+    'executions': frozenset({'execution'}),
+    'files': frozenset({'files'}),
+    'pdrs': frozenset({'pdr_name'}),
+    'providers': frozenset({'provider'})
+}
+
+def references_table(references, table, records):
+    # A table is referenced by its qualified columns, the columns its join adds and the columns only it has
+    catalog = get_schema_catalog()
+    for qualifier, column in references:
+        if qualifier:
+            if qualifier == table and table != records:
+                return True
+        elif column in JOIN_OUTPUT_COLUMNS.get(table, ()):
+            return True
+        elif catalog.has_column(table, column) and not catalog.has_column(records, column):
+            return True
+    return False
+
 def is_column_selected(selected_columns, table):
-    print(f'Checking {table} table for {selected_columns}')
-    ret = False
     if '*' in selected_columns:
-        ret = True
-    else:
-        table_columns = db_dict.get(table)
-        for selected_column in selected_columns:
-            if '.' in selected_column:
-                table_columns = (f'{table}.{column}' for column in table_columns)
-
-            print(f'Is "{selected_column}" in {table_columns}')
-            if selected_column in table_columns:
-                ret = True
-                break 
-    return ret
+        return True
+    return references_table(get_column_references(', '.join(selected_columns)), table, 'granules')
 
 def build_query_case_1(columns='*', limit=10, providers_where='', collections_where='', pdrs_where='', granules_where='', files_where='', executions_where=''):
     if columns != '*':
@@ -142,7 +164,11 @@ def build_query_case_1(columns='*', limit=10, providers_where='', collections_wh
         else:
             pdrs_query = f'''
                 LEFT JOIN (
-                    {pdrs_query}
+                    SELECT 
+                        DISTINCT ON (pdrs.cumulus_id) pdrs.cumulus_id as pdr_cumulus_id,
+                        name AS pdr_name
+                    FROM 
+                        pdrs
                     JOIN granules_cte ON granules_cte.pdr_cumulus_id = pdrs.cumulus_id
                 ) AS pdr_names USING (pdr_cumulus_id)
             '''
@@ -382,10 +408,10 @@ def build_query_case_2(columns='*', limit=10, providers_where='', collections_wh
             pdrs_where = f'WHERE {pdrs_where}'
         pdrs_query = f'''
             LEFT JOIN (
-                SELECT pdrs.cumulus_id as pdr_cumulus_id, name AS pdr_name
+                SELECT DISTINCT ON (pdrs.cumulus_id) pdrs.cumulus_id as pdr_cumulus_id, name AS pdr_name
                 FROM pdrs
                 JOIN granules_cte ON granules_cte.pdr_cumulus_id = pdrs.cumulus_id
-                {providers_where}
+                {pdrs_where}
             ) AS pdr_names USING (pdr_cumulus_id)
         '''
         join_queries.append(pdrs_query)
@@ -428,4 +454,407 @@ def build_query_case_2(columns='*', limit=10, providers_where='', collections_wh
 
     query = condense_whitespaces(query)
     
-    return query
\ No newline at end of file
+    return query
+
+# planner compiles granule queries from a logical plan, legacy uses the original string builders
+QUERY_STRATEGIES = ('planner', 'legacy')
+EXPLAIN_OPTIONS = 'EXPLAIN (FORMAT JSON)'
+
+def join_check(selected_columns, where, table, records):
+    if selected_columns == '*':
+        return True
+    return references_table(get_column_references(selected_columns) | get_column_references(where), table, records)
+
+def get_limit_sql(limit):
+    limit_sql = sql.SQL('')
+    if limit >= 0:
+        limit_sql = sql.SQL(
+            """
+            LIMIT {}
+            """
+        ).format(sql.SQL(str(limit)))
+
+    return limit_sql
+
+def get_async_join(columns, where, right_table, limit):
+    collections_join = sql.SQL('')
+    if join_check(columns, where, 'async_operations', right_table):
+        collections_join = sql.SQL(
+            '''
+            LEFT JOIN (
+                SELECT cumulus_id, id AS async_operation_id
+                FROM async_operations
+                {}
+            ) AS async_operations ON async_operations.cumulus_id={}
+            '''
+            ).format(get_limit_sql(limit), sql.Identifier(right_table, 'async_operation_cumulus_id'))
+
+    return collections_join
+
+def get_collection_json_join(columns, where, right_table, limit):
+    collections_join = sql.SQL('')
+    if join_check(columns, where, 'collections', right_table):
+        collections_join = sql.SQL(
+            '''
+            JOIN (
+            SELECT cumulus_id, json_build_object('collection', json_build_object('name', name, 'version', version))
+            FROM collections
+            {}
+            ) AS GC ON GC.cumulus_id={}
+            '''
+            ).format(get_limit_sql(limit), sql.Identifier(right_table, 'collection_cumulus_id'))
+
+    return collections_join
+
+def get_collection_id_join(columns, where, right_table, limit):
+    collections_join = sql.SQL('')
+    if join_check(columns, where, 'collections', right_table):
+        collections_join = sql.SQL(
+            '''
+            JOIN (
+                SELECT cumulus_id, concat(collections.name, '___', collections.version) AS collection_id
+                FROM collections
+                {}
+            ) AS GC ON GC.cumulus_id={}
+            '''
+            ).format(get_limit_sql(limit), sql.Identifier(right_table, 'collection_cumulus_id'))
+
+    return collections_join
+
+def get_executions_join(columns, where, right_table, limit):
+    executions_join = sql.SQL('')
+    if join_check(columns, where, 'executions', right_table):
+        executions_join = sql.SQL(
+        '''
+        LEFT JOIN (
+          SELECT DISTINCT ON (granule_cumulus_id) granule_cumulus_id, url AS execution
+          FROM executions
+          JOIN granules_executions ON executions.cumulus_id=granules_executions.execution_cumulus_id
+          ORDER BY granule_cumulus_id, executions.timestamp
+          {}
+        ) AS execution_arns ON execution_arns.granule_cumulus_id={}
+        '''
+    ).format(get_limit_sql(limit), sql.Identifier(right_table, 'cumulus_id'))
+
+    return executions_join
+
+def get_files_array_join(columns, where, right_table, limit):
+    files_join = sql.SQL('')
+    if join_check(columns, where, 'files', right_table):
+        files_join = sql.SQL(
+        '''
+        LEFT JOIN (
+          SELECT granule_cumulus_id, json_agg(files) AS files
+          FROM files
+          GROUP BY granule_cumulus_id
+          {}
+        ) AS granule_files on granule_files.granule_cumulus_id={}
+        '''
+    ).format(get_limit_sql(limit), sql.Identifier(right_table, 'cumulus_id'))
+
+    return files_join
+
+def get_executions_lateral_join(columns, where, right_table, limit):
+    # Same rows as get_executions_join but only the executions of each outer row are read
+    executions_join = sql.SQL('')
+    if join_check(columns, where, 'executions', right_table):
+        executions_join = sql.SQL(
+        '''
+        LEFT JOIN LATERAL (
+          SELECT granules_executions.granule_cumulus_id, granule_executions.url AS execution
+          FROM executions AS granule_executions
+          JOIN granules_executions ON granule_executions.cumulus_id=granules_executions.execution_cumulus_id
+          WHERE granules_executions.granule_cumulus_id={}
+          ORDER BY granule_executions.timestamp
+          LIMIT 1
+        ) AS execution_arns ON true
+        '''
+    ).format(sql.Identifier(right_table, 'cumulus_id'))
+
+    return executions_join
+
+def get_files_lateral_join(columns, where, right_table, limit):
+    # Same rows as get_files_array_join but only the files of each outer row are aggregated
+    files_join = sql.SQL('')
+    if join_check(columns, where, 'files', right_table):
+        files_join = sql.SQL(
+        '''
+        LEFT JOIN LATERAL (
+          SELECT granule_files.granule_cumulus_id, json_agg(granule_files) AS files
+          FROM files AS granule_files
+          WHERE granule_files.granule_cumulus_id={}
+          GROUP BY granule_files.granule_cumulus_id
+        ) AS granule_files ON true
+        '''
+    ).format(sql.Identifier(right_table, 'cumulus_id'))
+
+    return files_join
+
+LATERAL_JOINS = {
+    get_executions_join: get_executions_lateral_join,
+    get_files_array_join: get_files_lateral_join
+}
+
+def get_join_functions(join_functions, strategy='planner'):
+    if strategy != 'legacy':
+        join_functions = [LATERAL_JOINS.get(get_join, get_join) for get_join in join_functions]
+    return join_functions
+
+def get_providers_join(columns, where, right_table, limit):
+    providers_join = sql.SQL('')
+    if join_check(columns, where, 'providers', right_table):
+        providers_join = sql.SQL(
+        '''
+        LEFT JOIN (
+          SELECT name AS provider, providers.cumulus_id
+          FROM providers
+          {}
+        ) AS provider_names ON provider_names.cumulus_id={}
+        '''
+    ).format(get_limit_sql(limit), sql.Identifier(right_table, 'provider_cumulus_id'))
+    
+    return providers_join
+
+def build_where(where=''):
+    sql_where = sql.SQL('')
+    if where:
+        sql_where = sql.SQL('WHERE {}').format(as_sql(where))
+
+    return sql_where
+
+def build_granules_query(records, columns, where='', limit=-1, strategy='planner'):
+    joins = []
+    for get_join in get_join_functions([get_collection_id_join, get_executions_join, get_files_array_join, get_providers_join], strategy):
+       joins.append(get_join(columns, where, records, limit))
+
+    joins = sql.SQL(' ').join(joins)
+
+    return joins
+
+
+def build_rules_query(records, columns=None, where=None, limit=-1, strategy='planner'):
+    joins = []
+    for get_join in get_join_functions([get_collection_json_join, get_providers_join], strategy):
+       joins.append(get_join(columns, where, records, limit))
+
+    joins = sql.SQL(' ').join(joins)
+
+    return joins
+
+def build_executions_query(records, columns=None, where=None, limit=-1, strategy='planner'):
+    joins = []
+    for get_join in get_join_functions([get_async_join, get_collection_id_join, get_executions_join], strategy):
+       joins.append(get_join(columns, where, records, limit))
+
+    joins = sql.SQL(' ').join(joins)
+
+    return joins
+
+def build_pdrs_query(records, columns=None, where=None, limit=-1, strategy='planner'):
+    joins = []
+    for get_join in get_join_functions([get_async_join, get_collection_id_join, get_executions_join], strategy):
+       joins.append(get_join(columns, where, records, limit))
+
+    joins = sql.SQL(' ').join(joins)
+
+    return joins
+
+def get_empty_sql_object(records, columns=None, where=None, limit=-1, strategy='planner'):
+    return sql.SQL('')
+
+def build_query_new(records, columns=None, where=None, limit=0, strategy='planner', **rds_config):
+    if not columns:
+        columns = '*'
+
+    joins_switch = {
+        'granules': build_granules_query,
+        'rules': build_rules_query,
+        'executions': build_executions_query,
+        'pdrs': build_pdrs_query
+    }
+
+    query = sql.SQL(
+        '''
+        SELECT {}
+        FROM {}
+        {}
+        {}
+        {}
+        '''
+    ).format(
+        sql.SQL(columns if columns else '*'),
+        sql.Identifier(records),
+        joins_switch.get(records, get_empty_sql_object)(records, columns, where, limit, strategy),
+        build_where(where),
+        get_limit_sql(limit)
+    )
+
+    return query
+
+def add_records_filter(records, query_config, records_filter):
+    # Granule queries filter the granules with granules_where, the other records with where
+    where_key = 'granules_where' if records == 'granules' else 'where'
+    return {**query_config, where_key: and_where(query_config.get(where_key), records_filter)}
+
+def temp_query_selection(records, strategy='planner', **rds_config):
+    if strategy not in QUERY_STRATEGIES:
+        raise ValueError(f'Unsupported strategy "{strategy}", expected one of: {", ".join(QUERY_STRATEGIES)}')
+
+    query = ''
+    if records == 'granules' and strategy == 'planner':
+        query = plan_granules_query(**rds_config)
+    elif records == 'granules':
+        if any(where in rds_config for where in ['granules_where', 'collections_where', 'providers_where', 'pdrs_where']):
+            print('CASE 1')
+            query = build_query_case_1(**rds_config)
+        else:
+            print('CASE 2')
+            query = build_query_case_2(**rds_config)
+        query = sql.SQL(query)
+    else:
+        query = build_query_new(records, strategy=strategy, **rds_config)
+
+    return query
+
+
+def build_describe_query(query):
+    return sql.SQL('SELECT * FROM ({}) AS described_query LIMIT 0').format(query)
+
+# Column types server_json renders in Postgres, rows of queries with other columns are all encoded by the lambda
+SERVER_JSON_TYPE_CODES = (
+    BOOL_TYPE_CODE, JSONB_TYPE_CODE, *TIMESTAMP_TYPE_CODES, *INTEGER_TYPE_CODES, *FLOAT_TYPE_CODES, *TEXT_TYPE_CODES,
+    *ARRAY_TYPE_CODES
+)
+# json.dumps escapes every character outside of this range
+JSON_ASCII_PATTERN = r'^[\x01-\x7e]*$'
+# Plain float text, the only float8 and float4 output that reads back to a float Python prints the same way
+PLAIN_FLOAT_PATTERN = r'^-?[0-9]+(\.[0-9]+)?$'
+# A digit followed by a fraction or an exponent, jsonb keeps the digits of numbers that Python reads as floats
+JSONB_FLOAT_PATTERN = '[0-9][.eE]'
+
+def get_json_value_sql(column, type_code, normalize_json=False):
+    # Renders the value the same way JSONRowEncoder does after psycopg2 has decoded it. normalize_json casts
+    # json values to jsonb so the rendered row never contains a raw newline.
+    if type_code == BOOL_TYPE_CODE:
+        value = sql.SQL('{}::text').format(column)
+    elif type_code in TIMESTAMP_TYPE_CODES:
+        timezone = sql.SQL('')
+        if type_code == TIMESTAMPTZ_TYPE_CODE:
+            timezone = sql.SQL(" || to_char({}, 'TZH:TZM')").format(column)
+        value = sql.SQL(
+            """
+            to_char({column}, 'YYYY-MM-DD HH24:MI:SS')
+            || CASE WHEN mod(date_part('microseconds', {column})::bigint, 1000000) <> 0
+                THEN to_char({column}, '.US') ELSE '' END
+            {timezone}
+            """
+        ).format(column=column, timezone=timezone)
+    elif type_code in FLOAT_TYPE_CODES:
+        # Python prints whole floats with a trailing .0
+        return sql.SQL(
+            "coalesce(CASE WHEN {0}::text ~ '^-?[0-9]+$' THEN {0}::text || '.0' ELSE {0}::text END, 'null')"
+        ).format(column)
+    elif type_code in ARRAY_TYPE_CODES:
+        # jsonb separates elements with ", " like json.dumps
+        return sql.SQL("coalesce(to_jsonb({})::text, 'null')").format(column)
+    elif type_code == JSON_TYPE_CODE and normalize_json:
+        value = sql.SQL('{}::jsonb').format(column)
+    else:
+        value = column
+
+    return sql.SQL("coalesce(to_json({})::text, 'null')").format(value)
+
+def get_json_row_sql(description, aliases, normalize_json=False):
+    # Like a Python dict, a duplicated name keeps the position of its first occurrence and the value of its last
+    value_indexes = {}
+    for index, column in enumerate(description):
+        value_indexes.update({column.name: index})
+
+    members = []
+    for name, index in value_indexes.items():
+        column = sql.Identifier('rendered_query', aliases[index])
+        members.append(sql.SQL('{} || {}').format(
+            sql.Literal(f'{json.dumps(name)}: '),
+            get_json_value_sql(column, description[index].type_code, normalize_json)
+        ))
+
+    return sql.SQL("'{{' || {} || '}}'").format(sql.SQL(" || ', ' || ").join(members) if members else sql.SQL("''"))
+
+def build_json_rows_query(query, description, normalize_json=False):
+    """
+    Wraps query so that Postgres returns each row as a single JSON text column in the format produced by
+    JSONRowEncoder. The subquery columns are renamed by position so that duplicate column names can be referenced.
+    """
+    aliases = [f'column_{index}' for index in range(len(description))]
+    return sql.SQL(
+        """
+        SELECT {} AS json_row
+        FROM ({}) AS rendered_query({})
+        """
+    ).format(
+        get_json_row_sql(description, aliases, normalize_json),
+        query,
+        sql.SQL(', ').join(sql.Identifier(alias) for alias in aliases)
+    )
+
+def get_server_json_checks(description, aliases):
+    # Conditions on the values of a row under which Postgres renders it exactly like JSONRowEncoder
+    text_columns = []
+    checks = []
+    for alias, column in zip(aliases, description):
+        value = sql.Identifier('rendered_query', alias)
+        if column.type_code in FLOAT_TYPE_CODES:
+            checks.append(sql.SQL('coalesce({}::text ~ {}, true)').format(value, sql.Literal(PLAIN_FLOAT_PATTERN)))
+        elif column.type_code == JSONB_TYPE_CODE:
+            checks.append(sql.SQL('coalesce({}::text !~ {}, true)').format(value, sql.Literal(JSONB_FLOAT_PATTERN)))
+        if column.type_code in (JSONB_TYPE_CODE, *TEXT_TYPE_CODES, *ARRAY_TYPE_CODES):
+            text_columns.append(value)
+
+    if text_columns:
+        checks.append(sql.SQL('concat({}) ~ {}').format(
+            sql.SQL(', ').join(text_columns), sql.Literal(JSON_ASCII_PATTERN)
+        ))
+    return checks
+
+def build_server_json_query(query, description):
+    """
+    Wraps query for the server_json export. The first column, json_row, is the row rendered as JSON text byte for
+    byte like JSONRowEncoder. When Postgres cannot render a row identically, because of non-ASCII text, floats
+    printed in exponent form or a column type it renders differently such as json, json_row is null and the other
+    columns hold the values of the row instead.
+    """
+    aliases = [f'column_{index}' for index in range(len(description))]
+    fallback_names = [column.name for column in description if column.type_code not in SERVER_JSON_TYPE_CODES]
+    if fallback_names:
+        print(f'server_json encodes the rows in the lambda because of the columns: {", ".join(fallback_names)}')
+        json_row = sql.SQL('NULL::text')
+    else:
+        json_row = get_json_row_sql(description, aliases)
+        checks = get_server_json_checks(description, aliases)
+        if checks:
+            json_row = sql.SQL('CASE WHEN {} THEN {} END').format(sql.SQL(' AND ').join(checks), json_row)
+
+    return sql.SQL(
+        """
+        SELECT json_row, {}
+        FROM (
+            SELECT {} AS json_row, rendered_query.*
+            FROM ({}) AS rendered_query({})
+        ) AS rendered_rows
+        """
+    ).format(
+        sql.SQL(', ').join(
+            sql.SQL('CASE WHEN json_row IS NULL THEN {} END AS {}').format(
+                sql.Identifier(alias), sql.Identifier(column.name)
+            ) for alias, column in zip(aliases, description)
+        ),
+        json_row,
+        query,
+        sql.SQL(', ').join(sql.Identifier(alias) for alias in aliases)
+    )
+
+def build_count_query(query):
+    return sql.SQL('SELECT count(*) FROM ({}) AS counted_query').format(query)
+
+def build_explain_query(query):
+    return sql.SQL('{} {}').format(sql.SQL(EXPLAIN_OPTIONS), query)
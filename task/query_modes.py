@@ -0,0 +1,88 @@
+from psycopg2.errors import QueryCanceled
+
+from task.deadline import deadline
+from task.export import format_query, get_truncated_args
+from task.metrics import metrics
+from task.prepared_statements import execute_prepared
+from task.query_builders import EXPLAIN_OPTIONS, build_count_query, build_explain_query, temp_query_selection
+
+QUERY_MODES = ('export', 'count', 'estimate')
+# Selecting a constant lets the query builders leave out every join that is only needed for the projection
+COUNT_COLUMNS = '1'
+
+
+def get_query_mode(export_options):
+    mode = export_options.get('mode', 'export')
+    if mode not in QUERY_MODES:
+        raise ValueError(f'Unsupported mode "{mode}", expected one of: {", ".join(QUERY_MODES)}')
+    return mode
+
+
+def has_filters(query_config):
+    return any(value for key, value in query_config.items() if key == 'where' or key.endswith('_where'))
+
+
+def get_limit(query_config):
+    # Defaults of build_query_case_1/2 and build_query_new
+    return query_config.get('limit', 10 if query_config.get('records') == 'granules' else 0)
+
+
+def run_count(db_conn, query_config):
+    with metrics.timer('build'):
+        query = build_count_query(temp_query_selection(**{**query_config, 'columns': COUNT_COLUMNS}))
+    with metrics.timer('execute'), db_conn.cursor() as curs:
+        execute_prepared(curs, query)
+        count = curs.fetchone()[0]
+
+    return {'count': count, 'query': format_query(query, db_conn)}
+
+
+def get_table_estimate(db_conn, table):
+    with db_conn.cursor() as curs:
+        curs.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', (table,))
+        row = curs.fetchone()
+    # reltuples is -1 (or 0 on older versions) for tables that have never been vacuumed or analyzed
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+def run_estimate(db_conn, query_config):
+    records = query_config.get('records')
+    estimate = None
+    if not has_filters(query_config):
+        estimate = get_table_estimate(db_conn, records)
+        limit = get_limit(query_config)
+        if estimate is not None and limit >= 0:
+            estimate = min(estimate, limit)
+
+    if estimate is not None:
+        return {'count': estimate, 'estimate_source': 'reltuples'}
+
+    with metrics.timer('build'):
+        explained_query = temp_query_selection(**{**query_config, 'columns': COUNT_COLUMNS})
+        query = build_explain_query(explained_query)
+    with metrics.timer('execute'), db_conn.cursor() as curs:
+        execute_prepared(curs, explained_query, EXPLAIN_OPTIONS)
+        plan = curs.fetchone()[0]
+
+    return {
+        'count': int(plan[0].get('Plan').get('Plan Rows')),
+        'estimate_source': 'explain',
+        'query': format_query(query, db_conn)
+    }
+
+
+def run_query_mode(db_conn, query_config, mode):
+    deadline.set_statement_timeout(db_conn)
+    try:
+        if mode == 'count':
+            result = run_count(db_conn, query_config)
+        else:
+            result = run_estimate(db_conn, query_config)
+    except QueryCanceled as e:
+        if not deadline.cancelled(e):
+            raise
+        # A count has no partial result, so one cut short by the deadline has no count
+        print(f'Deadline reached, stopped the {mode} query')
+        result = {'count': None, **get_truncated_args(True)}
+
+    return {**result, 'mode': mode}
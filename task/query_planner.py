@@ -0,0 +1,356 @@
+from psycopg2 import sql
+
+from task.filters import as_sql
+from task.schema_catalog import get_column_references, get_schema_catalog
+
+
+class Relation:
+    """
+    A table related to granules. columns are the output columns it adds to the granule rows, to_many relations have
+    several rows per granule and are aggregated or reduced to a single row. Normalized exports read to_many relations
+    as a separate flat stream instead, using stream_sql.
+    """
+    def __init__(self, name, columns, to_many, semi_join_sql, join_sql, stream_sql=None):
+        self.name = name
+        self.where_key = f'{name}_where'
+        self.columns = columns
+        self.to_many = to_many
+        self.semi_join_sql = semi_join_sql
+        self.join_sql = join_sql
+        self.stream_sql = stream_sql
+
+    def __repr__(self):
+        return self.name
+
+
+def get_filter_sql(where):
+    return sql.SQL('AND ({})').format(as_sql(where)) if where else sql.SQL('')
+
+
+def get_files_join(where=''):
+    # files_where also limits the aggregated files to the matching ones
+    return sql.SQL(
+        '''
+        LEFT JOIN LATERAL (
+            SELECT json_agg(files) AS files
+            FROM files
+            WHERE files.granule_cumulus_id = granules_cte.granule_cumulus_id
+            {}
+        ) AS file_arrays ON true
+        '''
+    ).format(get_filter_sql(where))
+
+
+def get_execution_join(where=''):
+    # The latest execution, of the matching ones when executions_where is given
+    return sql.SQL(
+        '''
+        LEFT JOIN LATERAL (
+            SELECT executions.url AS execution
+            FROM granules_executions
+            JOIN executions ON executions.cumulus_id = granules_executions.execution_cumulus_id
+            WHERE granules_executions.granule_cumulus_id = granules_cte.granule_cumulus_id
+            {}
+            ORDER BY executions.timestamp DESC
+            LIMIT 1
+        ) AS execution ON true
+        '''
+    ).format(get_filter_sql(where))
+
+
+def get_provider_join(where=''):
+    return sql.SQL(
+        '''
+        LEFT JOIN (
+            SELECT providers.cumulus_id AS provider_cumulus_id, name AS provider FROM providers
+        ) AS provider_names USING (provider_cumulus_id)
+        '''
+    )
+
+
+def get_collection_join(where=''):
+    return sql.SQL(
+        '''
+        LEFT JOIN (
+            SELECT collections.cumulus_id AS collection_cumulus_id, concat(name, '___', version) AS collection_id
+            FROM collections
+        ) AS collection_ids USING (collection_cumulus_id)
+        '''
+    )
+
+
+def get_pdr_join(where=''):
+    return sql.SQL(
+        '''
+        LEFT JOIN (
+            SELECT pdrs.cumulus_id AS pdr_cumulus_id, name AS pdr_name FROM pdrs
+        ) AS pdr_names USING (pdr_cumulus_id)
+        '''
+    )
+
+
+def get_files_stream(where=''):
+    return sql.SQL(
+        '''
+        SELECT files.*
+        FROM granules_cte
+        JOIN files ON files.granule_cumulus_id = granules_cte.granule_cumulus_id
+        {}
+        ORDER BY files.granule_cumulus_id, files.cumulus_id
+        '''
+    ).format(get_filter_sql(where))
+
+
+def get_executions_stream(where=''):
+    # Every execution of the granule rather than only the latest one, newest first
+    return sql.SQL(
+        '''
+        SELECT granules_executions.granule_cumulus_id, executions.*
+        FROM granules_cte
+        JOIN granules_executions ON granules_executions.granule_cumulus_id = granules_cte.granule_cumulus_id
+        JOIN executions ON executions.cumulus_id = granules_executions.execution_cumulus_id
+        {}
+        ORDER BY granules_executions.granule_cumulus_id, executions.timestamp DESC, executions.cumulus_id
+        '''
+    ).format(get_filter_sql(where))
+
+
+GRANULE_RELATIONS = (
+    Relation(
+        'files', ('files',), True,
+        sql.SQL('files WHERE files.granule_cumulus_id = granules.cumulus_id'),
+        get_files_join,
+        get_files_stream
+    ),
+    Relation(
+        'executions', ('execution',), True,
+        sql.SQL(
+            '''
+            granules_executions
+            JOIN executions ON executions.cumulus_id = granules_executions.execution_cumulus_id
+            WHERE granules_executions.granule_cumulus_id = granules.cumulus_id
+            '''
+        ),
+        get_execution_join,
+        get_executions_stream
+    ),
+    Relation(
+        'providers', ('provider',), False,
+        sql.SQL('providers WHERE providers.cumulus_id = granules.provider_cumulus_id'),
+        get_provider_join
+    ),
+    Relation(
+        'collections', ('collection_id',), False,
+        sql.SQL('collections WHERE collections.cumulus_id = granules.collection_cumulus_id'),
+        get_collection_join
+    ),
+    Relation(
+        'pdrs', ('pdr_name',), False,
+        sql.SQL('pdrs WHERE pdrs.cumulus_id = granules.pdr_cumulus_id'),
+        get_pdr_join
+    )
+)
+
+
+class GranulePlan:
+    """
+    Logical plan of a granule query. It starts out joining every related table like the original builders, the
+    optimizer rules then remove joins and decide where each filter and join is placed.
+    """
+    def __init__(self, columns, limit, granules_where, relation_filters):
+        self.columns = columns if columns else '*'
+        self.projection = get_selected_names(columns)
+        self.limit = limit
+        self.granules_where = granules_where
+        self.relation_filters = relation_filters
+        self.joins = list(GRANULE_RELATIONS)
+        self.semi_joins = []
+        self.joined_filters = {}
+        self.use_cte = True
+        # Normalized plans return the granules in cumulus_id order and read the to-many relations in streams
+        self.streams = None
+
+    def __repr__(self):
+        return (
+            f'GranulePlan(joins={self.joins}, semi_joins={self.semi_joins}, '
+            f'cte={self.use_cte}, limit={self.limit}, streams={self.streams})'
+        )
+
+
+def get_selected_names(columns):
+    # None means every column is selected
+    if not columns or columns.strip() == '*':
+        return None
+    return {column.strip().split('.')[-1] for column in columns.split(',')}
+
+
+def build_logical_plan(columns='*', limit=10, granules_where='', **relation_filters):
+    unknown_keys = set(relation_filters) - {relation.where_key for relation in GRANULE_RELATIONS}
+    if unknown_keys:
+        raise ValueError(f'Unsupported granule query options: {", ".join(sorted(unknown_keys))}')
+
+    filters = {}
+    for relation in GRANULE_RELATIONS:
+        where = relation_filters.get(relation.where_key)
+        if where:
+            filters.update({relation.name: where})
+
+    return GranulePlan(columns, limit, granules_where, filters)
+
+
+def prune_joins(plan):
+    # A related table is only joined when one of its output columns is selected. The to-many relations of normalized
+    # plans are never joined.
+    if plan.projection is not None:
+        plan.joins = [
+            relation for relation in plan.joins if any(column in plan.projection for column in relation.columns)
+        ]
+    if plan.streams is not None:
+        plan.joins = [relation for relation in plan.joins if not relation.to_many]
+
+
+def is_index_friendly(relation, where):
+    catalog = get_schema_catalog()
+    return any(
+        catalog.is_indexed(relation.name, column)
+        for qualifier, column in get_column_references(where) if qualifier in (None, relation.name)
+    )
+
+
+def push_down_filters(plan):
+    # Filters on related tables become EXISTS semi-joins inside the granule scan so the limit is applied after every
+    # filter and before any join. A to-many relation that is also joined keeps its filter so only matching rows are
+    # aggregated. Filters that can use an index of their table are placed first.
+    for relation in GRANULE_RELATIONS:
+        where = plan.relation_filters.get(relation.name)
+        if where:
+            plan.semi_joins.append((relation, where))
+            if relation.to_many:
+                plan.joined_filters.update({relation.name: where})
+    plan.semi_joins.sort(key=lambda semi_join: not is_index_friendly(*semi_join))
+
+
+def choose_placement(plan):
+    # Without joins the granule rows are selected directly. The limited granule set is only needed as a CTE when
+    # joins or the granule_cumulus_id alias refer to it.
+    if not plan.joins and plan.projection is not None and 'granule_cumulus_id' not in plan.projection:
+        plan.use_cte = False
+
+
+OPTIMIZER_RULES = (prune_joins, push_down_filters, choose_placement)
+
+
+def optimize(plan):
+    for rule in OPTIMIZER_RULES:
+        rule(plan)
+    return plan
+
+
+def get_limit_sql(limit):
+    return sql.SQL('LIMIT {}').format(sql.Literal(int(limit))) if limit is not None and limit >= 0 else sql.SQL('')
+
+
+def get_order_sql(plan, column):
+    # Ordering before the limit also makes the limited granule set the same in every stream of a normalized plan
+    return sql.SQL('ORDER BY {}').format(sql.SQL(column)) if plan.streams is not None else sql.SQL('')
+
+
+def get_where_sql(plan):
+    filters = []
+    if plan.granules_where:
+        filters.append(sql.SQL('({})').format(as_sql(plan.granules_where)))
+    for relation, where in plan.semi_joins:
+        filters.append(sql.SQL('EXISTS (SELECT 1 FROM {} AND ({}))').format(relation.semi_join_sql, as_sql(where)))
+    return sql.SQL('WHERE {}').format(sql.SQL(' AND ').join(filters)) if filters else sql.SQL('')
+
+
+def compile_plan(plan):
+    where_sql = get_where_sql(plan)
+    order_sql = get_order_sql(plan, 'granules.cumulus_id')
+    if not plan.use_cte:
+        return sql.SQL('SELECT {} FROM granules {} {} {}').format(
+            sql.SQL(plan.columns), where_sql, order_sql, get_limit_sql(plan.limit)
+        )
+
+    # Every join returns at most one row per granule so the granule limit is the query limit
+    joins = [relation.join_sql(plan.joined_filters.get(relation.name, '')) for relation in plan.joins]
+    return sql.SQL(
+        '''
+        WITH granules_cte AS (
+            SELECT granules.cumulus_id AS granule_cumulus_id, granules.*
+            FROM granules
+            {}
+            {}
+            {}
+        )
+        SELECT {}
+        FROM granules_cte
+        {}
+        {}
+        '''
+    ).format(
+        where_sql, order_sql, get_limit_sql(plan.limit), sql.SQL(plan.columns), sql.SQL(' ').join(joins),
+        get_order_sql(plan, 'granules_cte.granule_cumulus_id')
+    )
+
+
+def compile_stream(plan, relation):
+    # Only the ids of the limited granule set are needed to read the rows of a to-many relation
+    return sql.SQL(
+        '''
+        WITH granules_cte AS (
+            SELECT granules.cumulus_id AS granule_cumulus_id
+            FROM granules
+            {}
+            {}
+            {}
+        )
+        {}
+        '''
+    ).format(
+        get_where_sql(plan), get_order_sql(plan, 'granules.cumulus_id'), get_limit_sql(plan.limit),
+        relation.stream_sql(plan.relation_filters.get(relation.name, ''))
+    )
+
+
+def plan_granules_query(**rds_config):
+    return compile_plan(optimize(build_logical_plan(**rds_config)))
+
+
+def get_stream_columns(columns, stream_columns):
+    # The to-many columns are left out of the granule rows, which always keep a key to correlate the streams with
+    selected = [column.strip() for column in columns.split(',') if column.strip().split('.')[-1] not in stream_columns]
+    if not {column.split('.')[-1] for column in selected} & {'cumulus_id', 'granule_cumulus_id'}:
+        selected.insert(0, 'granule_cumulus_id')
+    return ', '.join(selected)
+
+
+def plan_normalized_queries(tables=None, **rds_config):
+    """
+    Plans a granule query whose to-many relations are read as separate flat streams instead of being aggregated into
+    every granule row. Returns (table, query) pairs starting with the granules, in granule cumulus_id order, followed
+    by a stream for each of tables ordered by granule_cumulus_id. tables defaults to the to-many relations the
+    columns select.
+    """
+    plan = build_logical_plan(**rds_config)
+    stream_relations = {relation.name: relation for relation in GRANULE_RELATIONS if relation.to_many}
+    if tables is None:
+        tables = [
+            name for name, relation in stream_relations.items()
+            if plan.projection is None or any(column in plan.projection for column in relation.columns)
+        ]
+    unknown_tables = [table for table in tables if table not in stream_relations]
+    if unknown_tables:
+        raise ValueError(
+            f'Unsupported normalized tables: {", ".join(unknown_tables)}, expected: {", ".join(stream_relations)}'
+        )
+
+    if plan.projection is not None:
+        stream_columns = {column for relation in stream_relations.values() for column in relation.columns}
+        plan.columns = get_stream_columns(plan.columns, stream_columns)
+        plan.projection = get_selected_names(plan.columns)
+    plan.streams = [stream_relations.get(table) for table in tables]
+    optimize(plan)
+    return [('granules', compile_plan(plan))] + [
+        (relation.name, compile_stream(plan, relation)) for relation in plan.streams
+    ]
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from psycopg2 import sql
+
+from task.s3_json import get_json_object, object_exists, put_json_object
+
+CACHE_OPTION_KEYS = ('cache_max_age', 'cache_bypass')
+CACHED_RESULT_KEYS = (
+    'bucket', 'key', 'shards', 'streams', 'shard_count', 'count', 'records', 'raw_bytes', 'compressed_bytes'
+)
+
+# Entries already read or written by this warm container, checked before the S3 index
+local_index = {}
+local_index_lock = threading.Lock()
+
+
+def render_query(query):
+    """
+    Renders a psycopg2 sql object to text without a database connection so the cache can be checked before
+    connecting. The output is only used for hashing.
+    """
+    if isinstance(query, sql.Composed):
+        return ''.join(render_query(part) for part in query.seq)
+    elif isinstance(query, sql.Identifier):
+        return '.'.join('"{}"'.format(string.replace('"', '""')) for string in query.strings)
+    elif isinstance(query, sql.Literal):
+        return json.dumps(query.wrapped, default=str)
+    elif isinstance(query, sql.Placeholder):
+        return f'%({query.name})s' if query.name else '%s'
+    elif isinstance(query, sql.SQL):
+        return query.string
+    return str(query)
+
+
+def normalize_query(query):
+    return ' '.join(render_query(query).split())
+
+
+def get_cache_key(query_config, export_options):
+    """
+    Hashes the query options rather than the generated query, so a cache hit is found without the schema catalog or
+    a database connection. Whitespace in the SQL text options does not change the key.
+    """
+    query_options = {
+        key: normalize_query(value) if isinstance(value, (str, sql.Composable)) else value
+        for key, value in query_config.items()
+    }
+    output_options = {key: value for key, value in export_options.items() if key not in CACHE_OPTION_KEYS}
+    cache_source = json.dumps({'query': query_options, 'output': output_options}, sort_keys=True, default=str)
+    return hashlib.sha256(cache_source.encode()).hexdigest()
+
+
+def get_index_location(cache_key):
+    return os.getenv('BUCKET_NAME'), f'{os.getenv("S3_KEY_PREFIX")}result_cache/{cache_key}.json'
+
+
+def get_cache_max_age(export_options):
+    return int(export_options.get('cache_max_age', os.getenv('RESULT_CACHE_MAX_AGE', 0)))
+
+
+def get_cached_result(cache_key, max_age):
+    with local_index_lock:
+        entry = local_index.get(cache_key)
+    if not entry or time.time() - entry.get('created_at') > max_age:
+        entry = get_json_object(*get_index_location(cache_key))
+
+    if not entry or time.time() - entry.get('created_at') > max_age:
+        return None
+
+    # The results may have been removed by a lifecycle rule since the index entry was written
+    result = entry.get('result')
+    keys = [output.get('key') for output in result.get('shards') or result.get('streams') or []] or [result.get('key')]
+    if not all(object_exists(result.get('bucket'), key) for key in keys):
+        return None
+
+    with local_index_lock:
+        local_index.update({cache_key: entry})
+    return {**result, 'cache_age': round(time.time() - entry.get('created_at'), 3)}
+
+
+def put_cached_result(cache_key, handler_args):
+    result = {key: handler_args.get(key) for key in CACHED_RESULT_KEYS if key in handler_args}
+    if result.get('shards'):
+        result.update({'bucket': result.get('shards')[0].get('bucket')})
+    entry = {'created_at': time.time(), 'result': result}
+    put_json_object(*get_index_location(cache_key), entry)
+    with local_index_lock:
+        local_index.update({cache_key: entry})
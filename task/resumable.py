@@ -0,0 +1,192 @@
+import os
+import time
+
+from botocore.exceptions import ClientError
+from psycopg2 import sql
+
+from task.connection_manager import connection_manager
+from task.deadline import deadline
+from task.export import (
+    complete_upload, create_upload_handler, get_export_encoder_class, get_results_key, get_upload_options,
+    get_upload_stats, run_export
+)
+from task.fetch_sizing import get_fetch_options
+from task.metrics import metrics
+from task.parallel_scan import PARALLEL_SCAN_TABLES, add_range_filter
+from task.prepared_statements import execute_prepared
+from task.query_builders import temp_query_selection
+from task.query_modes import get_limit
+from task.upload_handlers import MPUHandler
+
+DEFAULT_PAGE_SIZE = 100000
+# Seconds left for finishing the current page, uploading the buffered parts and returning the continuation token
+DEFAULT_TIME_MARGIN = 60
+
+
+def get_resumable_options(export_options):
+    resumable = export_options.get('resumable')
+    return resumable if isinstance(resumable, dict) else {}
+
+
+def get_page_upper_bound(db_conn, table, last_key, page_size):
+    # Only reads the primary key index so finding the end of the next page is cheap however far into the table it is.
+    # Every page runs the same prepared statement.
+    with db_conn.cursor() as curs:
+        execute_prepared(
+            curs,
+            sql.SQL(
+                """
+                SELECT max(cumulus_id) FROM (
+                    SELECT cumulus_id FROM {} WHERE cumulus_id > {} ORDER BY cumulus_id LIMIT {}
+                ) AS page
+                """
+            ).format(sql.Identifier(table), sql.Literal(last_key), sql.Literal(page_size))
+        )
+        return curs.fetchone()[0]
+
+
+def get_pending_key(key, last_key):
+    # Named after the checkpoint so a retried invocation still finds the object of the token it was given
+    return f'{key}.pending_{last_key}'
+
+
+def read_pending(bucket, pending_key):
+    if not pending_key:
+        return b''
+    rsp = connection_manager.get_s3_client().get_object(Bucket=bucket, Key=pending_key)
+    return rsp.get('Body').read()
+
+
+def write_pending(bucket, pending_key, pending):
+    if not pending:
+        return None
+    connection_manager.get_s3_client().put_object(Bucket=bucket, Key=pending_key, Body=pending)
+    return pending_key
+
+
+def delete_pending(bucket, pending_key):
+    if not pending_key:
+        return
+    try:
+        connection_manager.get_s3_client().delete_object(Bucket=bucket, Key=pending_key)
+    except ClientError as e:
+        print(f'Unable to delete {pending_key}: {e}')
+
+
+def create_resumable_handler(token, handler_args, upload_options, encoder_class, export_options):
+    if not token:
+        return create_upload_handler(handler_args, upload_options, encoder_class, export_options)
+
+    upload_handler = MPUHandler(
+        **handler_args, **{**upload_options, 'part_size': token.get('part_size')}, upload_id=token.get('upload_id')
+    )
+    upload_handler.encoder_class = encoder_class
+    upload_handler.resume(
+        token.get('parts'), token.get('started'), token.get('raw_bytes'), token.get('stored_bytes'),
+        read_pending(token.get('bucket'), token.get('pending_key'))
+    )
+    return upload_handler
+
+
+def run_resumable_export(event, context, rds_config, query_config, export_options):
+    """
+    Exports the query one page of driving table cumulus_ids at a time, each page in its own short transaction. When
+    the lambda is about to run out of time the uploaded parts and the position are returned as a continuation token.
+    Invoking the lambda with {"continuation": <token>} resumes the same multipart upload and the final invocation
+    completes it. A failed invocation can be retried with the token it was given.
+    """
+    records = query_config.get('records')
+    if records not in PARALLEL_SCAN_TABLES:
+        raise ValueError(f'Resumable exports support the records: {", ".join(PARALLEL_SCAN_TABLES)}')
+    if export_options.get('export', 'cursor') != 'cursor' or export_options.get('format') == 'parquet':
+        raise ValueError('Resumable exports support the cursor export of the json, ndjson and csv formats')
+    if export_options.get('normalized') or export_options.get('incremental'):
+        raise ValueError('Resumable exports cannot be normalized or incremental')
+
+    encoder_class = get_export_encoder_class(export_options)
+    options = get_resumable_options(export_options)
+    page_size = options.get('page_size', DEFAULT_PAGE_SIZE)
+    time_margin = options.get('time_margin', DEFAULT_TIME_MARGIN)
+    fetch_options = get_fetch_options(event)
+    upload_options = get_upload_options(event, export_options)
+
+    token = event.get('continuation') or {}
+    if token:
+        handler_args = {'bucket': token.get('bucket'), 'key': token.get('key')}
+    else:
+        handler_args = {'bucket': os.getenv('BUCKET_NAME'), 'key': get_results_key(encoder_class, export_options)}
+    upload_handler = create_resumable_handler(token, handler_args, upload_options, encoder_class, export_options)
+
+    limit = get_limit(query_config)
+    last_key = token.get('last_key', 0)
+    count = token.get('count', 0)
+    complete = False
+    longest_page = 0
+    try:
+        with connection_manager.connection() as db_conn:
+            while deadline.has_time(longest_page, time_margin):
+                remaining_limit = limit - count if limit >= 0 else limit
+                if remaining_limit == 0:
+                    complete = True
+                    break
+
+                start = time.perf_counter()
+                with db_conn:
+                    upper_key = get_page_upper_bound(db_conn, records, last_key, page_size)
+                    if upper_key is None:
+                        complete = True
+                        break
+                    page_config = add_range_filter(
+                        records, {**query_config, 'limit': remaining_limit}, last_key + 1, upper_key + 1
+                    )
+                    with metrics.timer('build'):
+                        query = temp_query_selection(**page_config)
+                    _, rowcount, truncated = run_export(
+                        db_conn, query, upload_handler, export_options, fetch_options
+                    )
+                    if truncated:
+                        # The token can only point at the end of a page, so a partial page cannot be resumed
+                        raise RuntimeError(
+                            f'The page after cumulus_id {last_key} did not finish before the deadline, retry the '
+                            'token with a smaller page_size or a larger time_margin'
+                        )
+                count += rowcount
+                last_key = upper_key
+                longest_page = max(longest_page, time.perf_counter() - start)
+
+        if complete:
+            complete_upload(upload_handler)
+            delete_pending(handler_args.get('bucket'), token.get('pending_key'))
+            return {**handler_args, 'count': count, 'complete': True, **get_upload_stats(upload_handler)}
+
+        pending_key = write_pending(
+            handler_args.get('bucket'), get_pending_key(handler_args.get('key'), last_key), upload_handler.checkpoint()
+        )
+    except Exception:
+        # Without a token nothing can resume the upload. Otherwise the upload is kept so the token can be retried.
+        if not token:
+            upload_handler.abort_upload()
+        raise
+
+    if token.get('pending_key') != pending_key:
+        delete_pending(handler_args.get('bucket'), token.get('pending_key'))
+
+    return {
+        **handler_args,
+        'count': count,
+        'complete': False,
+        'continuation': {
+            **handler_args,
+            'rds_config': rds_config,
+            'upload_id': upload_handler.s3_mpu_dict.get('UploadId'),
+            'part_size': upload_handler.s3_part_size,
+            'parts': upload_handler.s3_parts,
+            'started': upload_handler.started,
+            'raw_bytes': upload_handler.raw_bytes,
+            'stored_bytes': upload_handler.stored_bytes,
+            'pending_key': pending_key,
+            'last_key': last_key,
+            'count': count,
+            'invocations': token.get('invocations', 0) + 1
+        }
+    }
@@ -0,0 +1,31 @@
+import json
+
+from botocore.exceptions import ClientError
+
+from task.connection_manager import connection_manager
+
+
+def get_json_object(bucket, key):
+    try:
+        rsp = connection_manager.get_s3_client().get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(rsp.get('Body').read())
+
+
+def put_json_object(bucket, key, value):
+    connection_manager.get_s3_client().put_object(
+        Bucket=bucket, Key=key, Body=json.dumps(value, default=str).encode(), ContentType='application/json'
+    )
+
+
+def object_exists(bucket, key):
+    try:
+        connection_manager.get_s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound'):
+            return False
+        raise
+    return True
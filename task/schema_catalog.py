@@ -0,0 +1,155 @@
+import os
+import re
+import threading
+
+import psycopg2
+from psycopg2 import sql
+
+from task.connection_manager import connection_manager
+from task.schema_snapshot import TABLE_COLUMNS, TABLE_INDEXES
+
+# Quoted literals are removed before looking for column references so values are never mistaken for columns
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+IDENTIFIER_PATTERN = re.compile(r'\b([a-z_][a-z0-9_]*)(?:\.([a-z_][a-z0-9_]*))?\b', re.IGNORECASE)
+
+
+class SchemaCatalog:
+    """
+    Columns and indexes of the Cumulus tables, from the live database or the bundled snapshot. Every lookup is a dict
+    or frozenset lookup so join decisions do not depend on the number of columns.
+    """
+    def __init__(self, table_columns, table_indexes, source):
+        self.source = source
+        self.table_columns = {table: frozenset(columns) for table, columns in table_columns.items()}
+        self.table_indexes = {table: dict(indexes) for table, indexes in table_indexes.items()}
+        column_tables = {}
+        for table, columns in self.table_columns.items():
+            for column in columns:
+                column_tables.setdefault(column, set()).add(table)
+        self.column_tables = {column: frozenset(tables) for column, tables in column_tables.items()}
+        # Only the leading column of an index can be used on its own to filter rows
+        self.indexed_columns = {
+            table: frozenset(columns[0] for columns in indexes.values() if columns)
+            for table, indexes in self.table_indexes.items()
+        }
+
+    def has_column(self, table, column):
+        return column in self.table_columns.get(table, ())
+
+    def get_tables(self, column):
+        return self.column_tables.get(column, frozenset())
+
+    def is_indexed(self, table, column):
+        return column in self.indexed_columns.get(table, ())
+
+    def __repr__(self):
+        return f'SchemaCatalog(source={self.source}, tables={len(self.table_columns)})'
+
+
+def get_column_references(text):
+    """
+    Returns the (table, column) pairs referenced in a column list or where clause. Unqualified names have no table.
+    Compiled filters are searched for their identifiers.
+    """
+    if isinstance(text, sql.Composed):
+        return set().union(*(get_column_references(part) for part in text.seq))
+    if isinstance(text, sql.Identifier):
+        names = [name.lower() for name in text.strings]
+        return {(names[-2], names[-1]) if len(names) > 1 else (None, names[0])}
+    if isinstance(text, sql.SQL):
+        text = text.string
+    elif isinstance(text, sql.Composable):
+        return set()
+
+    references = set()
+    for qualifier, name in IDENTIFIER_PATTERN.findall(LITERAL_PATTERN.sub('', text or '')):
+        references.add((qualifier.lower(), name.lower()) if name else (None, qualifier.lower()))
+    return references
+
+
+def introspect_schema(db_conn):
+    # Tables of every schema on the search path, the same tables the unqualified queries resolve to
+    with db_conn.cursor() as curs:
+        curs.execute(
+            """
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema = ANY(current_schemas(false))
+            ORDER BY table_name, ordinal_position
+            """
+        )
+        table_columns = {}
+        for table, column in curs.fetchall():
+            table_columns.setdefault(table, []).append(column)
+
+        curs.execute(
+            """
+            SELECT tables.relname, indexes.relname, array_agg(columns.attname ORDER BY keys.position)
+            FROM pg_index
+            JOIN pg_class AS tables ON tables.oid = pg_index.indrelid
+            JOIN pg_class AS indexes ON indexes.oid = pg_index.indexrelid
+            JOIN pg_namespace ON pg_namespace.oid = tables.relnamespace
+            CROSS JOIN LATERAL unnest(pg_index.indkey) WITH ORDINALITY AS keys(attnum, position)
+            JOIN pg_attribute AS columns ON columns.attrelid = tables.oid AND columns.attnum = keys.attnum
+            WHERE pg_namespace.nspname = ANY(current_schemas(false))
+            GROUP BY tables.relname, indexes.relname
+            """
+        )
+        table_indexes = {}
+        for table, index, columns in curs.fetchall():
+            table_indexes.setdefault(table, {}).update({index: tuple(columns)})
+
+    return table_columns, table_indexes
+
+
+SNAPSHOT_CATALOG = SchemaCatalog(TABLE_COLUMNS, TABLE_INDEXES, 'snapshot')
+
+_catalog = None
+_catalog_lock = threading.Lock()
+# Set when the introspection failed, the snapshot is then used until the next invocation tries again
+_introspection_failed = False
+
+
+def get_schema_catalog():
+    # Only the planner and the filters need the catalog, so a cached result is returned without connecting
+    return _catalog or load_schema_catalog()
+
+
+def retry_schema_introspection():
+    global _introspection_failed
+    _introspection_failed = False
+
+
+def load_schema_catalog():
+    """
+    Introspects the database the first time the catalog is needed in a container and caches the catalog for the warm
+    invocations that follow. SCHEMA_CATALOG=snapshot skips the introspection and uses the bundled snapshot. A failed
+    introspection falls back to the snapshot and is tried again by the next invocation.
+    """
+    global _catalog, _introspection_failed
+    with _catalog_lock:
+        if _catalog is not None:
+            return _catalog
+        if _introspection_failed:
+            return SNAPSHOT_CATALOG
+
+        if os.getenv('SCHEMA_CATALOG', 'live') == 'snapshot':
+            _catalog = SNAPSHOT_CATALOG
+            return _catalog
+
+        try:
+            with connection_manager.connection() as db_conn, db_conn:
+                table_columns, table_indexes = introspect_schema(db_conn)
+        except psycopg2.Error as e:
+            print(f'Schema introspection failed, using the bundled snapshot: {e}')
+            _introspection_failed = True
+            return SNAPSHOT_CATALOG
+
+        if not table_columns:
+            print('No tables found on the search path, using the bundled snapshot')
+            _introspection_failed = True
+            return SNAPSHOT_CATALOG
+
+        _catalog = SchemaCatalog(table_columns, table_indexes, 'database')
+        print(_catalog)
+        return _catalog
@@ -0,0 +1,196 @@
+"""
+Columns and indexes of the Cumulus tables, used by task.schema_catalog when the database cannot be introspected.
+Regenerate with task.schema_catalog.introspect_schema against an up to date Cumulus database after a schema migration.
+"""
+
+TABLE_COLUMNS = {
+    'async_operations': (
+        'cumulus_id',
+        'id',
+        'description',
+        'operation_type',
+        'output',
+        'status',
+        'task_arn',
+        'created_at',
+        'updated_at'
+    ),
+    'collections': (
+        'cumulus_id',
+        'name',
+        'version',
+        'sample_file_name',
+        'granule_id_validation_regex',
+        'granule_id_extraction_regex',
+        'files',
+        'process',
+        'url_path',
+        'duplicate_handling',
+        'report_to_ems',
+        'ignore_files_config_for_discovery',
+        'meta',
+        'tags',
+        'created_at',
+        'updated_at'
+    ),
+    'executions': (
+        'cumulus_id',
+        'arn',
+        'async_operation_cumulus_id',
+        'collection_cumulus_id',
+        'parent_cumulus_id',
+        'cumulus_version',
+        'url',
+        'status',
+        'tasks',
+        'error',
+        'workflow_name',
+        'duration',
+        'original_payload',
+        'final_payload',
+        'timestamp',
+        'created_at',
+        'updated_at'
+    ),
+    'files': (
+        'cumulus_id',
+        'granule_cumulus_id',
+        'created_at',
+        'updated_at',
+        'file_size',
+        'bucket',
+        'checksum_type',
+        'checksum_value',
+        'file_name',
+        'key',
+        'path',
+        'source',
+        'type'
+    ),
+    'granules': (
+        'cumulus_id',
+        'granule_id',
+        'status',
+        'collection_cumulus_id',
+        'created_at',
+        'updated_at',
+        'published',
+        'duration',
+        'time_to_archive',
+        'time_to_process',
+        'product_volume',
+        'error',
+        'cmr_link',
+        'pdr_cumulus_id',
+        'provider_cumulus_id',
+        'beginning_date_time',
+        'ending_date_time',
+        'last_update_date_time',
+        'processing_end_date_time',
+        'processing_start_date_time',
+        'production_date_time',
+        'query_fields',
+        'timestamp'
+    ),
+    'granules_executions': (
+        'granule_cumulus_id',
+        'execution_cumulus_id'
+    ),
+    'pdrs': (
+        'cumulus_id',
+        'collection_cumulus_id',
+        'provider_cumulus_id',
+        'execution_cumulus_id',
+        'status',
+        'name',
+        'progress',
+        'pan_sent',
+        'pan_message',
+        'stats',
+        'address',
+        'original_url',
+        'duration',
+        'timestamp',
+        'created_at',
+        'updated_at'
+    ),
+    'providers': (
+        'cumulus_id',
+        'name',
+        'protocol',
+        'host',
+        'port',
+        'username',
+        'password',
+        'global_connection_limit',
+        'private_key',
+        'cm_key_id',
+        'certificate_uri',
+        'created_at',
+        'updated_at',
+        'allowed_redirects',
+        'max_download_time'
+    ),
+    'rules': (
+        'cumulus_id',
+        'name',
+        'workflow',
+        'collection_cumulus_id',
+        'provider_cumulus_id',
+        'type',
+        'enabled',
+        'value',
+        'arn',
+        'log_event_arn',
+        'execution_name_prefix',
+        'payload',
+        'meta',
+        'tags',
+        'queue_url',
+        'created_at',
+        'updated_at'
+    )
+}
+
+TABLE_INDEXES = {
+    'async_operations': {
+        'async_operations_id_key': ('id',),
+        'async_operations_pkey': ('cumulus_id',)
+    },
+    'collections': {
+        'collections_name_version_key': ('name', 'version'),
+        'collections_pkey': ('cumulus_id',)
+    },
+    'executions': {
+        'executions_arn_key': ('arn',),
+        'executions_pkey': ('cumulus_id',)
+    },
+    'files': {
+        'files_bucket_key_key': ('bucket', 'key'),
+        'files_granule_cumulus_id_index': ('granule_cumulus_id',),
+        'files_pkey': ('cumulus_id',)
+    },
+    'granules': {
+        'granules_collection_cumulus_id_index': ('collection_cumulus_id',),
+        'granules_granule_id_collection_cumulus_id_key': ('granule_id', 'collection_cumulus_id'),
+        'granules_pkey': ('cumulus_id',),
+        'granules_status_index': ('status',),
+        'granules_updated_at_index': ('updated_at',)
+    },
+    'granules_executions': {
+        'granules_executions_execution_cumulus_id_index': ('execution_cumulus_id',),
+        'granules_executions_pkey': ('granule_cumulus_id', 'execution_cumulus_id')
+    },
+    'pdrs': {
+        'pdrs_name_key': ('name',),
+        'pdrs_pkey': ('cumulus_id',)
+    },
+    'providers': {
+        'providers_name_key': ('name',),
+        'providers_pkey': ('cumulus_id',)
+    },
+    'rules': {
+        'rules_name_key': ('name',),
+        'rules_pkey': ('cumulus_id',)
+    }
+}
@@ -0,0 +1,217 @@
+import csv
+import datetime
+import io
+import json
+
+# Postgres type OIDs reported in cursor.description
+BOOL_TYPE_CODE = 16
+JSON_TYPE_CODE = 114
+JSONB_TYPE_CODE = 3802
+TIMESTAMP_TYPE_CODE = 1114
+TIMESTAMPTZ_TYPE_CODE = 1184
+TIMESTAMP_TYPE_CODES = (TIMESTAMP_TYPE_CODE, TIMESTAMPTZ_TYPE_CODE)
+INTEGER_TYPE_CODES = (20, 21, 23)  # int8, int2, int4
+FLOAT_TYPE_CODES = (700, 701)  # float4, float8
+TEXT_TYPE_CODES = (19, 25, 1042, 1043, 2950)  # name, text, char, varchar, uuid
+ARRAY_TYPE_CODES = (1000, 1005, 1007, 1009, 1015, 1016)  # bool, int2, int4, text, varchar and int8 arrays
+
+
+def convert_timestamp(value, isoformat=datetime.datetime.isoformat):
+    # Same output as str(value) without the extra dispatch through datetime.__str__
+    return isoformat(value, ' ')
+
+
+def convert_bool(value):
+    return 'true' if value else 'false'
+
+
+def get_column_converter(type_code):
+    converter = None
+    if type_code in TIMESTAMP_TYPE_CODES:
+        converter = convert_timestamp
+    elif type_code == BOOL_TYPE_CODE:
+        converter = convert_bool
+
+    return converter
+
+
+class RowEncoderBase:
+    """
+    Encodes batches of cursor rows to bytes. prefix and suffix wrap the whole result and separator is written between
+    encoded batches.
+    """
+    prefix = b''
+    separator = b''
+    suffix = b''
+    extension = ''
+    # Record keys for column names, for example the Cumulus API field names. Applied once per cursor description.
+    key_map = None
+    # Converters for the values of named columns in place of the converter of their type, None leaves values as they are
+    column_converters = None
+
+    def __init__(self, description):
+        self.column_names = [column.name for column in description]
+        if self.key_map:
+            self.column_names = [self.key_map.get(name, name) for name in self.column_names]
+
+    def encode_rows(self, rows):
+        raise NotImplementedError
+
+
+class JSONRowEncoder(RowEncoderBase):
+    """
+    Encodes the records of a whole fetchmany batch at a time. The column names and the converters needed for each
+    column are worked out once from cursor.description.
+    """
+    prefix = b'['
+    separator = b', '
+    suffix = b']'
+    extension = 'json'
+
+    def __init__(self, description):
+        super().__init__(description)
+        self.converters = []
+        column_converters = self.column_converters or {}
+        for index, column in enumerate(description):
+            converter = column_converters.get(column.name, get_column_converter(column.type_code))
+            if converter:
+                self.converters.append((index, converter))
+        self.encoder = json.JSONEncoder()
+
+    def convert_rows(self, rows):
+        if not self.converters:
+            return rows
+
+        # Converting column by column keeps the converter lookup out of the inner loop
+        columns = list(zip(*rows))
+        for index, converter in self.converters:
+            columns[index] = [value if value is None else converter(value) for value in columns[index]]
+
+        return zip(*columns)
+
+    def encode_records(self, records):
+        # Encoding the list in a single call keeps the whole batch in the C encoder. The brackets are dropped so that
+        # consecutive batches can be joined with the separator.
+        return self.encoder.encode(records)[1:-1].encode()
+
+    def encode_rows(self, rows):
+        if not rows:
+            return b''
+        names = self.column_names
+        return self.encode_records([dict(zip(names, row)) for row in self.convert_rows(rows)])
+
+
+class PrerenderedJSONRowEncoder(RowEncoderBase):
+    """
+    Used when Postgres renders each row as JSON text (see query_builders.build_server_json_query) so the rows only
+    need to be joined. Rows Postgres cannot render exactly like JSONRowEncoder have a null json_row and carry the
+    column values instead, which are encoded by JSONRowEncoder. The framing matches JSONRowEncoder.
+    """
+    prefix = JSONRowEncoder.prefix
+    separator = JSONRowEncoder.separator
+    suffix = JSONRowEncoder.suffix
+    extension = JSONRowEncoder.extension
+
+    def __init__(self, description):
+        super().__init__(description)
+        self.fallback_encoder = JSONRowEncoder(description[1:])
+
+    def render_rows(self, rows):
+        fallback_rows = [row[1:] for row in rows if row[0] is None]
+        if not fallback_rows:
+            return [row[0] for row in rows]
+
+        encoder = self.fallback_encoder
+        names = encoder.column_names
+        encode = encoder.encoder.encode
+        records = iter([encode(dict(zip(names, row))) for row in encoder.convert_rows(fallback_rows)])
+        return [next(records) if row[0] is None else row[0] for row in rows]
+
+    def encode_rows(self, rows):
+        return self.separator.join([record.encode() for record in self.render_rows(rows)])
+
+
+class NDJSONRowEncoder(JSONRowEncoder):
+    """
+    Newline delimited JSON with one record per line. The records match JSONRowEncoder.
+    """
+    prefix = b''
+    separator = b''
+    suffix = b''
+    extension = 'ndjson'
+
+    def encode_records(self, records):
+        encode = self.encoder.encode
+        return ''.join([f'{encode(record)}\n' for record in records]).encode()
+
+
+class CSVRowEncoder(JSONRowEncoder):
+    """
+    CSV with a header row. Values are converted like JSONRowEncoder and json values are written as JSON text.
+    """
+    separator = b''
+    suffix = b''
+    extension = 'csv'
+
+    def __init__(self, description):
+        super().__init__(description)
+        self.prefix = self.write_csv([self.column_names]) if description else b''
+
+    @staticmethod
+    def write_csv(rows):
+        output = io.StringIO()
+        csv.writer(output, lineterminator='\n').writerows(rows)
+        return output.getvalue().encode()
+
+    @staticmethod
+    def convert_value(value):
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            # Columns whose converter keeps booleans for JSON output
+            value = convert_bool(value)
+        return value
+
+    def encode_rows(self, rows):
+        convert_value = self.convert_value
+        return self.write_csv([[convert_value(value) for value in row] for row in self.convert_rows(rows)])
+
+
+
+class PrerenderedNDJSONRowEncoder(PrerenderedJSONRowEncoder):
+    """
+    Newline delimited version of PrerenderedJSONRowEncoder.
+    """
+    prefix = NDJSONRowEncoder.prefix
+    separator = NDJSONRowEncoder.separator
+    suffix = NDJSONRowEncoder.suffix
+    extension = NDJSONRowEncoder.extension
+
+    def encode_rows(self, rows):
+        return ''.join([f'{record}\n' for record in self.render_rows(rows)]).encode()
+
+
+ROW_ENCODERS = {
+    'json': JSONRowEncoder,
+    'ndjson': NDJSONRowEncoder,
+    'csv': CSVRowEncoder
+}
+
+
+PRERENDERED_ROW_ENCODERS = {
+    'json': PrerenderedJSONRowEncoder,
+    'ndjson': PrerenderedNDJSONRowEncoder
+}
+
+
+def get_row_encoder_class(output_format='json', prerendered=False):
+    encoders = PRERENDERED_ROW_ENCODERS if prerendered else ROW_ENCODERS
+    encoder_class = encoders.get(output_format)
+    if not encoder_class:
+        raise ValueError(f'Unsupported format "{output_format}", expected one of: {", ".join(encoders)}')
+    return encoder_class
+
+
+def get_renamed_encoder_class(encoder_class, key_map, column_converters=None):
+    # A subclass keeps the prefix, suffix and extension of encoder_class for the upload handlers and results key
+    return type(encoder_class.__name__, (encoder_class,), {'key_map': key_map, 'column_converters': column_converters})
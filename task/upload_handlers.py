@@ -0,0 +1,594 @@
+import json
+import threading
+from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+
+from task.compression import get_compressor_class
+from task.connection_manager import connection_manager
+from task.metrics import metrics
+from task.s3_json import put_json_object
+from task.serializers import (
+    JSONRowEncoder, RowEncoderBase, BOOL_TYPE_CODE, JSON_TYPE_CODE, JSONB_TYPE_CODE, TIMESTAMP_TYPE_CODE,
+    TIMESTAMPTZ_TYPE_CODE
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is only available when pyarrow is provided, for example by a lambda layer
+    pyarrow = None
+
+S3_MIN_PART_SIZE = 5242880  # 5MB
+S3_DEFAULT_PART_SIZE = 20971520  # 20MB
+S3_MAX_PARTS = 10000
+# Columns whose range of values is recorded for each shard of a sharded output when no key_column is given
+SHARD_KEY_COLUMNS = ('cumulus_id', 'granule_id', 'name')
+
+
+class UploadHandlerBase(ABC):
+    # The encoder turns batches of cursor rows into bytes and can be swapped per handler class or instance
+    encoder_class = JSONRowEncoder
+    # raw_bytes grows with every handled batch, which lets the fetch size follow the serialized row width
+    serializes_batches = True
+
+    def get_encoder(self, description):
+        encoder = getattr(self, 'encoder', None)
+        if not encoder or getattr(self, 'encoder_description', None) is not description:
+            encoder = self.encoder_class(description)
+            self.encoder = encoder
+            self.encoder_description = description
+        return encoder
+
+    def handle_row(self, row, selected_columns):
+        self.handle_rows([row], selected_columns)
+
+    def write_stream(self, data):
+        # Appends already encoded output, such as COPY data, that includes its own framing
+        raise NotImplementedError
+
+    def handle_rows(self, rows, selected_columns):
+        raise NotImplementedError
+
+    def complete_upload(self):
+        raise NotImplementedError
+
+    def abort_upload(self):
+        # Called when the export fails so that nothing is left behind, only needed by handlers that upload in parts
+        pass
+
+
+def get_compressor(compression, compression_level):
+    compressor = None
+    if compression:
+        compressor = get_compressor_class(compression)(compression_level)
+    return compressor
+
+
+class MPUHandler(UploadHandlerBase):
+    def __init__(self, bucket, key, part_size=S3_DEFAULT_PART_SIZE, upload_workers=4, max_inflight_parts=None,
+                 max_inflight_bytes=None, compression=None, compression_level=None, upload_id=None):
+        if part_size < S3_MIN_PART_SIZE:
+            raise ValueError(f'part_size must be at least {S3_MIN_PART_SIZE} bytes: {part_size}')
+        self.s3_parts = []
+        self.s3_client = connection_manager.get_s3_client()
+        s3_dict = {'Bucket': bucket, 'Key': key}
+
+        # Serialized output is streamed through the compressor so part boundaries follow the compressed size
+        self.compressor = get_compressor(compression, compression_level)
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        if not upload_id:
+            mpu_args = {}
+            if self.compressor:
+                mpu_args.update({'ContentEncoding': self.compressor.content_encoding})
+            upload_id = self.s3_client.create_multipart_upload(**s3_dict, **mpu_args).get('UploadId')
+        s3_dict.update({'UploadId': upload_id})
+        self.s3_mpu_dict = s3_dict
+        self.aborted = False
+        self.s3_part_size = part_size
+        self.part_count = 0
+        self.encoder = None
+        self.started = False
+
+        # Rows are copied straight into a preallocated part sized buffer. Once it is full the buffer itself is handed
+        # to the uploader and a new one is allocated so every part is exactly part_size bytes apart from the last.
+        self.part_buffer = bytearray(part_size)
+        self.buffer_length = 0
+
+        # Parts are handed to a thread pool so the cursor keeps fetching while previous parts are uploaded. A
+        # upload_workers value of 0 uploads each part synchronously.
+        self.executor = None
+        if upload_workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='mpu-part')
+        self.max_inflight_parts = max_inflight_parts or max(upload_workers, 1) * 2
+        self.max_inflight_bytes = max_inflight_bytes or part_size * 2
+        self.inflight_parts = 0
+        self.inflight_bytes = 0
+        self.inflight_condition = threading.Condition()
+        self.part_futures = []
+
+    def handle_rows(self, rows, column_description):
+        if not rows:
+            return
+        encoder = self.get_encoder(column_description)
+        self.write(encoder.separator if self.started else encoder.prefix)
+        with metrics.timer('serialize'):
+            data = encoder.encode_rows(rows)
+        self.write(data)
+        self.started = True
+
+    def write_stream(self, data):
+        self.started = True
+        self.write(data)
+
+    def write(self, data):
+        self.raw_bytes += len(data)
+        if self.compressor:
+            with metrics.timer('compress'):
+                data = self.compressor.compress(data)
+        self.buffer_part_data(data)
+
+    def buffer_part_data(self, data):
+        self.stored_bytes += len(data)
+        view = memoryview(data)
+        while view:
+            space = self.s3_part_size - self.buffer_length
+            chunk = view[:space]
+            self.part_buffer[self.buffer_length:self.buffer_length + len(chunk)] = chunk
+            self.buffer_length += len(chunk)
+            view = view[len(chunk):]
+            if self.buffer_length == self.s3_part_size:
+                self.flush_part()
+
+    def flush_part(self, last_part=False):
+        if last_part and not self.buffer_length and self.part_count:
+            return
+        body = self.part_buffer
+        if last_part:
+            # Shrinks the buffer in place rather than copying the used bytes out of it
+            del body[self.buffer_length:]
+        else:
+            self.part_buffer = bytearray(self.s3_part_size)
+        self.buffer_length = 0
+        self.upload_part(body)
+
+    def upload_part(self, body):
+        self.part_count += 1
+        if self.part_count > S3_MAX_PARTS:
+            raise RuntimeError(f'Multipart uploads are limited to {S3_MAX_PARTS} parts, increase part_size')
+
+        if self.executor:
+            self.wait_for_capacity(len(body))
+            upload_part = metrics.bind(self.upload_part_background)
+            self.part_futures.append(self.executor.submit(upload_part, self.part_count, body))
+        else:
+            self.s3_parts.append(self.send_part(self.part_count, body))
+
+    def send_part(self, part_number, body):
+        part_number_dict = {'PartNumber': part_number}
+        mpu_upload_dict = {**part_number_dict, **self.s3_mpu_dict}
+        mpu_upload_dict.update({'Body': body})
+        with metrics.timer('part_upload'):
+            rsp = self.s3_client.upload_part(**mpu_upload_dict)
+        metrics.increment('parts')
+        part_number_dict.update({'ETag': rsp.get('ETag')})
+        return part_number_dict
+
+    def upload_part_background(self, part_number, body):
+        try:
+            return self.send_part(part_number, body)
+        finally:
+            with self.inflight_condition:
+                self.inflight_parts -= 1
+                self.inflight_bytes -= len(body)
+                self.inflight_condition.notify_all()
+
+    def wait_for_capacity(self, part_size):
+        with metrics.timer('upload_wait'), self.inflight_condition:
+            # A single part larger than the memory cap is still allowed through once nothing else is in flight
+            while self.inflight_parts and (
+                    self.inflight_parts >= self.max_inflight_parts or
+                    self.inflight_bytes + part_size > self.max_inflight_bytes
+            ):
+                self.raise_failed_part()
+                self.inflight_condition.wait()
+            self.inflight_parts += 1
+            self.inflight_bytes += part_size
+
+    def raise_failed_part(self):
+        for future in self.part_futures:
+            if future.done() and future.exception():
+                raise future.exception()
+
+    def wait_for_parts(self):
+        if self.executor:
+            try:
+                self.s3_parts.extend(future.result() for future in self.part_futures)
+            finally:
+                self.part_futures.clear()
+                self.executor.shutdown(wait=True)
+        self.s3_parts.sort(key=lambda part: part.get('PartNumber'))
+
+    def resume(self, parts, started, raw_bytes, stored_bytes, pending=b''):
+        """
+        Continues a multipart upload written by an earlier invocation. pending holds the output that was too small to be
+        uploaded as a part when that invocation stopped.
+        """
+        self.s3_parts = list(parts)
+        self.part_count = max((part.get('PartNumber') for part in self.s3_parts), default=0)
+        self.started = started
+        self.raw_bytes = raw_bytes
+        self.stored_bytes = stored_bytes
+        self.part_buffer[:len(pending)] = pending
+        self.buffer_length = len(pending)
+
+    def checkpoint(self):
+        """
+        Waits for every full part to be uploaded and returns the buffered output that is not part sized yet. The
+        compressed stream is ended so the next invocation can start a new one, gzip members and zstd frames can be
+        concatenated. The handler can not be written to afterwards.
+        """
+        if self.compressor:
+            with metrics.timer('compress'):
+                self.buffer_part_data(self.compressor.flush())
+        self.wait_for_parts()
+        return bytes(memoryview(self.part_buffer)[:self.buffer_length])
+
+    def abort_upload(self):
+        if self.aborted:
+            return
+        self.aborted = True
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self.s3_client.abort_multipart_upload(**self.s3_mpu_dict)
+
+    def complete_upload(self):
+        encoder = self.encoder or self.encoder_class([])
+        if not self.started:
+            self.write(encoder.prefix)
+        self.write(encoder.suffix)
+        if self.compressor:
+            with metrics.timer('compress'):
+                self.buffer_part_data(self.compressor.flush())
+        self.flush_part(last_part=True)
+        try:
+            self.wait_for_parts()
+        except Exception:
+            self.abort_upload()
+            raise
+
+        complete_mpu_dict = {
+            **self.s3_mpu_dict, **{
+                'MultipartUpload': {
+                    'Parts': self.s3_parts
+                }
+            }
+        }
+        return self.s3_client.complete_multipart_upload(**complete_mpu_dict)
+
+
+class UploadHandler(UploadHandlerBase):
+    # The body is only measured when the upload is completed
+    serializes_batches = False
+
+    def __init__(self, bucket, key, compression=None, compression_level=None):
+        self.s3_dict = {'Bucket': bucket, 'Key': key}
+        self.compressor = get_compressor(compression, compression_level)
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.body = bytearray()
+        self.encoder = None
+        self.started = False
+
+    def handle_rows(self, rows, selected_columns):
+        if rows:
+            encoder = self.get_encoder(selected_columns)
+            self.body += encoder.separator if self.started else encoder.prefix
+            self.body += encoder.encode_rows(rows)
+            self.started = True
+
+    def write_stream(self, data):
+        self.started = True
+        self.body += data
+
+    def complete_upload(self):
+        s3_client = connection_manager.get_s3_client()
+        encoder = self.encoder or self.encoder_class([])
+        if not self.started:
+            self.body += encoder.prefix
+        self.body += encoder.suffix
+        self.raw_bytes = len(self.body)
+        if self.compressor:
+            self.body = self.compressor.compress(self.body) + self.compressor.flush()
+            self.s3_dict.update({'ContentEncoding': self.compressor.content_encoding})
+        self.stored_bytes = len(self.body)
+        self.s3_dict.update({'Body': self.body})
+        return s3_client.put_object(**self.s3_dict)
+
+
+
+class ParquetSink:
+    """
+    Write only file-like object used by pyarrow.parquet.ParquetWriter that streams the Parquet file into a multipart
+    upload.
+    """
+    def __init__(self, upload_handler):
+        self.upload_handler = upload_handler
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.upload_handler.write_stream(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def get_arrow_column_types():
+    int_types = {20: pyarrow.int64(), 21: pyarrow.int16(), 23: pyarrow.int32()}
+    return {
+        BOOL_TYPE_CODE: pyarrow.bool_(),
+        **int_types,
+        700: pyarrow.float32(),
+        701: pyarrow.float64(),
+        1082: pyarrow.date32(),
+        TIMESTAMP_TYPE_CODE: pyarrow.timestamp('us'),
+        TIMESTAMPTZ_TYPE_CODE: pyarrow.timestamp('us', tz='UTC')
+    }
+
+
+def convert_to_json_string(value):
+    return value if value is None else json.dumps(value)
+
+
+def convert_to_string(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+class ParquetUploadHandler(UploadHandlerBase):
+    """
+    Builds Arrow record batches from the fetched rows using the column types in cursor.description and streams each
+    row group into a multipart upload, so memory is bounded by row_group_size rows. json and jsonb values, such as the
+    files json_agg, are stored as JSON strings and unknown types as their string representation.
+    """
+    extension = 'parquet'
+    # Rows are buffered into row groups so raw_bytes only grows when a row group is written
+    serializes_batches = False
+
+    def __init__(self, bucket, key, row_group_size=100000, compression=None, compression_level=None,
+                 **mpu_options):
+        if not pyarrow:
+            raise ValueError('Parquet output requires the pyarrow package')
+        self.mpu_handler = MPUHandler(bucket, key, **mpu_options)
+        # The Parquet file has its own framing and compression
+        self.mpu_handler.encoder_class = RowEncoderBase
+        self.row_group_size = row_group_size
+        self.parquet_compression = compression or 'snappy'
+        self.parquet_compression_level = compression_level
+        self.writer = None
+        self.schema = None
+        self.column_indexes = []
+        self.column_converters = []
+        self.rows = []
+        self.compressor = None
+
+    @property
+    def raw_bytes(self):
+        return self.mpu_handler.raw_bytes
+
+    @property
+    def stored_bytes(self):
+        return self.mpu_handler.stored_bytes
+
+    def create_writer(self, description):
+        # Duplicate column names keep the position of the first and the value of the last column like the JSON output
+        value_indexes = {}
+        for index, column in enumerate(description):
+            value_indexes.update({column.name: index})
+
+        column_types = get_arrow_column_types()
+        fields = []
+        for name, index in value_indexes.items():
+            type_code = description[index].type_code
+            arrow_type = column_types.get(type_code, pyarrow.string())
+            converter = None
+            if type_code in (JSON_TYPE_CODE, JSONB_TYPE_CODE):
+                converter = convert_to_json_string
+            elif type_code not in column_types:
+                converter = convert_to_string
+            fields.append(pyarrow.field(name, arrow_type))
+            self.column_indexes.append(index)
+            self.column_converters.append(converter)
+
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(
+            ParquetSink(self.mpu_handler), self.schema,
+            compression=self.parquet_compression, compression_level=self.parquet_compression_level
+        )
+
+    def write_row_group(self):
+        columns = list(zip(*self.rows))
+        arrays = []
+        for index, converter, field in zip(self.column_indexes, self.column_converters, self.schema):
+            values = columns[index]
+            if converter:
+                values = [converter(value) for value in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_batch(pyarrow.record_batch(arrays, schema=self.schema), row_group_size=self.row_group_size)
+        self.rows.clear()
+
+    def handle_rows(self, rows, selected_columns):
+        if not self.writer:
+            self.create_writer(selected_columns)
+
+        start = 0
+        while start < len(rows):
+            end = start + self.row_group_size - len(self.rows)
+            self.rows.extend(rows[start:end])
+            start = end
+            if len(self.rows) >= self.row_group_size:
+                with metrics.timer('serialize'):
+                    self.write_row_group()
+
+    def complete_upload(self):
+        if not self.writer:
+            # No rows were returned so an empty file without columns is written
+            self.create_writer([])
+        if self.rows:
+            with metrics.timer('serialize'):
+                self.write_row_group()
+        self.writer.close()
+        return self.mpu_handler.complete_upload()
+
+    def abort_upload(self):
+        self.mpu_handler.abort_upload()
+
+def get_sibling_key(key, suffix, extension=None):
+    # Adds suffix to the name of key before its extensions, which can be replaced with extension
+    directory, _, name = key.rpartition('/')
+    base, _, key_extension = name.partition('.')
+    return f'{directory}{"/" if directory else ""}{base}{suffix}.{extension or key_extension}'
+
+
+def get_shard_key(key, index, label='shard'):
+    return get_sibling_key(key, f'_{label}_{index:05d}')
+
+
+def get_manifest_key(key):
+    return get_sibling_key(key, '.manifest', 'json')
+
+
+class ShardedUploadHandler(UploadHandlerBase):
+    """
+    Splits the results into standalone objects that each hold a complete JSON array, NDJSON, CSV or Parquet file.
+    A new object is started once the current one holds max_rows rows or max_bytes serialized bytes. Rows are cut at
+    exactly max_rows but the byte limit is checked between fetched batches, so a shard can exceed it by one batch.
+    complete_upload writes a manifest listing the shard keys, row counts, sizes and the lowest and highest key_column
+    value of each shard. create_handler(key) returns the upload handler of a shard.
+    """
+    def __init__(self, bucket, key, create_handler, max_rows=None, max_bytes=None, key_column=None):
+        if not max_rows and not max_bytes:
+            raise ValueError('Sharded output requires a row or byte limit per shard')
+        self.bucket = bucket
+        self.key = key
+        self.manifest_key = get_manifest_key(key)
+        self.create_handler = create_handler
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.key_column = key_column
+        self.key_index = None
+        self.key_description = None
+        self.shards = []
+        self.completed_raw_bytes = 0
+        self.completed_stored_bytes = 0
+        self.handler = None
+        self.start_shard()
+        self.serializes_batches = self.handler.serializes_batches
+
+    @property
+    def raw_bytes(self):
+        return self.completed_raw_bytes + self.handler.raw_bytes
+
+    @property
+    def stored_bytes(self):
+        return self.completed_stored_bytes + self.handler.stored_bytes
+
+    @property
+    def compressor(self):
+        return self.handler.compressor
+
+    def start_shard(self):
+        key = get_shard_key(self.key, len(self.shards))
+        self.handler = self.create_handler(key)
+        self.shards.append({'key': key, 'count': 0, 'min_key': None, 'max_key': None})
+
+    def complete_shard(self):
+        self.handler.complete_upload()
+        self.completed_raw_bytes += self.handler.raw_bytes
+        self.completed_stored_bytes += self.handler.stored_bytes
+        self.shards[-1].update({'raw_bytes': self.handler.raw_bytes, 'stored_bytes': self.handler.stored_bytes})
+
+    def is_shard_full(self):
+        count = self.shards[-1].get('count')
+        return count and (
+            (self.max_rows and count >= self.max_rows) or (self.max_bytes and self.handler.raw_bytes >= self.max_bytes)
+        )
+
+    def get_key_index(self, description):
+        if description is not self.key_description:
+            names = [column.name for column in description]
+            if self.key_column:
+                if self.key_column not in names:
+                    raise ValueError(f'The shard key_column "{self.key_column}" is not a selected column')
+                self.key_index = names.index(self.key_column)
+            else:
+                self.key_index = next((names.index(name) for name in SHARD_KEY_COLUMNS if name in names), None)
+                self.key_column = names[self.key_index] if self.key_index is not None else None
+            self.key_description = description
+        return self.key_index
+
+    def update_key_range(self, rows, description):
+        key_index = self.get_key_index(description)
+        if key_index is None:
+            return
+        # The rows are not ordered so the bounds are the lowest and highest values rather than the first and last
+        values = [row[key_index] for row in rows if row[key_index] is not None]
+        if values:
+            shard = self.shards[-1]
+            low, high = min(values), max(values)
+            shard.update({
+                'min_key': low if shard.get('min_key') is None else min(shard.get('min_key'), low),
+                'max_key': high if shard.get('max_key') is None else max(shard.get('max_key'), high)
+            })
+
+    def handle_rows(self, rows, selected_columns):
+        start = 0
+        while start < len(rows):
+            if self.is_shard_full():
+                self.complete_shard()
+                self.start_shard()
+            end = len(rows)
+            if self.max_rows:
+                end = min(end, start + self.max_rows - self.shards[-1].get('count'))
+            shard_rows = rows[start:end] if start or end < len(rows) else rows
+            self.update_key_range(shard_rows, selected_columns)
+            self.handler.handle_rows(shard_rows, selected_columns)
+            self.shards[-1]['count'] += len(shard_rows)
+            start = end
+
+    def get_manifest(self):
+        return {
+            'bucket': self.bucket,
+            'key_column': self.key_column,
+            'count': sum(shard.get('count') for shard in self.shards),
+            'raw_bytes': self.completed_raw_bytes,
+            'stored_bytes': self.completed_stored_bytes,
+            'shards': self.shards
+        }
+
+    def complete_upload(self):
+        # An empty result still has one shard holding an empty array or file
+        self.complete_shard()
+        manifest = self.get_manifest()
+        put_json_object(self.bucket, self.manifest_key, manifest)
+        return manifest
+
+    def abort_upload(self):
+        # The completed shards are deleted too so a failed export leaves no results without a manifest behind
+        if 'raw_bytes' not in self.shards[-1]:
+            self.handler.abort_upload()
+        s3_client = connection_manager.get_s3_client()
+        for shard in self.shards:
+            if 'raw_bytes' in shard:
+                s3_client.delete_object(Bucket=self.bucket, Key=shard.get('key'))
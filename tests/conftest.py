@@ -0,0 +1,48 @@
+import os
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from benchmarks.fake_s3 import FakeS3Client
+from benchmarks.seed import seed
+from task.connection_manager import connection_manager
+
+# The tests that need Postgres seed a schema of their own so they can change rows without affecting the benchmarks
+TEST_GRANULES = 1500
+TEST_BUCKET = 'test-bucket'
+TEST_KEY_PREFIX = 'rds_lambda/'
+
+
+@pytest.fixture(scope='session')
+def db_params():
+    # Run against the BENCHMARK_DSN database of the benchmarks and skipped when it is not set
+    dsn = os.getenv('BENCHMARK_DSN')
+    if not dsn:
+        pytest.skip('BENCHMARK_DSN is not set')
+
+    db_conn = psycopg2.connect(dsn)
+    try:
+        schema, _ = seed(db_conn, TEST_GRANULES)
+    finally:
+        db_conn.close()
+    return {**extensions.parse_dsn(dsn), 'options': f'-c search_path={schema}'}
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('BUCKET_NAME', TEST_BUCKET)
+    monkeypatch.setenv('S3_KEY_PREFIX', TEST_KEY_PREFIX)
+    s3_client = FakeS3Client(keep_bodies=True)
+    connection_manager._clients.update({('s3', ()): s3_client})
+    yield s3_client
+    connection_manager.reset()
+
+
+@pytest.fixture
+def lambda_env(db_params, s3_client):
+    # The shared connection manager connects to the test schema and uploads to the in-process S3 stand-in
+    connection_manager.db_params_provider = lambda: db_params
+    yield s3_client
+    connection_manager.db_params_provider = None
+    connection_manager.reset()
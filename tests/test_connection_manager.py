@@ -0,0 +1,139 @@
+import threading
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from task.connection_manager import ConnectionManager, ManagedConnection
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.last_used = 0
+        self.rollbacks = 0
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class CountingProvider:
+    def __init__(self, *params):
+        self.params = list(params)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.params[min(self.calls, len(self.params)) - 1]
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = ConnectionManager(max_connections=2)
+    manager.db_params_provider = CountingProvider({'host': 'localhost'})
+    monkeypatch.setattr(manager, 'open_connection', FakeConnection)
+    yield manager
+    manager.reset()
+
+
+def test_db_params_are_cached_until_refreshed(manager):
+    assert manager.get_db_params() == {'host': 'localhost'}
+    manager.get_db_params()
+    assert manager.db_params_provider.calls == 1
+
+    manager.get_db_params(refresh=True)
+    assert manager.db_params_provider.calls == 2
+
+
+def test_db_params_expire_after_secrets_ttl(manager):
+    manager.secrets_ttl = 0
+    manager.get_db_params()
+    manager.get_db_params()
+    assert manager.db_params_provider.calls == 2
+
+
+def test_released_connection_is_reused(manager):
+    with manager.connection() as first_conn:
+        pass
+    with manager.connection() as second_conn:
+        pass
+
+    assert second_conn is first_conn
+    assert first_conn.rollbacks == 2
+
+
+def test_connection_is_discarded_after_operational_error(manager):
+    with pytest.raises(psycopg2.OperationalError):
+        with manager.connection() as first_conn:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+    with manager.connection() as second_conn:
+        pass
+
+    assert first_conn.closed
+    assert second_conn is not first_conn
+
+
+def test_connection_is_kept_after_query_error(manager):
+    with pytest.raises(psycopg2.ProgrammingError):
+        with manager.connection() as first_conn:
+            raise psycopg2.ProgrammingError('column "nonsense" does not exist')
+    with manager.connection() as second_conn:
+        pass
+
+    assert second_conn is first_conn
+
+
+def test_unhealthy_idle_connection_is_replaced(manager):
+    with manager.connection() as first_conn:
+        pass
+    first_conn.transaction_status = extensions.TRANSACTION_STATUS_INERROR
+    with manager.connection() as second_conn:
+        pass
+
+    assert first_conn.closed
+    assert second_conn is not first_conn
+
+
+def test_connections_are_limited_to_max_connections(manager):
+    acquired = threading.Event()
+    first_conn = manager.acquire()
+    second_conn = manager.acquire()
+
+    def acquire_third():
+        manager.release(manager.acquire())
+        acquired.set()
+
+    thread = threading.Thread(target=acquire_third)
+    thread.start()
+    assert not acquired.wait(0.2)
+    manager.release(first_conn)
+    assert acquired.wait(5)
+    thread.join()
+    manager.release(second_conn)
+
+
+def test_clients_are_shared_per_service_and_arguments(manager):
+    s3_client = manager.get_client('s3', region_name='us-west-2')
+    assert manager.get_client('s3', region_name='us-west-2') is s3_client
+    assert manager.get_client('s3', region_name='us-east-1') is not s3_client
+
+
+def test_failed_connect_retries_with_fresh_credentials(db_params):
+    # Port 1 refuses the connection like a rotated password would fail the login
+    manager = ConnectionManager()
+    manager.db_params_provider = CountingProvider({**db_params, 'port': 1}, db_params)
+    try:
+        with manager.connection() as db_conn, db_conn.cursor() as curs:
+            curs.execute('SELECT 1')
+            assert curs.fetchone() == (1,)
+        assert isinstance(db_conn, ManagedConnection)
+        assert manager.db_params_provider.calls == 2
+    finally:
+        manager.reset()
@@ -0,0 +1,82 @@
+import datetime
+import json
+from collections import namedtuple
+
+import pytest
+
+from task.serializers import CSVRowEncoder, JSONRowEncoder, get_renamed_encoder_class, get_row_encoder_class
+
+Column = namedtuple('Column', ['name', 'type_code'])
+
+DESCRIPTION = (
+    Column('cumulus_id', 20),
+    Column('granule_id', 25),
+    Column('published', 16),
+    Column('created_at', 1184),
+    Column('duration', 701),
+    Column('error', 3802),
+    Column('files', 114)
+)
+TIMESTAMP = datetime.datetime(2023, 9, 7, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+ROWS = [
+    (1, 'granule_1', True, TIMESTAMP, 12.5, None, [{'bucket': 'protected', 'key': 'granule_1.nc', 'size': 1048576}]),
+    (2, 'granule_"2"\n', False, None, 0.1, {'Error': 'FileNotFound', 'Cause': 'ünïcode'}, []),
+    (3, None, None, TIMESTAMP.replace(microsecond=0), None, None, None)
+]
+
+
+def encode_row(row):
+    # The per-row encoding the batched encoders replace
+    record = {}
+    for column, value in zip(DESCRIPTION, row):
+        if isinstance(value, datetime.datetime):
+            value = str(value)
+        elif isinstance(value, bool):
+            value = json.dumps(value)
+        record.update({column.name: value})
+    return json.dumps(record)
+
+
+def encode(encoder, batches):
+    return encoder.prefix + encoder.separator.join(encoder.encode_rows(rows) for rows in batches) + encoder.suffix
+
+
+def test_json_encoder_matches_per_row_encoding():
+    encoder = JSONRowEncoder(DESCRIPTION)
+    assert encode(encoder, [ROWS]) == f'[{", ".join(encode_row(row) for row in ROWS)}]'.encode()
+
+
+def test_json_batches_join_into_one_document():
+    encoder = JSONRowEncoder(DESCRIPTION)
+    assert encode(encoder, [ROWS[:1], ROWS[1:]]) == encode(encoder, [ROWS])
+    assert len(json.loads(encode(encoder, [ROWS[:1], ROWS[1:]]))) == len(ROWS)
+
+
+def test_empty_batch_encodes_to_nothing():
+    assert JSONRowEncoder(DESCRIPTION).encode_rows([]) == b''
+
+
+def test_csv_encoder_writes_header_and_json_text():
+    encoder = CSVRowEncoder(DESCRIPTION)
+    lines = encode(encoder, [ROWS[:1]]).decode().splitlines()
+    assert lines[0] == 'cumulus_id,granule_id,published,created_at,duration,error,files'
+    assert lines[1] == (
+        '1,granule_1,true,2023-09-07 12:30:15.123456+00:00,12.5,,'
+        '"[{""bucket"": ""protected"", ""key"": ""granule_1.nc"", ""size"": 1048576}]"'
+    )
+
+
+def test_renamed_encoder_maps_keys_and_converts_columns():
+    encoder_class = get_renamed_encoder_class(
+        JSONRowEncoder, {'granule_id': 'granuleId', 'created_at': 'createdAt'}, {'published': None}
+    )
+    records = json.loads(encode(encoder_class(DESCRIPTION), [ROWS]))
+    assert records[0]['granuleId'] == 'granule_1'
+    assert records[0]['createdAt'] == '2023-09-07 12:30:15.123456+00:00'
+    assert records[0]['published'] is True
+    assert encoder_class.extension == 'json'
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError, match='Unsupported format "xml"'):
+        get_row_encoder_class('xml')
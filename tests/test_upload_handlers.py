@@ -0,0 +1,90 @@
+import random
+
+import pytest
+from botocore.exceptions import ClientError
+
+from task.serializers import NDJSONRowEncoder
+from task.upload_handlers import S3_MIN_PART_SIZE, MPUHandler
+
+PART_SIZE = S3_MIN_PART_SIZE
+
+
+def record_part_sizes(s3_client, monkeypatch):
+    part_sizes = {}
+    upload_part = s3_client.upload_part
+
+    def recording_upload_part(**kwargs):
+        part_sizes.update({kwargs.get('PartNumber'): len(kwargs.get('Body'))})
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(s3_client, 'upload_part', recording_upload_part)
+    return part_sizes
+
+
+def write_chunks(upload_handler, data):
+    # Chunks of uneven sizes so part boundaries fall inside them
+    chunk_sizes = random.Random(7)
+    position = 0
+    while position < len(data):
+        size = chunk_sizes.randint(1, PART_SIZE // 3)
+        upload_handler.write_stream(data[position:position + size])
+        position += size
+
+
+def create_handler(upload_workers=0, **kwargs):
+    upload_handler = MPUHandler('test-bucket', 'results.ndjson', part_size=PART_SIZE, upload_workers=upload_workers,
+                                **kwargs)
+    upload_handler.encoder_class = NDJSONRowEncoder
+    return upload_handler
+
+
+@pytest.mark.parametrize('upload_workers, max_inflight_parts', [(0, None), (2, None), (2, 1)])
+def test_parts_are_exactly_part_size_apart_from_the_last(s3_client, monkeypatch, upload_workers, max_inflight_parts):
+    part_sizes = record_part_sizes(s3_client, monkeypatch)
+    data = bytes(random.Random(1).getrandbits(8) for _ in range(PART_SIZE * 2 + 12345))
+    upload_handler = create_handler(upload_workers, max_inflight_parts=max_inflight_parts)
+    write_chunks(upload_handler, data)
+    upload_handler.complete_upload()
+
+    assert part_sizes == {1: PART_SIZE, 2: PART_SIZE, 3: 12345}
+    assert s3_client.get_body('test-bucket', 'results.ndjson') == data
+    assert upload_handler.raw_bytes == upload_handler.stored_bytes == len(data)
+
+
+def test_output_ending_on_a_part_boundary_has_no_empty_part(s3_client, monkeypatch):
+    part_sizes = record_part_sizes(s3_client, monkeypatch)
+    upload_handler = create_handler()
+    write_chunks(upload_handler, b'x' * PART_SIZE * 2)
+    upload_handler.complete_upload()
+
+    assert part_sizes == {1: PART_SIZE, 2: PART_SIZE}
+
+
+def test_empty_json_output_is_an_empty_array(s3_client):
+    upload_handler = MPUHandler('test-bucket', 'results.json', part_size=PART_SIZE)
+    upload_handler.complete_upload()
+
+    assert s3_client.get_body('test-bucket', 'results.json') == b'[]'
+
+
+def test_part_size_below_the_s3_minimum_is_rejected(s3_client):
+    with pytest.raises(ValueError, match='part_size must be at least'):
+        MPUHandler('test-bucket', 'results.json', part_size=PART_SIZE - 1)
+
+
+def test_failed_part_aborts_the_upload(s3_client, monkeypatch):
+    upload_part = s3_client.upload_part
+
+    def failing_upload_part(**kwargs):
+        if kwargs.get('PartNumber') == 2:
+            raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow Down'}}, 'UploadPart')
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(s3_client, 'upload_part', failing_upload_part)
+    upload_handler = create_handler(upload_workers=2)
+    write_chunks(upload_handler, b'x' * (PART_SIZE * 2 + 1))
+    with pytest.raises(ClientError):
+        upload_handler.complete_upload()
+
+    assert not s3_client.uploads
+    assert ('test-bucket', 'results.ndjson') not in s3_client.objects